@@ -39,6 +39,7 @@ import biothings.hub.databuild.syncer as syncer
 import biothings.hub.dataindex.indexer as indexer
 from hub.databuild.builder import MyChemDataBuilder
 from hub.dataindex.indexer import DrugIndexer
+from hub.dataload.crosswalk import update_crosswalk
 
 shell = HubShell(job_manager)
 
@@ -80,6 +81,8 @@ COMMANDS["dump_all"] = dump_manager.dump_all
 # upload commands
 COMMANDS["upload"] = upload_manager.upload_src
 COMMANDS["upload_all"] = upload_manager.upload_all
+# identifiers crosswalk used by dependent uploaders
+COMMANDS["crosswalk"] = partial(update_crosswalk,job_manager)
 # building/merging
 COMMANDS["whatsnew"] = partial(build_manager.whatsnew,"drug")
 COMMANDS["lsmerge"] = build_manager.list_merge
@@ -207,3 +207,7 @@ RELEASE_PATH = ConfigurationError("Define path to folder which will contain outp
 # Usually inside DATA_ARCHIVE_ROOT
 #RELEASE_PATH = os.path.join(DATA_ARCHIVE_ROOT,"release")
 
+# Path to SQLite file holding the identifiers crosswalk (see hub.dataload.crosswalk)
+# Optional, defaults to DATA_ARCHIVE_ROOT/crosswalk.sqlite
+#CROSSWALK_FILE = os.path.join(DATA_ARCHIVE_ROOT,"crosswalk.sqlite")
+
@@ -10,9 +10,11 @@ __sources_dict__ = [
         'hub.dataload.sources.sider',
         'hub.dataload.sources.ndc',
 
+        # manually dumped
+        'hub.dataload.sources.drugcentral',
+
         # collection-only
         'hub.dataload.sources.ginas',
         'hub.dataload.sources.aeolus',
-        'hub.dataload.sources.drugcentral',
     ]
 
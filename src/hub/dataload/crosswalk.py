@@ -0,0 +1,244 @@
+"""
+Identifier crosswalk: maps identifiers found in core sources (drugbank, chembl,
+pubchem, chebi, unii) to InChIKeys. It's built from source collections into a
+local SQLite file, so dependent uploaders can resolve identifiers without
+querying MongoDB. It's rebuilt when one of these sources is uploaded again,
+either from the "crosswalk" hub command or by the first uploader needing it.
+"""
+import os
+import json
+import fcntl
+import sqlite3
+import asyncio
+import threading
+import logging
+
+import config
+from biothings.utils.common import iter_n
+from biothings.utils.mongo import get_src_db
+from biothings.utils.hub_db import get_src_dump
+
+# id type => list of (collection, field holding id, field holding InChIKey),
+# in order of preference (first source with a match wins)
+CROSSWALK_SOURCES = {
+        "drugbank" : [("drugbank","drugbank.drugbank_id","drugbank.inchi_key")],
+        "drugbank_accession" : [("drugbank","drugbank.accession_number","drugbank.inchi_key")],
+        "chembl" : [("chembl","chembl.molecule_chembl_id","chembl.inchi_key")],
+        "pubchem" : [("pubchem","pubchem.cid","pubchem.inchi_key")],
+        "ndc" : [("drugbank","drugbank.products.ndc_product_code","drugbank.inchi_key")],
+        "chebi" : [("chebi","chebi.chebi_id","chebi.inchikey")],
+        "unii" : [("unii","unii.unii","unii.inchikey")],
+        # ChEBI ids (without "CHEBI:" prefix) found in other sources, used
+        # by fused chebi-short -> inchikey edges
+        "drugbank_chebi" : [("drugbank","drugbank.chebi","drugbank.inchi_key")],
+        "chembl_chebi" : [("chembl","chembl.chebi_par_id","chembl.inchi_key")],
+        }
+
+# bumped when the SQLite schema changes, forcing a rebuild
+CROSSWALK_VERSION = 2
+
+# max number of SQL variables in a query
+QUERY_CHUNK_SIZE = 500
+
+logger = logging.getLogger("crosswalk")
+
+
+def get_crosswalk_file():
+    return getattr(config,"CROSSWALK_FILE",None) or \
+            os.path.join(config.DATA_ARCHIVE_ROOT,"crosswalk.sqlite")
+
+def get_values(doc, path):
+    """Return all values found in doc following dotted path, through lists"""
+    values = [doc]
+    for key in path.split("."):
+        found = []
+        for value in values:
+            for val in (isinstance(value,list) and value or [value]):
+                if isinstance(val,dict) and key in val:
+                    found.append(val[key])
+        values = found
+    res = []
+    for value in values:
+        res.extend(isinstance(value,list) and value or [value])
+    return [val for val in res if val not in (None,"")]
+
+def get_id_type(col_name, id_field, ik_field):
+    """Return id type built from InChIKeys in ik_field, for ids in id_field of col_name, or None"""
+    for id_type,sources in sorted(CROSSWALK_SOURCES.items()):
+        if (col_name,id_field,ik_field) in sources:
+            return id_type
+
+def get_sources_signature(current=None):
+    """
+    Return release and upload date of the last successful upload, for all
+    collections the crosswalk is built from, used to know if it needs to be
+    rebuilt. While a source is being uploaded (or if its upload failed), its
+    collection is still the one from the last successful upload, but src_dump
+    doesn't hold this upload anymore: value from current signature (the one
+    of the existing crosswalk) is kept, if any.
+    """
+    current = current or {}
+    src_dump = get_src_dump()
+    sig = {}
+    cols = sorted(set([src[0] for srcs in CROSSWALK_SOURCES.values() for src in srcs]))
+    for col in cols:
+        doc = src_dump.find_one({"_id":col}) or {}
+        job = doc.get("upload",{}).get("jobs",{}).get(col,{})
+        if job.get("status") == "success":
+            sig[col] = [job.get("release"),str(job.get("started_at"))]
+        else:
+            sig[col] = current.get(col)
+    # new id types also require a rebuild
+    sig["_id_types"] = sorted(CROSSWALK_SOURCES)
+    sig["_version"] = CROSSWALK_VERSION
+    return sig
+
+def is_uptodate(crosswalk):
+    """Return True if crosswalk was built from current source collections"""
+    signature = crosswalk.signature
+    return signature == get_sources_signature(signature)
+
+def build_crosswalk(path, signature, src_db=None):
+    """
+    Scan source collections and store (id type, id, InChIKey) triplets in SQLite
+    file path. File is written aside then renamed, so readers never see a partial one.
+    """
+    src_db = src_db or get_src_db()
+    tmp_path = "%s.%s.tmp" % (path,os.getpid())
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    # seq keeps scan order, so ties between InChIKeys of the same rank go to
+    # the first one found in the source collection
+    conn.execute("CREATE TABLE xref (id_type TEXT, id TEXT, inchikey TEXT, rank INTEGER, seq INTEGER, " + \
+                 "PRIMARY KEY (id_type,id,inchikey)) WITHOUT ROWID")
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    for id_type,sources in sorted(CROSSWALK_SOURCES.items()):
+        for rank,(col_name,id_field,ik_field) in enumerate(sources):
+            cur = src_db[col_name].find({id_field:{"$exists":True},ik_field:{"$exists":True}},
+                                        {id_field:1,ik_field:1})
+            cnt = 0
+            for docs in iter_n(cur,10000):
+                rows = []
+                for doc in docs:
+                    for ik in get_values(doc,ik_field):
+                        for _id in get_values(doc,id_field):
+                            rows.append((id_type,str(_id),ik,rank,cnt + len(rows)))
+                conn.executemany("INSERT OR IGNORE INTO xref VALUES (?,?,?,?,?)",rows)
+                cnt += len(rows)
+            logger.info("Crosswalk '%s': %s identifiers from '%s'" % (id_type,cnt,col_name))
+    conn.execute("INSERT INTO meta VALUES (?,?)",("signature",json.dumps(signature,sort_keys=True)))
+    conn.commit()
+    conn.close()
+    os.rename(tmp_path,path)
+
+
+class Crosswalk(object):
+
+    def __init__(self, path):
+        self.path = path
+        # sqlite connections can't be shared between threads (crosswalk
+        # object is cached and used by uploaders running in hub's threads),
+        # each thread gets its own
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        conn = getattr(self._local,"conn",None)
+        if conn is None:
+            # crosswalk is only written by build_crosswalk()
+            conn = self._local.conn = sqlite3.connect("file:%s?mode=ro" % self.path,uri=True)
+        return conn
+
+    def __getstate__(self):
+        # sqlite connections can't be pickled
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def signature(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+        return row and json.loads(row[0])
+
+    def lookup(self, id_type, ids):
+        """
+        Return a dict mapping each id found in ids to its InChIKeys (list)
+        """
+        res = {}
+        # ids are stored as strings, keep track of the original values
+        wanted = {}
+        for _id in ids:
+            wanted.setdefault(str(_id),[]).append(_id)
+        for chunk in iter_n(list(wanted),QUERY_CHUNK_SIZE):
+            query = "SELECT id, inchikey, rank FROM xref WHERE id_type = ? AND id IN (%s) ORDER BY rank, seq" % \
+                    ",".join(["?"] * len(chunk))
+            best = {}
+            for _id,ik,rank in self.conn.execute(query,[id_type] + list(chunk)):
+                # only keep InChIKeys from the preferred source
+                if best.setdefault(_id,rank) == rank:
+                    for orig_id in wanted[_id]:
+                        res.setdefault(orig_id,[]).append(ik)
+        return res
+
+    def get(self, id_type, _id):
+        """Return first InChIKey found for _id, or None"""
+        return self.lookup(id_type,[_id]).get(_id,[None])[0]
+
+    def count(self, id_type):
+        """Return the number of (id, InChIKey) pairs known for id_type"""
+        return self.conn.execute("SELECT count(*) FROM xref WHERE id_type = ?",(id_type,)).fetchone()[0]
+
+    def get_map(self, id_type):
+        """Return a dict mapping all known ids of id_type to an InChIKey"""
+        res = {}
+        for _id,ik in self.conn.execute("SELECT id, inchikey FROM xref WHERE id_type = ? ORDER BY rank, seq",(id_type,)):
+            res.setdefault(_id,ik)
+        return res
+
+
+_crosswalk = None
+
+def get_crosswalk(build=True):
+    """
+    Return the Crosswalk object, (re)building it first if it's missing or if one
+    of the sources it's built from was uploaded since. If build is False, None is
+    returned instead of building it. Builds are serialized with a lock file, so
+    concurrent uploaders wait for the first one instead of all rebuilding it.
+    """
+    global _crosswalk
+    if _crosswalk is not None and is_uptodate(_crosswalk):
+        return _crosswalk
+    path = get_crosswalk_file()
+    if os.path.exists(path) and is_uptodate(Crosswalk(path)):
+        _crosswalk = Crosswalk(path)
+        return _crosswalk
+    if not build:
+        return None
+    with open(path + ".lock","w") as lockf:
+        fcntl.flock(lockf,fcntl.LOCK_EX)
+        try:
+            # may have been built while waiting for the lock
+            if not (os.path.exists(path) and is_uptodate(Crosswalk(path))):
+                logger.info("Building identifier crosswalk '%s'" % path)
+                current = os.path.exists(path) and Crosswalk(path).signature or None
+                build_crosswalk(path,get_sources_signature(current))
+        finally:
+            fcntl.flock(lockf,fcntl.LOCK_UN)
+    _crosswalk = Crosswalk(path)
+    return _crosswalk
+
+def update_crosswalk(job_manager):
+    """
+    Hub command (re)building the crosswalk if needed, in a thread, so it
+    can be done once core sources are uploaded, before dependent uploaders run
+    """
+    pinfo = {"category" : "crosswalk",
+             "source" : None,
+             "step" : "build",
+             "description" : get_crosswalk_file()}
+    return asyncio.ensure_future(job_manager.defer_to_thread(pinfo,get_crosswalk))
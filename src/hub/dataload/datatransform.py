@@ -0,0 +1,203 @@
+import time
+import collections
+
+from biothings.hub.datatransform import DataTransformMDB, DataTransformEdge, IDStruct, MongoDBEdge
+
+from hub.dataload.crosswalk import get_crosswalk, get_id_type
+
+
+class BatchedDataTransformMDB(DataTransformMDB):
+    """
+    DataTransformMDB resolving identifiers for blocks of block_size documents
+    at once: each edge of the graph is followed with a single "$in" query over
+    all the identifiers found in the block, instead of one query for every
+    few hundred documents.
+    """
+
+    # number of documents buffered and resolved together
+    block_size = 5000
+
+    def __init__(self, graph, *args, block_size=None, **kwargs):
+        super(BatchedDataTransformMDB,self).__init__(graph, *args, **kwargs)
+        self.block_size = block_size or self.__class__.block_size
+        # DataTransform splits batch_size among input types, so blocks
+        # hold block_size docs whatever the number of input types
+        self.batch_size = self.block_size * len(self.input_types)
+
+    def _precompute_paths(self):
+        super(BatchedDataTransformMDB,self)._precompute_paths()
+        # paths are followed on a copy of the graph, extended with fused edges
+        self.graph = self.graph.copy()
+        for key,paths in self.paths.items():
+            self.paths[key] = tuple([self._fuse_path(path) for path in paths])
+
+    def _fuse_path(self, path):
+        """
+        Return path where consecutive hops querying the same collection (ex:
+        "chebi-short -> drugbank -> inchikey", both from drugbank collection) are
+        replaced by a single edge, so the collection is queried only once and
+        intermediate identifiers aren't looked up. Fused edges are cached, and a
+        hop resolved from the crosswalk is only fused if the crosswalk also holds
+        the fused mapping (it's kept as is otherwise).
+        """
+        path = list(path)
+        i = 0
+        while i < len(path) - 2:
+            edge1,xwalk1 = unwrap_edge(self.graph.edges[path[i],path[i+1]]["object"])
+            edge2,xwalk2 = unwrap_edge(self.graph.edges[path[i+1],path[i+2]]["object"])
+            if edge1 and edge2 and not xwalk1 and edge1.collection_name == edge2.collection_name \
+                    and edge1.field == edge2.lookup:
+                id_type = xwalk2 and get_id_type(edge1.collection_name,edge1.lookup,edge2.field)
+                if not xwalk2 or id_type:
+                    fused = "%s>%s" % (path[i],path[i+1])
+                    if not self.graph.has_edge(fused,path[i+2]):
+                        edge = MongoDBEdge(edge1.collection_name,edge1.lookup,edge2.field,
+                                           weight=edge1.weight + edge2.weight,check_index=False)
+                        if id_type:
+                            edge = CrosswalkEdge(id_type,edge)
+                        self.graph.add_edge(fused,path[i+2],object=CachedEdge(edge))
+                    if i > 0 and not self.graph.has_edge(path[i-1],fused):
+                        # fused vertex holds the same ids as path[i], it's reached the same way
+                        self.graph.add_edge(path[i-1],fused,object=self.graph.edges[path[i-1],path[i]]["object"])
+                    path[i:i+2] = [fused]
+                    continue
+            i += 1
+        return tuple(path)
+
+    def __call__(self, func, debug=None):
+        wrapped_f = super(BatchedDataTransformMDB,self).__call__(func,debug)
+        def cached_f(*args):
+            edges = []
+            for vert1,vert2,data in self.graph.edges(data=True):
+                # edges leading to fused vertices are shared with the original ones
+                if isinstance(data["object"],CachedEdge) and \
+                        not [edge for _,_,edge in edges if edge is data["object"]]:
+                    edges.append((vert1,vert2,data["object"]))
+            # caches and counters are for this call only (sources may have changed since)
+            for _,_,edge in edges:
+                edge.reset()
+            # crosswalk is checked once for the whole call, not for each lookup
+            crosswalk = get_crosswalk(build=False)
+            for _,_,data in self.graph.edges(data=True):
+                edge = data["object"]
+                edge = isinstance(edge,CachedEdge) and edge.edge or edge
+                if isinstance(edge,CrosswalkEdge):
+                    edge.set_crosswalk(crosswalk)
+            for doc in wrapped_f(*args):
+                yield doc
+            # decorated function is usually an uploader's load_data(), log in its logger
+            logger = args and getattr(args[0],"logger",None) or self.logger
+            for vert1,vert2,edge in edges:
+                if edge.stats["hits"] or edge.stats["misses"]:
+                    logger.info("Edge %s -> %s: %s" % (vert1,vert2,edge.report()))
+        return cached_f
+
+
+def unwrap_edge(edge):
+    """
+    Return (MongoDBEdge, CrosswalkEdge) behind edge, possibly cached. CrosswalkEdge
+    is None if edge doesn't use the crosswalk, MongoDBEdge is None if edge doesn't
+    query a collection.
+    """
+    if isinstance(edge,CachedEdge):
+        edge = edge.edge
+    xwalk = None
+    if isinstance(edge,CrosswalkEdge):
+        xwalk,edge = edge,edge.fallback
+    return type(edge) == MongoDBEdge and edge or None, xwalk
+
+
+class CrosswalkEdge(DataTransformEdge):
+    """
+    Edge converting id_type identifiers to InChIKeys using the local identifier
+    crosswalk (see hub.dataload.crosswalk), instead of querying source collections.
+    If the crosswalk isn't available (not built yet, or outdated), lookups
+    are delegated to fallback edge.
+    """
+
+    def __init__(self, id_type, fallback, label=None):
+        super(CrosswalkEdge,self).__init__(label)
+        self.id_type = id_type
+        self.fallback = fallback
+        self.weight = fallback.weight
+        self.crosswalk = None
+        self.resolved = False
+
+    def set_crosswalk(self, crosswalk):
+        """Use crosswalk for next lookups (None means using fallback edge)"""
+        self.crosswalk = crosswalk
+        self.resolved = True
+
+    def edge_lookup(self, keylookup_obj, id_strct, debug=False):
+        if not self.resolved:
+            # not used from BatchedDataTransformMDB, resolve it on first lookup
+            self.set_crosswalk(get_crosswalk(build=False))
+        crosswalk = self.crosswalk
+        if crosswalk is None:
+            return self.fallback.edge_lookup(keylookup_obj,id_strct,debug)
+        res_id_strct = IDStruct()
+        if debug:
+            res_id_strct.import_debug(id_strct)
+        id_lst = id_strct.id_lst
+        if id_lst:
+            for _id,inchikeys in crosswalk.lookup(self.id_type,id_lst).items():
+                for orig_id in id_strct.find_right(_id):
+                    res_id_strct.add(orig_id,inchikeys)
+                    if debug:
+                        res_id_strct.set_debug(orig_id,self.label,inchikeys)
+        return res_id_strct
+
+
+class CachedEdge(DataTransformEdge):
+    """
+    Edge memoizing lookups from another edge, in a LRU cache holding results
+    (including no match) for at most cache_size identifiers. Hits, misses and
+    time spent in the underlying edge lookups are counted.
+    """
+
+    cache_size = 100000
+
+    def __init__(self, edge, cache_size=None, label=None):
+        super(CachedEdge,self).__init__(label or edge.label)
+        self.edge = edge
+        self.weight = edge.weight
+        self.cache_size = cache_size or self.__class__.cache_size
+        self.reset()
+
+    def reset(self):
+        self.cache = collections.OrderedDict()
+        self.stats = {"hits" : 0, "misses" : 0, "time" : 0.0}
+
+    def report(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        return "%s hits, %s misses (hit rate: %.1f%%), %.2fs spent in lookups" % \
+                (self.stats["hits"],self.stats["misses"],
+                 total and 100.0 * self.stats["hits"] / total or 0.0,self.stats["time"])
+
+    def edge_lookup(self, keylookup_obj, id_strct, debug=False):
+        if debug:
+            # debug information is only known from actual lookups
+            return self.edge.edge_lookup(keylookup_obj,id_strct,debug)
+        results = {}
+        todo = IDStruct()
+        for _id in id_strct.id_lst:
+            if _id in self.cache:
+                self.cache.move_to_end(_id)
+                results[_id] = self.cache[_id]
+                self.stats["hits"] += 1
+            else:
+                todo.add(_id,_id)
+                self.stats["misses"] += 1
+        if len(todo):
+            t0 = time.time()
+            found = self.edge.edge_lookup(keylookup_obj,todo,debug)
+            self.stats["time"] += time.time() - t0
+            for _id in todo.id_lst:
+                results[_id] = self.cache[_id] = set(found.find_left(_id))
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        res_id_strct = IDStruct()
+        for orig_id,_id in id_strct:
+            for new_id in results.get(_id,()):
+                res_id_strct.add(orig_id,new_id)
+        return res_id_strct
@@ -1,8 +1,13 @@
 from biothings.hub.datatransform import MongoDBEdge, RegExEdge, MyChemInfoEdge, MyGeneInfoEdge
 import networkx as nx
 
+from hub.dataload.datatransform import CrosswalkEdge, CachedEdge
+
 graph_mychem = nx.DiGraph()
 
+# edges to inchikey resolve identifiers from the local crosswalk when it's
+# available, and query the source collection otherwise
+
 ###############################################################################
 # PharmGKB Nodes and Edges
 ###############################################################################
@@ -25,13 +30,13 @@ graph_mychem.add_edge('inchi', 'pubchem',
                       object=MongoDBEdge('pubchem', 'pubchem.inchi', 'pubchem.cid', weight=1.0))
 
 graph_mychem.add_edge('chembl', 'inchikey',
-                      object=MongoDBEdge('chembl', 'chembl.molecule_chembl_id', 'chembl.inchi_key', weight=0.2))
+                      object=CrosswalkEdge('chembl', MongoDBEdge('chembl', 'chembl.molecule_chembl_id', 'chembl.inchi_key', weight=0.2)))
 
 graph_mychem.add_edge('drugbank', 'inchikey',
-                      object=MongoDBEdge('drugbank', 'drugbank.drugbank_id', 'drugbank.inchi_key', weight=0.1))
+                      object=CrosswalkEdge('drugbank', MongoDBEdge('drugbank', 'drugbank.drugbank_id', 'drugbank.inchi_key', weight=0.1)))
 
 graph_mychem.add_edge('pubchem', 'inchikey',
-                      object=MongoDBEdge('pubchem', 'pubchem.cid', 'pubchem.inchi_key', weight=0.1))
+                      object=CrosswalkEdge('pubchem', MongoDBEdge('pubchem', 'pubchem.cid', 'pubchem.inchi_key', weight=0.1)))
 
 ###############################################################################
 # Sider Nodes and Edges
@@ -47,7 +52,7 @@ graph_mychem.add_edge('pubchem', 'inchikey',
 graph_mychem.add_node('ndc')
 
 graph_mychem.add_edge('ndc', 'inchikey',
-                      object=MongoDBEdge('drugbank', 'drugbank.products.ndc_product_code', 'drugbank.inchi_key', weight=0.1))
+                      object=CrosswalkEdge('ndc', MongoDBEdge('drugbank', 'drugbank.products.ndc_product_code', 'drugbank.inchi_key', weight=0.1)))
 
 ###############################################################################
 # Chebi Nodes and Edges
@@ -66,3 +71,10 @@ graph_mychem.add_edge('chebi-short', 'drugbank',
 graph_mychem.add_edge('chebi-short', 'chembl',
                       object=MongoDBEdge('chembl', 'chembl.chebi_par_id', 'chembl.molecule_chembl_id'))
 
+###############################################################################
+# Lookups caching
+###############################################################################
+# the same identifiers are looked up again and again, all edges are memoized
+# (hits/misses are logged at the end of each transformation)
+for vert1, vert2, data in graph_mychem.edges(data=True):
+    data['object'] = CachedEdge(data['object'])
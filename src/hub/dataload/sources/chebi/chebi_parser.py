@@ -1,25 +1,102 @@
-import pickle
-from zlib import compress
+import os
+import io
+import json
+import struct
+from zlib import compress, decompress
+from bson import Binary
 from biothings.utils.dataload import dict_sweep, unlist, value_convert_to_number
 
 
-def load_data(sdf_file, drugbank_col=None, chembl_col=None):
-    import biothings.utils.mongo as mongo
-    f = open(sdf_file,'r').read()
-    comp_list = f.split("$$$$") #split the compounds and list
-    comp_list = [ele.split("\n> <") for ele in comp_list] #split from \n> <
-    comp_list = list(map(lambda x:[ele.strip("\n") for ele in x],comp_list))
-    comp_list = list(map(lambda x: [ele.split('>\n',1) for ele in x],comp_list))
-    for item in comp_list:
-        del item[0] #remove molecule structure - Marvin
-    for element in comp_list:
-        element = map(lambda x: [ele.split('\n') for ele in x],element)
-    comp_list = list(map(lambda x: dict([ ele for ele in x]),comp_list)) #python 3 compatible
-    del comp_list[-1]
-    for compound in comp_list:
+def build_record_index(sdf_file):
+    """
+    Scan SDF file and return the byte offset of each record (ie. start of file
+    and position right after each $$$$ delimiter line)
+    """
+    offsets = [0]
+    pos = 0
+    with open(sdf_file,'rb') as f:
+        for line in f:
+            pos += len(line)
+            if line.startswith(b"$$$$"):
+                offsets.append(pos)
+    # last one is end of file, not a record
+    offsets.pop()
+    return offsets
+
+def get_record_index(sdf_file):
+    """
+    Return record offsets from SDF file (see build_record_index()), cached in
+    a "<sdf_file>.idx" file, valid as long as the SDF file doesn't change.
+    """
+    idx_file = sdf_file + ".idx"
+    st = os.stat(sdf_file)
+    if os.path.exists(idx_file):
+        with open(idx_file) as f:
+            index = json.load(f)
+        if index["size"] == st.st_size and index["mtime"] == st.st_mtime:
+            return index["offsets"]
+    offsets = build_record_index(sdf_file)
+    with open(idx_file,"w") as f:
+        json.dump({"size":st.st_size, "mtime":st.st_mtime, "offsets":offsets},f)
+    return offsets
+
+def shard_records(offsets, file_size, num_shards):
+    """
+    Cut records, given their offsets, into (at most) num_shards shards
+    of similar size (in bytes). Returns a list of (start offset, number of records)
+    """
+    if not offsets:
+        return []
+    target = file_size / max(num_shards,1)
+    shards = []
+    first = 0
+    for i in range(1,len(offsets)):
+        if offsets[i] - offsets[first] >= target and len(shards) < num_shards - 1:
+            shards.append((offsets[first],i - first))
+            first = i
+    shards.append((offsets[first],len(offsets) - first))
+    return shards
+
+def iter_sdf_records(sdf_file, start=0, count=None):
+    """
+    Read SDF file one record at a time, yielding a {tag: value} dict
+    for each of them. Molecule structure (molfile part) is skipped.
+    If given, reading starts at byte offset "start" (must be the beginning
+    of a record) and stops after "count" records.
+    """
+    with open(sdf_file,'rb') as fb:
+        fb.seek(start)
+        f = io.TextIOWrapper(fb)
+        record = {}
+        tag = None
+        lines = []
+        for line in f:
+            if line.startswith("$$$$"):
+                if tag is not None:
+                    record[tag] = "".join(lines).rstrip("\n")
+                yield record
+                record = {}
+                tag = None
+                lines = []
+                if count is not None:
+                    count -= 1
+                    if count <= 0:
+                        break
+            elif line.startswith("> <"):
+                if tag is not None:
+                    record[tag] = "".join(lines).rstrip("\n")
+                tag = line[3:].rstrip("\n")
+                if tag.endswith(">"):
+                    tag = tag[:-1]
+                lines = []
+            elif tag is not None:
+                lines.append(line)
+
+def load_data(sdf_file, start=0, count=None, drugbank_col=None, chembl_col=None, overflow_col=None):
+    for compound in iter_sdf_records(sdf_file,start,count):
         restr_dict = restructure_dict(compound)
         restr_dict["_id"] = find_inchikey(restr_dict,drugbank_col,chembl_col)
-        restr_dict = truncate(restr_dict)
+        restr_dict = truncate(restr_dict,overflow_col)
         yield restr_dict
 
 def clean_up(_dict):
@@ -61,7 +138,64 @@ def find_inchikey(doc, drugbank_col, chembl_col):
     return _id
 
 
-def truncate(d):
+# collection (in src db) holding full values of truncated fields
+OVERFLOW_COLLECTION = "chebi_overflow"
+
+def pack_values(values):
+    """
+    Serialize a list of values in a compact binary format: a type byte,
+    then either int64 values ("i"), length-prefixed UTF-8 strings ("s"),
+    or JSON for mixed types ("j"), the whole being zlib-compressed.
+    """
+    if all(type(v) == int for v in values):
+        data = b"i" + struct.pack("<%dq" % len(values),*values)
+    elif all(isinstance(v,str) for v in values):
+        parts = [b"s"]
+        for v in values:
+            v = v.encode("utf-8")
+            parts.append(struct.pack("<I",len(v)))
+            parts.append(v)
+        data = b"".join(parts)
+    else:
+        data = b"j" + json.dumps(values).encode("utf-8")
+    return compress(data)
+
+def unpack_values(packed):
+    """Inverse of pack_values()"""
+    data = decompress(packed)
+    kind, data = data[:1], data[1:]
+    if kind == b"i":
+        return list(struct.unpack("<%dq" % (len(data) // 8),data))
+    elif kind == b"s":
+        values = []
+        pos = 0
+        while pos < len(data):
+            size, = struct.unpack_from("<I",data,pos)
+            pos += 4
+            values.append(data[pos:pos+size].decode("utf-8"))
+            pos += size
+        return values
+    elif kind == b"j":
+        return json.loads(data.decode("utf-8"))
+    else:
+        raise ValueError("Unknown packed values type %s" % repr(kind))
+
+def overflow_key(chebi_id, field_name):
+    return "%s/%s" % (chebi_id,field_name)
+
+def get_truncated_field(chebi_id, field_name, overflow_col=None):
+    """
+    Return the full list of values for a truncated field, or None if
+    the field wasn't truncated for that ChEBI ID.
+    """
+    if overflow_col is None:
+        from biothings.utils.mongo import get_src_db
+        overflow_col = get_src_db()[OVERFLOW_COLLECTION]
+    doc = overflow_col.find_one({"_id":overflow_key(chebi_id,field_name)})
+    if doc:
+        return unpack_values(doc["values"])
+
+def truncate(d, overflow_col=None):
     max_values = 1000
 
     fields = [
@@ -71,19 +205,24 @@ def truncate(d):
         'sabio_rk_database_links',
         'uniprot_database_links',
         ]
-    
+
     def truncate_field(field_name, field):
         if isinstance(field, list) and len(field) >= max_values:
-            compressed = compress(pickle.dumps(field))
             res = {
                 '_truncated': {
                     '_readme': "the following fields are truncated for top ten {}".format(field_name),
                     'total': len(field),
                     'kept': len(field[:max_values]),
-                    '_raw': compressed,
                     field_name: field[:max_values],
                     }
                 }
+            if overflow_col is not None:
+                # full list goes to a side collection, only a reference is kept
+                key = overflow_key(d['chebi']['chebi_id'],field_name)
+                overflow_col.replace_one({"_id":key},
+                        {"_id":key, "total":len(field), "values":Binary(pack_values(field))},
+                        upsert=True)
+                res['_truncated']['overflow'] = {"collection":OVERFLOW_COLLECTION, "_id":key}
             return res
         else:
             return field
@@ -3,11 +3,13 @@ import glob
 import zipfile
 import pymongo
 
-from .chebi_parser import load_data
+from config import HUB_MAX_WORKERS
+from .chebi_parser import load_data, get_record_index, shard_records, OVERFLOW_COLLECTION
 from hub.dataload.uploader import BaseDrugUploader
+from biothings.hub.dataload.uploader import ParallelizedSourceUploader
 from biothings.utils.mongo import get_src_db
 import biothings.hub.dataload.storage as storage
-from biothings.hub.datatransform import DataTransformMDB
+from hub.dataload.datatransform import BatchedDataTransformMDB
 from hub.dataload.graph_mychem import graph_mychem as G
 
 
@@ -18,18 +20,58 @@ SRC_META = {
         }
 
 
-class ChebiUploader(BaseDrugUploader):
+class ChebiUploader(BaseDrugUploader,ParallelizedSourceUploader):
 
     name = "chebi"
     storage_class = storage.IgnoreDuplicatedStorage
     __metadata__ = {"src_meta" : SRC_META}
+    use_crosswalk = True
 
-    @DataTransformMDB(G, ['chebi', ('drugbank', 'chebi.drugbank_database_links')], ['inchikey', 'drugbank'], skip_w_regex="^[A-Z]{14}\-[A-Z]{10}(\-[A-Z])?")
-    def load_data(self,data_folder):
-        self.logger.info("Load data from '%s'" % data_folder)
-        input_file = os.path.join(data_folder,"ChEBI_complete.sdf")
-        assert os.path.exists(input_file), "Can't find input file '%s'" % input_file
-        return load_data(input_file)
+    # number of shards the SDF file is split into (one job each)
+    NUM_SHARDS = HUB_MAX_WORKERS
+
+    def prepare_update(self):
+        self.input_file = os.path.join(self.data_folder,"ChEBI_complete.sdf")
+        assert os.path.exists(self.input_file), "Can't find input file '%s'" % self.input_file
+        # record offsets are cached next to the SDF file, so re-uploading
+        # the same release doesn't need to scan it again
+        offsets = get_record_index(self.input_file)
+        self.shards = shard_records(offsets,os.path.getsize(self.input_file),max(self.__class__.NUM_SHARDS,1))
+        self.logger.info("Split %s records from '%s' into %s shards" % (len(offsets),self.input_file,len(self.shards)))
+        db = get_src_db()
+        for col_name in db.collection_names():
+            # leftovers from failed uploads
+            if col_name.startswith(OVERFLOW_COLLECTION + "_temp_"):
+                db[col_name].drop()
+
+    def jobs(self):
+        # this will generate arguments for self.load.data() method, allowing parallelization
+        # (SDF file is scanned by prepare_update(), in a thread)
+        # full values of truncated fields are stored aside, along with the temp
+        # collection, and only replace current ones once it's switched
+        overflow_name = self.overflow_temp_collection_name
+        return [(self.input_file,start,count,overflow_name) for start,count in self.shards]
+
+    @property
+    def overflow_temp_collection_name(self):
+        return self.temp_collection_name.replace(self.collection_name,OVERFLOW_COLLECTION,1)
+
+    @BatchedDataTransformMDB(G, ['chebi', ('drugbank', 'chebi.drugbank_database_links')], ['inchikey', 'drugbank'], skip_w_regex="^[A-Z]{14}\-[A-Z]{10}(\-[A-Z])?")
+    def load_data(self,input_file,start=0,count=None,overflow_name=OVERFLOW_COLLECTION):
+        self.logger.info("Load data from file '%s' (%s records from offset %s)" % (input_file,count,start))
+        # truncated fields' full values go to a side collection
+        overflow_col = get_src_db()[overflow_name]
+        return load_data(input_file,start,count,overflow_col=overflow_col)
+
+    def switch_collection(self):
+        super(ChebiUploader,self).switch_collection()
+        overflow_name = self.overflow_temp_collection_name
+        if self.db[overflow_name].find_one():
+            self.logger.info("Renaming collection '%s' to '%s'" % (overflow_name,OVERFLOW_COLLECTION))
+            self.db[overflow_name].rename(OVERFLOW_COLLECTION,dropTarget=True)
+        else:
+            # nothing truncated in this release
+            self.db[OVERFLOW_COLLECTION].drop()
 
     def post_update_data(self, *args, **kwargs):
         for idxname in ["chebi.chebi_id"]:
@@ -4,14 +4,20 @@ import sys
 import time
 import glob
 import json
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
+import requests
 import biothings, config
 biothings.config_for_app(config)
 
 from config import DATA_ARCHIVE_ROOT
-from biothings.hub.dataload.dumper import HTTPDumper
+from biothings.hub.dataload.dumper import HTTPDumper, DumperException
 from biothings.utils.common import iter_n
 
+from .chembl_parser import iter_molecules
+
 
 class ChemblDumper(HTTPDumper):
 
@@ -22,6 +28,11 @@ class ChemblDumper(HTTPDumper):
 
     SCHEDULE = "0 12 * * *"
     CHUNK_MERGE_SIZE = 100 # number of part files merged together after download
+    PAGE_SIZE = 1000 # number of molecules per API call
+    MAX_PARALLEL_PAGES = 8 # number of API pages downloaded concurrently
+    PAGE_MAX_RETRIES = 5 # attempts per page before giving up
+    PAGE_RETRY_BACKOFF = 2 # seconds, doubled after each failed attempt
+    PAGE_TIMEOUT = (10,120) # seconds to connect, and between bytes received, per API call
 
     def remote_is_better(self,remotefile,localfile):
         remote_data = json.loads(self.client.get(self.__class__.SRC_VERSION_URL).text)
@@ -55,24 +66,94 @@ class ChemblDumper(HTTPDumper):
             new_localfile = os.path.join(self.new_data_folder,version_filename)
             self.to_dump.append({"remote":self.__class__.SRC_VERSION_URL, "local":new_localfile})
             # now we need to scroll the API endpoint. Let's get the total number of records
-            # and generate URLs for each call to parallelize the downloads
-            for num,i in enumerate(range(0,self.total_count,1000)):
-                remote = self.__class__.SRC_DATA_URL + "?limit=1000&offset=" + str(i)
+            # and generate URLs for each call. These are downloaded concurrently, sharing
+            # the same connection pool (see download_pages()), not as individual dump jobs
+            self.to_dump_pages = []
+            for num,i in enumerate(range(0,self.total_count,self.__class__.PAGE_SIZE)):
+                remote = self.__class__.SRC_DATA_URL + "?limit=%s&offset=%s" % (self.__class__.PAGE_SIZE,i)
                 local = os.path.join(self.new_data_folder,"molecule.part%d" % num)
-                self.to_dump.append({"remote":remote, "local":local})
+                self.to_dump_pages.append({"remote":remote, "local":local})
+
+    @asyncio.coroutine
+    def do_dump(self, job_manager=None):
+        yield from super(ChemblDumper,self).do_dump(job_manager=job_manager)
+        pages = getattr(self,"to_dump_pages",None)
+        if pages:
+            pinfo = self.get_pinfo()
+            pinfo["step"] = "dump"
+            pinfo["description"] = "%s API pages" % len(pages)
+            # self is pickled to be sent to the process, unpickable attributes
+            # (src_dump collection, logger, ...) are restored once it's done
+            state = self.unprepare()
+            job = yield from job_manager.defer_to_process(pinfo,partial(self.download_pages,pages))
+            try:
+                yield from job
+            finally:
+                self.prepare(state)
+            self.to_dump_pages = []
+
+    def download_pages(self, pages):
+        """
+        Download API pages using MAX_PARALLEL_PAGES threads, sharing a keep-alive
+        connection pool. Pages already on disk (from an interrupted dump) are skipped,
+        so a failed dump resumes where it stopped.
+        """
+        todo = [page for page in pages if not os.path.exists(page["local"])]
+        self.logger.info("%s API pages to download (%s already there)" % (len(todo),len(pages) - len(todo)))
+        if not todo:
+            return
+        self.prepare_local_folders(todo[0]["local"])
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,pool_maxsize=self.__class__.MAX_PARALLEL_PAGES)
+        session.mount("https://",adapter)
+        session.mount("http://",adapter)
+        try:
+            with ThreadPoolExecutor(max_workers=self.__class__.MAX_PARALLEL_PAGES) as executor:
+                # list() so the first error is raised here
+                list(executor.map(lambda page: self.download_page(session,page["remote"],page["local"]),todo))
+        finally:
+            session.close()
+        self.logger.info("%s API pages downloaded" % len(todo))
+
+    def download_page(self, session, remoteurl, localfile):
+        delay = self.__class__.PAGE_RETRY_BACKOFF
+        for attempt in range(1,self.__class__.PAGE_MAX_RETRIES + 1):
+            try:
+                res = session.get(remoteurl,timeout=self.__class__.PAGE_TIMEOUT)
+                if res.status_code != 200:
+                    raise DumperException("Error while downloading '%s' (status: %s, reason: %s)" % \
+                            (remoteurl,res.status_code,res.reason))
+                # make sure we got a complete page before keeping it
+                assert "molecules" in json.loads(res.text), "No molecules found in '%s'" % remoteurl
+                break
+            # timeouts/connection errors (requests.RequestException), error status,
+            # and truncated/invalid JSON are retried
+            except (requests.RequestException,DumperException,AssertionError,ValueError) as e:
+                if attempt == self.__class__.PAGE_MAX_RETRIES:
+                    raise
+                self.logger.warning("Attempt %s/%s to download '%s' failed (%s), retrying in %ss" % \
+                        (attempt,self.__class__.PAGE_MAX_RETRIES,remoteurl,e,delay))
+                time.sleep(delay)
+                delay *= 2
+        # write then rename, so a page file on disk is always complete (used to resume).
+        # Temp file is hidden so post_dump() doesn't pick it up as a part
+        tmpfile = os.path.join(os.path.dirname(localfile),".%s.tmp" % os.path.basename(localfile))
+        with open(tmpfile,"wb") as fout:
+            fout.write(res.content)
+        os.rename(tmpfile,localfile)
 
     def post_dump(self, *args, **kwargs):
         self.logger.info("Merging JSON documents in '%s'" % self.new_data_folder)
         # we'll merge 100 files together, that's 100'000 documents. That way we don't have one huge
-        # big files and we don't have thousands of them too. We'll also remove metadata (useless now)
+        # big files and we don't have thousands of them too. We'll also remove metadata (useless now).
+        # Molecules are streamed from each part to the output file, one JSON document per line
         parts = glob.iglob(os.path.join(self.new_data_folder,"molecule.part*"))
         for chunk,cnt in iter_n(parts,self.__class__.CHUNK_MERGE_SIZE,with_cnt=True):
-            outfile = os.path.join(self.new_data_folder,"molecule.%s.json" % cnt)
-            merged_data = {"molecules" : []}
-            for f in chunk:
-                data = json.load(open(f))
-                merged_data["molecules"].extend(data["molecules"])
-            json.dump(merged_data,open(outfile,"w"))
+            outfile = os.path.join(self.new_data_folder,"molecule.%s.ndjson" % cnt)
+            with open(outfile,"w") as fout:
+                for f in chunk:
+                    for molecule in iter_molecules(f):
+                        fout.write(json.dumps(molecule) + "\n")
             self.logger.info("Merged %s files" % cnt)
         # now we can delete the parts
         self.logger.info("Deleting part files")
@@ -80,4 +161,3 @@ class ChemblDumper(HTTPDumper):
         for f in parts:
             os.remove(f)
         self.logger.info("Post-dump merge done")
-
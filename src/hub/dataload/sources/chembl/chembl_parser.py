@@ -1,15 +1,45 @@
 import urllib.request
 import json
 import collections
+import decimal
+import ijson
 from biothings.utils.dataload import dict_sweep, unlist, value_convert_to_number
 from biothings.utils.dataload import boolean_convert
 
+def decimal_to_float(value):
+    """
+    ijson returns non-integer numbers as Decimal (which can't be stored in
+    MongoDB), convert them back to float, as json.load() would have.
+    """
+    if isinstance(value,dict):
+        return {k:decimal_to_float(v) for k,v in value.items()}
+    elif isinstance(value,list):
+        return [decimal_to_float(v) for v in value]
+    elif isinstance(value,decimal.Decimal):
+        return float(value)
+    else:
+        return value
+
+def iter_molecules(input_file):
+    """
+    Iterate over molecules from input_file, either newline-delimited JSON
+    (one molecule per line, as merged by the dumper) or a JSON document with a
+    "molecules" array (API pages, older dumps), parsed incrementally. Either
+    way, only one molecule is in memory at a time.
+    """
+    if input_file.endswith(".ndjson"):
+        with open(input_file) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(input_file,"rb") as f:
+            for molecule in ijson.items(f,"molecules.item"):
+                yield decimal_to_float(molecule)
+
 def load_data(input_file):
-    molecules_list = []
-    data = json.load(open(input_file))
-    molecules_list = data['molecules']
-    for i in range(0,len(molecules_list)):
-        restr_dict = restructure_dict(molecules_list[i])
+    for molecule in iter_molecules(input_file):
+        restr_dict = restructure_dict(molecule)
         try:
             _id = restr_dict["chembl"]['inchi_key']
             restr_dict["_id"] = _id
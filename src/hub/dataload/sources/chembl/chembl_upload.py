@@ -1,11 +1,21 @@
 import os
 import glob
+import json
+import asyncio
+import hashlib
+import itertools
 import zipfile
 import pymongo
+from functools import partial
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
 
 from .chembl_parser import load_data
 from hub.dataload.uploader import BaseDrugUploader
 from biothings.hub.dataload.uploader import ParallelizedSourceUploader
+from biothings.utils.common import iter_n, get_timestamp, get_random_string
+from biothings.utils.mongo import get_src_db
+from biothings.utils.dataload import merge_struct
 
 
 SRC_META = {
@@ -15,22 +25,201 @@ SRC_META = {
         }
 
 
+DUPLICATE_KEY_ERROR = 11000
+
+def doc_hash(doc):
+    return hashlib.sha1(json.dumps(doc,sort_keys=True).encode("utf-8")).hexdigest()
+
+def delta_upload_worker(loaddata_func, col_name, hash_col_name, claim_col_name, dup_col_name,
+                        run_id, batch_size, *args):
+    """
+    Pickable job launcher: store documents from loaddata_func(*args) in col_name
+    only if they're new or changed, according to content hashes kept in hash_col_name.
+    All documents seen are flagged with run_id so the ones which disappeared from
+    the release can be found afterward. Each _id is first claimed in claim_col_name
+    (unique _id, so only one job or batch gets it): documents with an _id claimed
+    before are staged in dup_col_name, to be merged afterward (see merge_duplicates()),
+    instead of being merged concurrently by several jobs. Return number of documents.
+    """
+    db = get_src_db()
+    col = db[col_name]
+    hash_col = db[hash_col_name]
+    claim_col = db[claim_col_name]
+    dup_col = db[dup_col_name]
+    cnt = 0
+    for docs in iter_n(loaddata_func(*args),batch_size):
+        cnt += len(docs)
+        batch = {}
+        dups = []
+        for doc in docs:
+            if doc["_id"] in batch:
+                dups.append(doc)
+            else:
+                batch[doc["_id"]] = doc
+        try:
+            claim_col.insert_many([{"_id" : _id} for _id in batch],ordered=False)
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if [err for err in errors if err["code"] != DUPLICATE_KEY_ERROR]:
+                raise
+            for err in errors:
+                dups.append(batch.pop(err["op"]["_id"]))
+        if dups:
+            dup_col.insert_many([{"doc_id" : doc["_id"], "doc" : doc} for doc in dups])
+        if not batch:
+            continue
+        known = dict([(d["_id"],d.get("hash")) for d in hash_col.find({"_id":{"$in":list(batch)}},{"hash":1})])
+        ops = []
+        hash_ops = []
+        for _id,doc in batch.items():
+            hsh = doc_hash(doc)
+            prev = known.get(_id)
+            status = prev is None and "inserted" or prev == hsh and "unchanged" or "updated"
+            if status != "unchanged":
+                ops.append(ReplaceOne({"_id":_id},doc,upsert=True))
+            # previous hash kept until duplicates are merged
+            hash_ops.append(UpdateOne({"_id":_id},{"$set":{"hash":hsh,"prev_hash":prev,
+                                                           "status":status,"run":run_id}},upsert=True))
+        # documents first, so a failure in between only means re-writing them next time
+        if ops:
+            col.bulk_write(ops,ordered=False)
+        hash_col.bulk_write(hash_ops,ordered=False)
+    return cnt
+
+
 class ChemblUploader(BaseDrugUploader,ParallelizedSourceUploader):
 
     name = "chembl"
     __metadata__ = {"src_meta" : SRC_META}
 
-    MOLECULE_PATTERN = "molecule.*.json"
+    MOLECULE_PATTERN = "molecule.*.ndjson"
+    # merged files from dumps before newline-delimited JSON was used
+    LEGACY_MOLECULE_PATTERN = "molecule.*.json"
+    # only store new/changed molecules in the existing collection and delete the
+    # ones not in the release anymore, instead of re-uploading everything.
+    # Opt-in: live collection is modified in place, there's no temp collection
+    # to switch, so a failed upload leaves it partially updated (until next run)
+    DELTA_MODE = False
+
+    @property
+    def hash_collection_name(self):
+        return "%s_hashes" % self.collection_name
 
     def jobs(self):
         # this will generate arguments for self.load.data() method, allowing parallelization
         json_files = glob.glob(os.path.join(self.data_folder,self.__class__.MOLECULE_PATTERN))
+        if not json_files:
+            json_files = glob.glob(os.path.join(self.data_folder,self.__class__.LEGACY_MOLECULE_PATTERN))
         return [(f,) for f in json_files]
 
     def load_data(self,input_file):
         self.logger.info("Load data from file '%s'" % input_file)
         return load_data(input_file)
 
+    @asyncio.coroutine
+    def update_data(self, batch_size, job_manager=None):
+        if not self.__class__.DELTA_MODE:
+            res = yield from super(ChemblUploader,self).update_data(batch_size,job_manager)
+            # hashes don't match the new collection anymore
+            self.db[self.hash_collection_name].drop()
+            return res
+        jobs = []
+        job_params = self.jobs()
+        assert job_params, "No input files found in '%s'" % self.data_folder
+        run_id = "%s_%s" % (get_timestamp(),get_random_string())
+        # _ids claimed during this run, and documents with an already claimed _id
+        claim_col_name = "%s_claims_%s" % (self.hash_collection_name,run_id)
+        dup_col_name = "%s_dups_%s" % (self.hash_collection_name,run_id)
+        for bnum,args in enumerate(job_params):
+            pinfo = self.get_pinfo()
+            pinfo["step"] = "update_data"
+            pinfo["description"] = "delta %s" % str(args)
+            # parser's load_data() is given, not self.load_data, so self isn't pickled
+            job = yield from job_manager.defer_to_process(
+                    pinfo,
+                    partial(delta_upload_worker,load_data,self.collection_name,self.hash_collection_name,
+                            claim_col_name,dup_col_name,run_id,batch_size,*args))
+            jobs.append(job)
+        try:
+            # raises if any job failed, stale documents are then kept
+            yield from asyncio.gather(*jobs)
+            # duplicates are merged by one thread only, so no merge is lost
+            pinfo = self.get_pinfo()
+            pinfo["step"] = "update_data"
+            pinfo["description"] = "merge duplicated documents"
+            job = yield from job_manager.defer_to_thread(pinfo,
+                    partial(self.merge_duplicates,self.collection_name,self.hash_collection_name,dup_col_name))
+            merged = yield from job
+        finally:
+            self.db[claim_col_name].drop()
+            self.db[dup_col_name].drop()
+        delta = self.get_delta_stats(self.hash_collection_name,run_id)
+        delta["merged"] = merged
+        if merged:
+            self.logger.warning("%s documents with duplicated _id merged" % merged)
+        cnt = delta["inserted"] + delta["updated"] + delta["unchanged"]
+        if not cnt:
+            raise ValueError("No documents found in %s, not deleting any" % job_params)
+        pinfo = self.get_pinfo()
+        pinfo["step"] = "update_data"
+        pinfo["description"] = "delete stale documents"
+        job = yield from job_manager.defer_to_thread(pinfo,
+                partial(self.delete_stale,self.collection_name,self.hash_collection_name,run_id,batch_size))
+        delta["deleted"] = yield from job
+        self.logger.info("Delta upload: %s" % delta,extra={"notify":True})
+        # so downstream steps know what actually changed
+        self.src_dump.update_one({"_id":self.main_source},{"$set":{"upload.jobs.%s.delta" % self.name : delta}})
+        return cnt
+
+    def merge_duplicates(self, col_name, hash_col_name, dup_col_name):
+        """
+        Merge documents staged in dup_col_name (see delta_upload_worker()) into
+        the ones stored in col_name, as MergerStorage does, updating their hash
+        and status. Return the number of merged documents.
+        """
+        col = self.db[col_name]
+        hash_col = self.db[hash_col_name]
+        merged = 0
+        dups = self.db[dup_col_name].find().sort([("doc_id",1),("_id",1)])
+        for doc_id,group in itertools.groupby(dups,key=lambda d: d["doc_id"]):
+            doc = col.find_one({"_id":doc_id})
+            for dup in group:
+                doc = merge_struct(doc,dup["doc"])
+                merged += 1
+            hsh = doc_hash(doc)
+            known = hash_col.find_one({"_id":doc_id})
+            if hsh != known["hash"]:
+                col.replace_one({"_id":doc_id},doc)
+            prev = known.get("prev_hash")
+            status = prev is None and "inserted" or prev == hsh and "unchanged" or "updated"
+            hash_col.update_one({"_id":doc_id},{"$set":{"hash":hsh,"status":status}})
+        return merged
+
+    def get_delta_stats(self, hash_col_name, run_id):
+        """Return number of inserted/updated/unchanged documents during upload run_id"""
+        hash_col = self.db[hash_col_name]
+        return dict([(status,hash_col.count({"run":run_id,"status":status}))
+                     for status in ("inserted","updated","unchanged")])
+
+    def delete_stale(self, col_name, hash_col_name, run_id, batch_size):
+        """
+        Delete documents not seen during upload run_id, ie. not in the release
+        anymore. Return the number of deleted documents.
+        """
+        col = self.db[col_name]
+        hash_col = self.db[hash_col_name]
+        deleted = 0
+        # scan the collection (not the hashes) to also catch documents uploaded
+        # before hashes were recorded
+        for docs in iter_n(col.find({},{"_id":1}),batch_size):
+            ids = [d["_id"] for d in docs]
+            seen = set([d["_id"] for d in hash_col.find({"_id":{"$in":ids},"run":run_id},{"_id":1})])
+            stale = [_id for _id in ids if not _id in seen]
+            if stale:
+                deleted += col.delete_many({"_id":{"$in":stale}}).deleted_count
+        hash_col.delete_many({"run":{"$ne":run_id}})
+        return deleted
+
     def post_update_data(self, *args, **kwargs):
         for idxname in ["chembl.chebi_par_id","chembl.inchi"]:
             self.logger.info("Indexing '%s'" % idxname)
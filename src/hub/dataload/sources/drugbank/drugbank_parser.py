@@ -2,19 +2,119 @@ import xmltodict
 import json, math
 import collections
 import logging
-from biothings.utils.dataload import dict_sweep, unlist, value_convert_to_number
-from biothings.utils.dataload import boolean_convert
-
-def load_data(xml_file):
-    drug_list = []
-    def handle(path,item):  #streaming mode of xmltodict
-        item = restructure_dict(item)
-        drug_list.append(item)
-        return True
-    with open(xml_file,'rb') as f:
-        xmltodict.parse(f,item_depth=2,item_callback=handle,xml_attribs=True)
-    f.close()
-    for doc in drug_list:
+import mmap
+import re
+from functools import lru_cache
+from lxml import etree
+from biothings.utils.dataload import dict_sweep, unlist, to_boolean, to_number
+
+# top-level <drug> elements start at column 0, nested ones (pathways, ...) are indented
+TOP_DRUG_PAT = re.compile(b"\n<drug[ >]")
+ROOT_END_TAG = b"</drugbank>"
+
+def shard_offsets(xml_file, num_shards):
+    """
+    Split DrugBank XML file into (at most) num_shards byte ranges of similar
+    size, cut at top-level <drug> boundaries. Returns a list of (start,end)
+    offsets, each range containing complete <drug> elements only.
+    """
+    with open(xml_file,"rb") as f:
+        mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        try:
+            # +1: skip the newline
+            starts = [m.start() + 1 for m in TOP_DRUG_PAT.finditer(mm)]
+            end = mm.rfind(ROOT_END_TAG)
+        finally:
+            mm.close()
+    if not starts:
+        return []
+    assert end > starts[-1], "Can't find closing root element in '%s'" % xml_file
+    target = (end - starts[0]) / max(num_shards,1)
+    shards = []
+    shard_start = starts[0]
+    for offset in starts[1:]:
+        if offset - shard_start >= target and len(shards) < num_shards - 1:
+            shards.append((shard_start,offset))
+            shard_start = offset
+    shards.append((shard_start,end))
+    return shards
+
+class XMLShardReader(object):
+    """
+    File-like object reading a byte range from a DrugBank XML file,
+    wrapped within the file's original header (root element opening tag)
+    and a closing root tag, so the range can be parsed as a complete document.
+    """
+
+    def __init__(self, xml_file, start, end, bufsize=1024*1024):
+        self.xml_file = xml_file
+        self.start = start
+        self.end = end
+        self.bufsize = bufsize
+        self._chunks = self._iter_chunks()
+        self._buf = b""
+
+    def _iter_chunks(self):
+        with open(self.xml_file,"rb") as f:
+            header = f.read(1024*1024)
+            m = TOP_DRUG_PAT.search(header)
+            assert m, "Can't find XML header in '%s'" % self.xml_file
+            yield header[:m.start() + 1]
+            f.seek(self.start)
+            remaining = self.end - self.start
+            while remaining > 0:
+                chunk = f.read(min(self.bufsize,remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        yield ROOT_END_TAG + b"\n"
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._buf + b"".join(self._chunks)
+            self._buf = b""
+            return data
+        while len(self._buf) < size:
+            try:
+                self._buf += next(self._chunks)
+            except StopIteration:
+                break
+        data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+def iter_drugs(xml_file, start=None, end=None):
+    """
+    Iterate over top-level <drug> elements, yielding each one as the
+    dict xmltodict would have produced (same as item_depth=2) as soon
+    as the element is closed. Parsed elements are cleared so memory
+    doesn't grow with the file size. If start/end byte offsets are given
+    (see shard_offsets()), only drugs within that range are parsed.
+    """
+    source = xml_file
+    if start is not None:
+        source = XMLShardReader(xml_file,start,end)
+    context = etree.iterparse(source,events=("end",),tag="{*}drug",huge_tree=True)
+    for _,elem in context:
+        parent = elem.getparent()
+        # <drug> elements are also nested in pathways, etc... only
+        # consider direct children of the <drugbank> root element
+        if parent is None or parent.getparent() is not None:
+            continue
+        item = xmltodict.parse(etree.tostring(elem,with_tail=False),xml_attribs=True)["drug"]
+        # xmltodict's streaming mode doesn't report the item's own attributes
+        # (nor the namespace declarations lxml copies from the root), drop them
+        for key in [k for k in item if k.startswith("@")]:
+            del item[key]
+        yield item
+        elem.clear()
+        while elem.getprevious() is not None:
+            del parent[0]
+    del context
+
+def load_data(xml_file, start=None, end=None):
+    for item in iter_drugs(xml_file,start,end):
+        doc = restructure_dict(item)
         # try to normalize to inchi key
         try:
             _id = doc["drugbank"]['inchi_key']
@@ -23,494 +123,436 @@ def load_data(xml_file):
             pass
         yield doc
 
+@lru_cache(maxsize=None)
+def property_key(kind):
+    return kind.lower().replace(' ','_').replace('-','_')
+
+PROTEIN_FIELDS = {'id', 'name', 'organism'}
+POLYPEPTIDE_FIELDS = {
+        '@id' : 'uniprot',
+        '@source' : 'source',
+        'general-function' : 'general_function',
+        'specific-function' : 'specific_function',
+        }
+PRODUCT_FIELDS = {
+        'name' : 'name',
+        'dosage-form' : 'dosage_form',
+        'strength' : 'strength',
+        'route' : 'route',
+        'over-the-counter' : 'otc',
+        'generic' : 'generic',
+        'ndc-id' : 'ndc_id',
+        'ndc-product-code' : 'ndc_product_code',
+        'dpd-id' : 'dpd',
+        'started-marketing-on' : 'started_marketing_on',
+        'ended-marketing-on' : 'ended_marketing_on',
+        'fda-application-number' : 'fda_application_number',
+        'approved' : 'approved',
+        'country' : 'country',
+        'source' : 'source',
+        }
+EXTERNAL_ID_FIELDS = {
+        "Drugs Product Database (DPD)" : 'dpd',
+        "KEGG Drug" : 'kegg_drug',
+        "KEGG Compound" : 'kegg_compound',
+        "National Drug Code Directory" : 'ndc_directory',
+        "PharmGKB" : 'pharmgkb',
+        "UniProtKB" : 'uniprotkb',
+        "Wikipedia" : 'wikipedia',
+        "ChemSpider" : 'chemspider',
+        "ChEBI" : 'chebi',
+        "PubChem Compound" : 'pubchem_compound',
+        "PubChem Substance" : 'pubchem_substance',
+        "GenBank" : 'genbank',
+        }
+CALCULATED_PROPERTY_FIELDS = {
+        "IUPAC Name" : 'iupac',
+        "SMILES" : 'smiles',
+        "Molecular Formula" : 'formula',
+        "InChI" : 'inchi',
+        }
+
 def restr_protein_dict(dictionary):
-    _li1 = ['id', 'name', 'organism']
     _dict = {}
     for x,y in iter(dictionary.items()):
-        if x in _li1:
-            _dict.update({x:y})
+        if x in PROTEIN_FIELDS:
+            _dict[x] = y
         elif x == 'actions' and y:
             for z in y:
-                _dict.update({x:y[z]})
+                _dict[x] = y[z]
         elif x == 'known-action':
-            x = x.replace('-','_')
-            _dict.update({x:dictionary['known-action']})
-        elif x == 'polypeptide':
-            _li2 = ['general-function','specific-function']
+            _dict['known_action'] = y
+        elif x == 'polypeptide' and isinstance(y,dict):
             for i in y:
-                if i ==  "@id":
-                    _dict.update({'uniprot':y[i]})
-                elif i == "@source":
-                    _dict.update({'source':y[i]})
-                elif i in _li2:
-                    j = i.replace('-','_')
-                    _dict.update({j:y[i]})
+                if i in POLYPEPTIDE_FIELDS:
+                    _dict[POLYPEPTIDE_FIELDS[i]] = y[i]
     return _dict
 
+def restr_product_dict(dictionary):
+    products_dict = {}
+    for x in dictionary:
+        if x in PRODUCT_FIELDS:
+            products_dict[PRODUCT_FIELDS[x]] = dictionary[x]
+    return products_dict
+
+def restr_pathway_dict(dictionary):
+    _dict = {}
+    for x,y in iter(dictionary.items()):
+        if x == 'smpdb-id':
+            _dict['smpdb_id'] = y
+        elif x == 'name' or x == 'enzymes':
+            _dict[x] = y
+        elif x == 'drugs':
+            _dict[x] = y['drug']
+    return _dict
+
+###############################################################################
+# restructure_dict() handlers, one per DrugBank <drug> field. Each is called
+# with (value, out_key, d1, state), d1 being the "drugbank" sub-document,
+# state holding the whole document and lists filled along the way.
+###############################################################################
+
+def _copy_value(value, out_key, d1, state):
+    d1[out_key] = value
+
+def _pharmacology(value, out_key, d1, state):
+    d1['pharmacology'][out_key] = value
+
+def _description(value, out_key, d1, state):
+    d1['pharmacology'] = {out_key:value}
+
+def _drugbank_id(value, out_key, d1, state):
+    id_list = []
+    if isinstance(value,list):
+        for ele in value:
+            if isinstance(ele,collections.OrderedDict):
+                assert "@primary" in ele
+                if '#text' in ele:
+                    # make sure we always have DB ID as drugbank_id
+                    d1['drugbank_id'] = ele['#text']
+                    state['restr_dict']['_id'] = ele['#text']
+            if isinstance(ele,str):
+                id_list.append(ele)
+                d1['accession_number'] = id_list
+    elif isinstance(value,dict):
+        if '#text' in value:
+            id_list.append(value['#text'])
+            d1[out_key] = id_list
+            state['restr_dict']['_id'] = value['#text']
+
+def _last_child(value, out_key, d1, state):
+    # <groups><group>...</group></groups>, etc... keep the inner value
+    for x in value:
+        d1[out_key] = value[x]
+
+def _salts(value, out_key, d1, state):
+    salts_list = []
+    for n in value.values():
+        if isinstance(n,list):
+            for ele in n:
+                if isinstance(ele,dict) and 'name' in ele:
+                    salts_list.append(ele['name'])
+                    d1[out_key] = salts_list
+        elif isinstance(n,dict):
+            d1[out_key] = n['name']
+
+def _synonyms(value, out_key, d1, state):
+    synonym_list = []
+    if isinstance(value,collections.OrderedDict):
+        for y in value.values():
+            for ele in y:
+                if isinstance(ele,dict) and '#text' in ele:
+                    synonym_list.append(ele['#text'])
+                    d1[out_key] = synonym_list
+
+def _products(value, out_key, d1, state):
+    for y in value.values():
+        if isinstance(y,dict):
+            state['products'].append(restr_product_dict(y))
+        elif isinstance(y,list):
+            for _d in y:
+                state['products'].append(restr_product_dict(_d))
+
+def _packagers(value, out_key, d1, state):
+    pack_list = []
+    for pack in value:
+        for pack1 in value[pack]:
+            if isinstance(pack1,dict) and pack1.get('name'):
+                pack_list.append(pack1['name'])
+                d1[out_key] = pack_list
+
+def _manufacturers(value, out_key, d1, state):
+    manuf_list = []
+    for y in value.values():
+        if isinstance(y,dict):
+            if '#text' in y:
+                manuf_list.append(y['#text'])
+                d1[out_key] = manuf_list
+        if isinstance(y,list):
+            for i in y:
+                if isinstance(i,dict) and '#text' in i:
+                    manuf_list.append(i['#text'])
+                    d1[out_key] = manuf_list
+
+def _affected_organisms(value, out_key, d1, state):
+    d1['pharmacology'][out_key] = value["affected-organism"]
+
+def _food_interactions(value, out_key, d1, state):
+    food_interaction_list = []
+    # note: a single interaction is stored under the original field name
+    key = 'food-interactions'
+    for y in value.values():
+        if isinstance(y,list):
+            key = out_key
+            for i in y:
+                food_interaction_list.append(i)
+                d1[key] = food_interaction_list
+        else:
+            d1[key] = y
+
+def _sequences(value, out_key, d1, state):
+    for y in value.values():
+        if isinstance(y,dict) and '@format' in y:
+            d1[y['@format'] + '_sequences'] = y['#text'].replace('\n',' ')
+
+def _experimental_properties(value, out_key, d1, state):
+    d1_exp_properties = {}
+    def restr_properties_dict(dictionary):
+        k1 = property_key(dictionary['kind'])
+        if k1 == "isoelectric_point":
+            # make sure value are floats, if intervals, then list(float)
+            try:
+                d1_exp_properties[k1] = float(dictionary['value'])
+            except ValueError:
+                # not a float, maybe a range ? "5.6 - 7.6"
+                vals = dictionary['value'].split("-")
+                try:
+                    for i,val in enumerate([v for v in vals]):
+                        vals[i] = float(val)
+                    logging.info("Document ID '%s' has a range " % state['restr_dict']["_id"] + \
+                                 "as isoelectric_point: %s" % vals)
+                    d1_exp_properties[k1] = vals
+                except ValueError as e:
+                    # not something we can handle, skip it
+                    logging.warning("Document ID '%s' has non-convertible " % state['restr_dict']["_id"] + \
+                                    " value for isoelectric_point, field ignored: %s" % dictionary['value'])
+        else:
+            d1_exp_properties[k1] = dictionary['value']
+        return d1_exp_properties
+
+    for ele in value.values():
+        if isinstance(ele,list):
+            for _d in ele:
+                d1[out_key] = restr_properties_dict(_d)
+        if isinstance(ele,dict):
+            d1[out_key] = restr_properties_dict(ele)
+
+def _calculated_properties(value, out_key, d1, state):
+    def restr_properties_dict(dictionary):
+        kind = dictionary['kind']
+        val = dictionary['value']
+        state['predicted_properties'][property_key(kind)] = val
+        if kind in CALCULATED_PROPERTY_FIELDS:
+            d1[CALCULATED_PROPERTY_FIELDS[kind]] = val
+        elif kind == "InChIKey":
+            if val[0:9] == 'InChIKey=':
+                d1['inchi_key'] = val[9:]
+            else:
+                d1['inchi_key'] = val
+        elif kind == "Molecular Weight":
+            d1['weight'] = {'average':val}
+        elif kind == "Monoisotopic Weight":
+            d1['weight']['monoisotopic'] = val
+
+    for y in value.values():
+        if isinstance(y,list):
+            for _d in y:
+                restr_properties_dict(_d)
+        if isinstance(y,dict):
+            restr_properties_dict(y)
+
+def _external_identifiers(value, out_key, d1, state):
+    idents = value['external-identifier']
+    if not isinstance(idents,list):
+        # single identifier was never recorded
+        return
+    for ele in idents:
+        if isinstance(ele,dict) and 'resource' in ele:
+            resource = ele['resource']
+            if resource in EXTERNAL_ID_FIELDS:
+                d1[EXTERNAL_ID_FIELDS[resource]] = ele['identifier']
+            else:
+                d1[property_key(resource)] = ele['identifier']
+
+def _external_links(value, out_key, d1, state):
+    links = value['external-link']
+    if not isinstance(links,list):
+        # single link was never recorded
+        return
+    for ele in links:
+        if ele and 'resource' in ele and 'url' in ele:
+            d1[ele['resource'].lower().replace('.','_')] = ele['url']
+
+def _patents(value, out_key, d1, state):
+    if isinstance(value,dict):
+        for x in value:
+            d1[out_key] = value[x]
+
+def _inner_value(inner_key):
+    def handler(value, out_key, d1, state):
+        d1[out_key] = value[inner_key]
+    return handler
+
+def _pathways(value, out_key, d1, state):
+    if isinstance(value['pathway'],list):
+        _li = []
+        for ele in value['pathway']:
+            _li.append(restr_pathway_dict(ele))
+            d1[out_key] = _li
+    elif isinstance(value['pathway'],dict):
+        d1[out_key] = restr_pathway_dict(value['pathway'])
+
+def _proteins(inner_key):
+    # targets, enzymes, transporters, carriers
+    def handler(value, out_key, d1, state):
+        if isinstance(value[inner_key],list):
+            for dictionary in value[inner_key]:
+                state[out_key].append(restr_protein_dict(dictionary))
+        elif isinstance(value[inner_key],dict):
+            state[out_key].append(restr_protein_dict(value[inner_key]))
+    return handler
+
+def _atc_codes(value, out_key, d1, state):
+    codes = value['atc-code']
+    if isinstance(codes,dict):
+        codes = [codes]
+    if isinstance(codes,list):
+        for _d in codes:
+            if isinstance(_d,dict) and '@code' in _d:
+                state['atc_codes'].append(_d['@code'])
+
+# DrugBank field => (handler, output key, skip handler when value is empty)
+FIELD_HANDLERS = {
+        'name' : (_copy_value, 'name', True),
+        'drugbank-id' : (_drugbank_id, 'drugbank_id', True),
+        'description' : (_description, 'description', False),
+        'groups' : (_last_child, 'groups', False),
+        'classification' : (_copy_value, 'taxonomy', True),
+        'salts' : (_salts, 'salts', True),
+        'synonyms' : (_synonyms, 'synonyms', True),
+        'products' : (_products, 'products', True),
+        'packagers' : (_packagers, 'packagers', True),
+        'manufacturers' : (_manufacturers, 'manufacturers', True),
+        'categories' : (_last_child, 'categories', True),
+        "snp-effects" : (_pharmacology, 'snp_effects', True),
+        "snp-adverse-drug-reactions" : (_pharmacology, 'snp_adverse_drug_reactions', True),
+        'affected-organisms' : (_affected_organisms, 'affected_organisms', True),
+        'ahfs-codes' : (_last_child, 'ahfs_codes', True),
+        'food-interactions' : (_food_interactions, 'food_interactions', True),
+        'drug-interactions' : (_last_child, 'drug_interactions', True),
+        'sequences' : (_sequences, None, True),
+        'experimental-properties' : (_experimental_properties, 'experimental_properties', True),
+        'calculated-properties' : (_calculated_properties, None, True),
+        'external-identifiers' : (_external_identifiers, None, True),
+        'external-links' : (_external_links, None, True),
+        'patents' : (_patents, 'patents', True),
+        'international-brands' : (_inner_value('international-brand'), 'international_brands', True),
+        'mixtures' : (_inner_value('mixture'), 'mixtures', True),
+        'pathways' : (_pathways, 'pathways', True),
+        'targets' : (_proteins('target'), 'targets', True),
+        'enzymes' : (_proteins('enzyme'), 'enzymes', True),
+        'transporters' : (_proteins('transporter'), 'transporters', True),
+        'carriers' : (_proteins('carrier'), 'carriers', True),
+        'atc-codes' : (_atc_codes, None, True),
+        }
+for _field in ['indication', 'pharmacodynamics', 'mechanism-of-action', 'toxicity', 'metabolism',
+               'absorption', 'half-life', 'protein-binding', 'route-of-elimination',
+               'volume-of-distribution', 'clearance']:
+    FIELD_HANDLERS[_field] = (_pharmacology, _field.replace('-','_'), False)
+
+# boolean_convert() and value_convert_to_number() from biothings.utils.dataload
+# rebuild their key lists for every key of every nested dict, which was most
+# of restructure_dict() time. convert_booleans() and convert_numbers() below
+# apply the same rules, with these keys precomputed as sets.
+BOOLEAN_KEYS = ["predicted_properties.mddr_like_rule","predicted_properties.bioavailability",
+        "predicted_properties.ghose_filter","predicted_properties.rule_of_five","products.generic",
+        "products.otc","products.approved","products.pediatric-extension"]
+# dotfield components found at each level
+BOOLEAN_LEVELS = [set([k.split(".")[i] for k in BOOLEAN_KEYS if len(k.split(".")) > i])
+                  for i in range(max([len(k.split(".")) for k in BOOLEAN_KEYS]))]
+NUMBER_SKIPPED_KEYS = {"dpd","chemspider","chebi","pubchem_compound","pubchem_substance","bindingdb"}
+
+def convert_booleans(d, level=0):
+    """
+    Same as boolean_convert(d,BOOLEAN_KEYS,level) from biothings.utils.dataload
+    (values for BOOLEAN_KEYS, in dotfield notation, converted to booleans)
+    """
+    for key, val in d.items():
+        if isinstance(val, dict):
+            d[key] = convert_booleans(val)
+        if level < len(BOOLEAN_LEVELS) and key in BOOLEAN_LEVELS[level]:
+            if isinstance(val, (list,tuple)):
+                if val and isinstance(val[0],dict):
+                    d[key] = [convert_booleans(v,level+1) for v in val]
+                else:
+                    d[key] = [to_boolean(x) for x in val]
+            elif isinstance(val, dict):
+                d[key] = convert_booleans(val,level+1)
+            else:
+                d[key] = to_boolean(val)
+    return d
+
+def convert_numbers(d):
+    """
+    Same as value_convert_to_number(d,NUMBER_SKIPPED_KEYS) from biothings.utils.dataload
+    (string values converted to int/float, except for NUMBER_SKIPPED_KEYS)
+    """
+    for key, val in d.items():
+        if isinstance(val, dict):
+            convert_numbers(val)
+        if key not in NUMBER_SKIPPED_KEYS:
+            if isinstance(val, list):
+                d[key] = [convert_numbers(x) if isinstance(x, dict) else to_number(x) for x in val]
+            elif isinstance(val, tuple):
+                d[key] = tuple([convert_numbers(x) if isinstance(x, dict) else to_number(x) for x in val])
+            else:
+                d[key] = to_number(val)
+    return d
+
 def restructure_dict(dictionary):
     restr_dict = dict()
     d1 = dict()
-    pred_properties_dict = {}
-    products_list = []
-    categories_list = []
-    enzymes_list = []
-    targets_list = []
-    carriers_list = []
-    transporters_list = []
-    atccode_list = []
+    state = {
+            'restr_dict' : restr_dict,
+            'predicted_properties' : {},
+            'products' : [],
+            'enzymes' : [],
+            'targets' : [],
+            'carriers' : [],
+            'transporters' : [],
+            'atc_codes' : [],
+            }
 
     for key,value in iter(dictionary.items()):
-        if key == 'name' and value:
-            d1[key] = value
-
-        elif key == 'drugbank-id' and value:
-            id_list = []
-            if isinstance(value,list):
-                for ele in value:
-                    if isinstance(ele,collections.OrderedDict):
-                        assert "@primary" in ele
-                        for x,y in iter(ele.items()):
-                            if x == '#text':
-                                # make sure we always have DB ID as drugbank_id
-                                d1.update({'drugbank_id' : y})
-                                restr_dict['_id'] = y
-
-                    if isinstance(ele,str):
-                        key = key.replace('-','_')
-                        id_list.append(ele)
-                        d1.update({'accession_number':id_list})
-
-            elif isinstance(value,dict) or isinstance(value,collections.OrderedDict):
-                for x,y in iter(value.items()):
-                    if x == '#text':
-                        key = key.replace('-','_')
-                        id_list.append(y)
-                        d1.update({key:id_list})
-                        restr_dict['_id'] = y
-
-
-        elif key == 'description':
-            d1.update({'pharmacology':{key:value}})
-
-        elif key == 'groups':
-            for i,j in iter(value.items()):
-                d1[key] = j
-
-        elif key == 'indication':
-            d1['pharmacology'].update({key:value})
-
-        elif key == 'pharmacodynamics':
-            d1['pharmacology'].update({key:value})
-
-        elif key == 'mechanism-of-action':
-            key = key.replace('-','_')
-            d1['pharmacology'].update({key:value})
-
-        elif key == 'toxicity':
-            d1['pharmacology'].update({key:value})
-
-        elif key == 'metabolism':
-            d1['pharmacology'].update({key:value})
-
-        elif key == 'absorption':
-            d1['pharmacology'].update({key:value})
-
-        elif key == 'half-life':
-            key = key.replace('-','_')
-            d1['pharmacology'].update({key:value})
-
-        elif key == 'protein-binding':
-            key = key.replace('-','_')
-            d1['pharmacology'].update({key:value})
-
-        elif key == 'route-of-elimination':
-            key = key.replace('-','_')
-            d1['pharmacology'].update({key:value})
-
-        elif key == 'volume-of-distribution':
-            key = key.replace('-','_')
-            d1['pharmacology'].update({key:value})
-
-        elif key == 'clearance':
-            d1['pharmacology'].update({key:value})
-
-        elif key == 'classification' and value:
-            for m,n in iter(value.items()):
-                m = m.lower().replace('-','_')
-                d1.update({'taxonomy':value})
-
-        elif key == 'salts'and value:
-            salts_list = []
-
-            for m,n in iter(value.items()):
-                if isinstance(n,list):
-                    for ele in n:
-                        for k in ele:
-                            if k == 'name':
-                                salts_list.append(ele[k])
-                                d1.update({key:salts_list})
-
-                elif isinstance(n,dict) or isinstance(n,collections.OrderedDict):
-                    d1.update({key:n['name']})
-
-        elif key == 'synonyms' and value:
-            synonym_list = []
-            if isinstance(value,collections.OrderedDict):
-                for x,y in iter(value.items()):
-                    for ele in y:
-                        for name in ele:
-                            if name == '#text':
-                                synonym_list.append(ele[name])
-                                d1.update({key:synonym_list})
-
-        elif key == 'products'and value:
-            def restr_product_dict(dictionary):
-                products_dict = {}
-                for x in dictionary:
-                    if x == 'name':
-                        products_dict[x] = dictionary[x]
-                    elif x == 'dosage-form':
-                        products_dict['dosage_form'] = dictionary[x]
-                    elif x == 'strength':
-                        products_dict[x] = dictionary[x]
-                    elif x == 'route':
-                        products_dict[x] = dictionary[x]
-                    elif x == 'over-the-counter':
-                        products_dict['otc'] = dictionary[x]
-                    elif x == 'generic':
-                        products_dict[x] = dictionary[x]
-                    elif x == 'ndc-id':
-                        products_dict['ndc_id'] = dictionary[x]
-                    elif x == 'ndc-product-code':
-                        products_dict['ndc_product_code'] = dictionary[x]
-                    elif x == 'dpd-id':
-                        products_dict['dpd'] = dictionary[x]
-                    elif x == 'started-marketing-on':
-                        products_dict[x.replace('-','_')] = dictionary[x]
-                    elif x == 'ended-marketing-on':
-                        products_dict[x.replace('-','_')] = dictionary[x]
-                    elif x == 'fda-application-number':
-                        products_dict[x.replace('-','_')] = dictionary[x]
-                    elif x == 'approved':
-                        products_dict[x] = dictionary[x]
-                    elif x == 'country':
-                        products_dict[x] = dictionary[x]
-                    elif x == 'source':
-                        products_dict[x] = dictionary[x]
-                return products_dict
-
-            for x,y in iter(value.items()):
-                if isinstance(y,dict) or isinstance(y,collections.OrderedDict):
-                    _d = restr_product_dict(y)
-                    products_list.append(_d)
-
-                elif isinstance(y,list):
-                    for _d in y:
-                        products_list.append(restr_product_dict(_d))
-
-        elif key == 'packagers' and value:
-            pack_list = []
-            for pack in value:
-                for pack1 in value[pack]:
-                    for s in pack1:
-                        if s == 'name' and pack1[s]:
-                            pack_list.append(pack1[s])
-                            d1.update({key:pack_list})
-
-        elif key == 'manufacturers' and value:
-            manuf_list = []
-            for x,y in iter(value.items()):
-                if isinstance(y,dict) or isinstance(y,collections.OrderedDict):
-                    for i in y:
-                        if i == '#text':
-                            manuf_list.append(y[i])
-                            d1.update({key:manuf_list})
-
-                if isinstance(y,list):
-                    for i in y:
-                        for m,n in iter(i.items()):
-                            if m == '#text':
-                                manuf_list.append(n)
-                                d1.update({key:manuf_list})
-
-        elif key == 'categories' and value:
-            for x,y in iter(value.items()):
-                d1.update({key:y})
-
-        elif key == "snp-effects" and value:
-            key = key.replace('-','_')
-            d1['pharmacology'].update({key:value})
-
-        elif key == "snp-adverse-drug-reactions" and value:
-            key = key.replace('-','_')
-            d1['pharmacology'].update({key:value})
-
-        elif key == 'affected-organisms' and value:
-            for x,y in iter(value.items()):
-                key = key.replace('-','_')
-                d1['pharmacology'].update({key:value["affected-organism"]})
-
-        elif key == 'ahfs-codes' and value:
-            for x in value:
-                key = key.replace('-','_')
-                d1.update({key:value[x]})
-
-        elif key == 'food-interactions' and value:
-            food_interaction_list = []
-            for x,y in iter(value.items()):
-                if isinstance(y,list):
-                    key = key.replace('-','_')
-                    for i in y:
-                        food_interaction_list.append(i)
-                        d1.update({key:food_interaction_list})
-                else:
-                    d1.update({key:y})
-
-        elif key == 'drug-interactions' and value:
-            key = key.replace('-','_')
-            for x,y in iter(value.items()):
-                d1.update({key:y})
-
-        elif key == 'sequences'and value:
-            for x,y in iter(value.items()):
-                for i in y:
-                    if i == '@format':
-                        str1 = y[i]+'_sequences'
-                        d1[str1] = y['#text'].replace('\n',' ')
-
-        elif key == 'experimental-properties' and value:
-            d1_exp_properties = {}
-            def restr_properties_dict(dictionary):
-                for x,y in iter(dictionary.items()):
-                    k1 = dictionary['kind']
-                    k1 = k1.lower().replace(' ','_').replace('-','_')
-                    if k1 == "isoelectric_point":
-                        # make sure value are floats, if intervals, then list(float)
-                        try:
-                            d1_exp_properties[k1] = float(dictionary['value'])
-                        except ValueError:
-                            # not a float, maybe a range ? "5.6 - 7.6"
-                            vals = dictionary['value'].split("-")
-                            try:
-                                for i,val in enumerate([v for v in vals]):
-                                    vals[i] = float(val)
-                                logging.info("Document ID '%s' has a range " % restr_dict["_id"] + \
-                                             "as isoelectric_point: %s" % vals)
-                                d1_exp_properties[k1] = vals
-                            except ValueError as e:
-                                # not something we can handle, skip it
-                                logging.warning("Document ID '%s' has non-convertible " % restr_dict["_id"] + \
-                                                " value for isoelectric_point, field ignored: %s" % dictionary['value'])
-                                continue
-                    else:
-                        d1_exp_properties[k1] = dictionary['value']
-                return d1_exp_properties
-
-            for ele in value:
-                key = key.replace('-','_')
-                if isinstance(value[ele],list):
-                    for _d in value[ele]:
-                        _d = restr_properties_dict(_d)
-                        d1.update({key:_d})
-
-                if isinstance(value[ele],dict) or isinstance(value[ele],collections.OrderedDict):
-                    _d = restr_properties_dict(value[ele])
-                    d1.update({key:_d})
-
-        elif key == 'calculated-properties' and value:
-            def restr_properties_dict(dictionary):
-                for x in dictionary:
-                    k = dictionary['kind']
-                    k = k.lower().replace(' ','_').replace('-','_')
-                    pred_properties_dict[k] = dictionary['value']
-
-                    if dictionary['kind'] == "IUPAC Name":
-                        d1.update({'iupac':dictionary['value']})
-                    elif dictionary['kind'] == "SMILES":
-                        d1.update({'smiles':dictionary['value']})
-                    elif dictionary['kind'] == "Molecular Formula":
-                        d1.update({'formula':dictionary['value']})
-                    elif dictionary['kind'] == "InChI":
-                        d1.update({'inchi':dictionary['value']})
-                    elif dictionary['kind'] == "InChIKey":
-                        if dictionary['value'][0:9] == 'InChIKey=':
-                            d1.update({'inchi_key':dictionary['value'][9:]})
-                        else:
-                            d1.update({'inchi_key':dictionary['value']})
-                    elif dictionary['kind'] == "Molecular Weight":
-                        d1.update({'weight':{'average':dictionary['value']}})
-                    elif dictionary['kind'] == "Monoisotopic Weight":
-                        d1['weight'].update({'monoisotopic':dictionary['value']})
-
-            for x,y in iter(value.items()):
-                if isinstance(y,list):
-                    for _d in y:
-                        _d = restr_properties_dict(_d)
-
-                if isinstance(y,dict) or isinstance(y,collections.OrderedDict):
-                    _d = restr_properties_dict(y)
-
-        elif key == 'external-identifiers' and value:
-            for ele in value['external-identifier']:
-                for x in ele:
-                    if x == 'resource':
-                        if ele[x] == "Drugs Product Database (DPD)":
-                            d1['dpd'] = ele['identifier']
-                        elif ele[x] == "KEGG Drug":
-                            d1['kegg_drug'] = ele['identifier']
-                        elif ele[x] == "KEGG Compound":
-                            d1['kegg_compound'] = ele['identifier']
-                        elif ele[x] == "National Drug Code Directory":
-                            d1['ndc_directory'] = ele['identifier']
-                        elif ele[x] == "PharmGKB":
-                            d1['pharmgkb'] = ele['identifier']
-                        elif ele[x] == "UniProtKB":
-                            d1['uniprotkb'] = ele['identifier']
-                        elif ele[x] == "Wikipedia":
-                                d1['wikipedia'] = ele['identifier']
-                        elif ele[x] == "ChemSpider":
-                                d1['chemspider'] = ele['identifier']
-                        elif ele[x] == "ChEBI":
-                                d1['chebi'] = ele['identifier']
-                        elif ele[x] == "PubChem Compound":
-                                d1['pubchem_compound'] = ele['identifier']
-                        elif ele[x] == "PubChem Substance":
-                                d1['pubchem_substance'] = ele['identifier']
-                        elif ele[x] == "UniProtKB":
-                                d1['uniprotkb'] = ele['identifier']
-                        elif ele[x] == "GenBank":
-                                d1['genbank'] = ele['identifier']
-                        else:
-                            source = ele[x].lower().replace('-','_').replace(' ','_')
-                            d1[source]=ele['identifier']
-
-        elif key == 'external-links' and value:
-            if isinstance(value['external-link'],list):
-                for ele in value['external-link']:
-                    for x in ele:
-                        try:
-                            resource = ele['resource']
-                            d1[resource.lower().replace('.','_')] = ele['url']
-                        except:
-                            pass
-            else:
-                try:
-                    resource = ele['resource']
-                    d1[resource.lower().replace('.','_')] = ele['url']
-                except:
-                    pass
-
-
-
-        elif key == 'patents'and value:
-            if isinstance(value,dict):
-                for x in value:
-                    d1.update({key:value[x]})
-
-        elif key == 'international-brands' and value:
-            key = key.lower().replace('-','_')
-            d1.update({key:value['international-brand']})
-
-        elif key == 'mixtures' and value:
-            d1.update({key:value['mixture']})
-
-        elif key == 'pathways' and value:
-            _li = []
-            def restr_pathway_dict(dictionary):
-                _dict = {}
-                for x,y in iter(dictionary.items()):
-                    if x == 'smpdb-id':
-                        _dict.update({'smpdb_id':y})
-                    elif x == 'name':
-                        _dict.update({x:y})
-                    elif x == 'drugs':
-                        _dict.update({x:y['drug']})
-                    elif x == 'enzymes':
-                        _dict.update({x:y})
-                return _dict
-
-            if isinstance(value['pathway'],list):
-                for ele in value['pathway']:
-                    _dict = restr_pathway_dict(ele)
-                    _li.append(_dict)
-                    d1.update({key:_li})
-
-            elif isinstance(value['pathway'],dict) or isinstance(value['pathway'],OrderedDict):
-                _dict = restr_pathway_dict(value['pathway'])
-                d1.update({key:_dict})
-
-        elif key == 'targets' and value:
-            if isinstance(value['target'],list):
-                for dictionary in value['target']:
-                    _dict = restr_protein_dict(dictionary)
-                    targets_list.append(_dict)
-
-            elif isinstance(value['target'],dict) or isinstance(value['target'],OrderedDict):
-                _dict = restr_protein_dict(value['target'])
-                targets_list.append(_dict)
-
-        elif key == 'enzymes' and value:
-            if isinstance(value['enzyme'],list):
-                for dictionary in value['enzyme']:
-                    _dict = restr_protein_dict(dictionary)
-                    enzymes_list.append(_dict)
-
-            elif isinstance(value['enzyme'],dict) or isinstance(value['enzyme'],OrderedDict):
-                _dict = restr_protein_dict(value['enzyme'])
-                enzymes_list.append(_dict)
-
-        elif key == 'transporters' and value:
-            if isinstance(value['transporter'],list):
-                for dictionary in value['transporter']:
-                    _dict = restr_protein_dict(dictionary)
-                    transporters_list.append(_dict)
-
-            elif isinstance(value['transporter'],dict) or isinstance(value['transporter'],OrderedDict):
-                _dict = restr_protein_dict(value['transporter'])
-                transporters_list.append(_dict)
-
-        elif key == 'carriers' and value:
-            if isinstance(value['carrier'],list):
-                for dictionary in value['carrier']:
-                    _dict = restr_protein_dict(dictionary)
-                    carriers_list.append(_dict)
-
-            elif isinstance(value['carrier'],dict) or isinstance(value['carrier'],OrderedDict):
-                _dict = restr_protein_dict(value['carrier'])
-                carriers_list.append(_dict)
-
-        elif key == 'atc-codes' and value:
-            def restr_atccode_dict(dictionary):
-                for x in dictionary:
-                    if x == '@code':
-                        atccode_list.append(dictionary[x])
-                return atccode_list
-
-            if isinstance(value['atc-code'], list):
-                for _d in value['atc-code']:
-                    restr_atccode_dict(_d)
-
-            elif isinstance(value['atc-code'], dict) or isinstance(value['atc-code'], OrderedDict):
-                restr_atccode_dict(value['atc-code'])
-
-
-    d1['atc_codes'] = atccode_list
-    d1['targets'] = targets_list
-    d1['carriers'] = carriers_list
-    d1['enzymes'] = enzymes_list
-    d1['transporters'] = transporters_list
-    d1['predicted_properties'] = pred_properties_dict
-    d1['products'] = products_list
+        try:
+            handler, out_key, skip_empty = FIELD_HANDLERS[key]
+        except KeyError:
+            continue
+        if skip_empty and not value:
+            continue
+        handler(value,out_key,d1,state)
+
+    d1['atc_codes'] = state['atc_codes']
+    d1['targets'] = state['targets']
+    d1['carriers'] = state['carriers']
+    d1['enzymes'] = state['enzymes']
+    d1['transporters'] = state['transporters']
+    d1['predicted_properties'] = state['predicted_properties']
+    d1['products'] = state['products']
     restr_dict['drugbank'] = d1
     restr_dict = unlist(restr_dict)
     restr_dict = dict_sweep(restr_dict,vals=[None,math.inf,"INF",".", "-", "", "NA", "none", " ",
         "Not Available", "unknown","null","None"])
-    if restr_dict["drugbank"].get('inchi_key') == "IOFPEOPOAMOMBE-MRVPVSSYSA-N":
-        print(repr(restr_dict["drugbank"].get("pdb")))
-    restr_dict = boolean_convert(restr_dict,["predicted_properties.mddr_like_rule",
-        "predicted_properties.bioavailability","predicted_properties.ghose_filter",
-        "predicted_properties.rule_of_five","products.generic","products.otc",
-        "products.approved","products.pediatric-extension"])
-    restr_dict = value_convert_to_number(restr_dict,skipped_keys=["dpd","chemspider","chebi","pubchem_compound","pubchem_substance","bindingdb"])
+    restr_dict = convert_booleans(restr_dict)
+    restr_dict = convert_numbers(restr_dict)
     return restr_dict
-
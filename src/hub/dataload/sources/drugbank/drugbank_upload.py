@@ -2,8 +2,10 @@ import os
 import glob
 import pymongo
 
-from .drugbank_parser import load_data
+from config import HUB_MAX_WORKERS
+from .drugbank_parser import load_data, shard_offsets
 from hub.dataload.uploader import BaseDrugUploader
+from biothings.hub.dataload.uploader import ParallelizedSourceUploader
 import biothings.hub.dataload.storage as storage
 from biothings.utils.common import unzipall
 
@@ -16,23 +18,40 @@ SRC_META = {
         }
 
 
-class DrugBankUploader(BaseDrugUploader):
+class DrugBankUploader(BaseDrugUploader,ParallelizedSourceUploader):
 
     name = "drugbank"
     storage_class = storage.IgnoreDuplicatedStorage
     __metadata__ = {"src_meta" : SRC_META}
 
-    def load_data(self,data_folder):
-        xmlfiles = glob.glob(os.path.join(data_folder,"*.xml"))
+    # number of byte-range shards the XML file is split into (one job each)
+    NUM_SHARDS = HUB_MAX_WORKERS
+
+    def get_input_file(self):
+        xmlfiles = glob.glob(os.path.join(self.data_folder,"*.xml"))
         if not xmlfiles:
             self.logger.info("Unzipping drugbank archive")
-            unzipall(data_folder)
-            self.logger.info("Load data from '%s'" % data_folder)
-            xmlfiles = glob.glob(os.path.join(data_folder,"*.xml"))
+            unzipall(self.data_folder)
+            xmlfiles = glob.glob(os.path.join(self.data_folder,"*.xml"))
         assert len(xmlfiles) == 1, "Expecting one xml file, got %s" % repr(xmlfiles)
         input_file = xmlfiles.pop()
         assert os.path.exists(input_file), "Can't find input file '%s'" % input_file
-        return load_data(input_file)
+        return input_file
+
+    def prepare_update(self):
+        # unzipping and scanning the XML file for shard boundaries take a while
+        self.input_file = self.get_input_file()
+        self.shards = shard_offsets(self.input_file,max(self.__class__.NUM_SHARDS,1))
+        self.logger.info("Split '%s' into %s shards" % (self.input_file,len(self.shards)))
+
+    def jobs(self):
+        # this will generate arguments for self.load.data() method, allowing parallelization
+        # (shards are computed by prepare_update(), in a thread)
+        return [(self.input_file,start,end) for start,end in self.shards]
+
+    def load_data(self,input_file,start=None,end=None):
+        self.logger.info("Load data from file '%s' (bytes %s-%s)" % (input_file,start,end))
+        return load_data(input_file,start,end)
 
     def post_update_data(self, *args, **kwargs):
         for idxname in ["drugbank.drugbank_id","drugbank.chebi","drugbank.inchi"]:
@@ -0,0 +1,56 @@
+import os
+import shutil
+import asyncio
+from functools import partial
+
+import biothings, config
+biothings.config_for_app(config)
+
+from config import DATA_ARCHIVE_ROOT, HUB_MAX_WORKERS
+from biothings.hub.dataload.dumper import ManualDumper, DumperException
+
+from .drugcentral_parser import TABLES, partition_table
+
+
+class DrugCentralDumper(ManualDumper):
+    """
+    DrugCentral tables are exported manually from DrugCentral database, into
+    a folder named after the release in SRC_ROOT_FOLDER (ex: "2018.6"), then
+    registered with dump("drugcentral",path="2018.6"). Tables are then grouped
+    and split in parts, loaded by DrugCentralUploader (one job per part).
+    """
+
+    SRC_NAME = "drugcentral"
+    SRC_ROOT_FOLDER = os.path.join(DATA_ARCHIVE_ROOT, SRC_NAME)
+    # number of parts struct ids are split into (one upload job each)
+    NUM_PARTS = HUB_MAX_WORKERS
+    PARTS_FOLDER = "parts"
+
+    def post_dump(self, *args, job_manager=None, **kwargs):
+        for _, _, filename in TABLES:
+            if not os.path.exists(os.path.join(self.new_data_folder,filename)):
+                raise DumperException("Can't find table '%s' in '%s'" % (filename,self.new_data_folder))
+        parts_folder = os.path.join(self.new_data_folder,self.__class__.PARTS_FOLDER)
+        if os.path.exists(parts_folder):
+            shutil.rmtree(parts_folder)
+        num_parts = max(self.__class__.NUM_PARTS,1)
+        # post_dump() runs in a thread, tables are grouped by job_manager's
+        # processes (one table each), scheduled from its event loop
+        grouped = asyncio.run_coroutine_threadsafe(self.partition_tables(parts_folder,num_parts,job_manager),
+                                                   job_manager.loop)
+        for (field,_,_),cnt in zip(TABLES,grouped.result()):
+            self.logger.info("Table '%s': %s struct ids" % (field,cnt))
+        self.logger.info("Tables split in %s parts, ready to be uploaded" % num_parts)
+
+    @asyncio.coroutine
+    def partition_tables(self, parts_folder, num_parts, job_manager):
+        jobs = []
+        for field,_,_ in TABLES:
+            pinfo = self.get_pinfo()
+            pinfo["step"] = "post_dump"
+            pinfo["description"] = "group table '%s'" % field
+            job = yield from job_manager.defer_to_process(pinfo,
+                    partial(partition_table,field,self.new_data_folder,parts_folder,num_parts))
+            jobs.append(job)
+        res = yield from asyncio.gather(*jobs)
+        return res
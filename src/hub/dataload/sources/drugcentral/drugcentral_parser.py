@@ -1,148 +1,133 @@
+import os
+import json
 import pandas as pd
-from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+import heapq
+from biothings.utils.common import iter_n
 from biothings.utils.dataload import dict_sweep, unlist
-import json
-import requests
 
-from . import file_path_pharma_class, file_path_faers, file_path_act, file_path_omop, file_path_approval, file_path_drug_dosage, file_path_structure, file_path_identifier,file_path_synonym
+from hub.dataload.crosswalk import get_crosswalk
+
+# Each table is read once, sorted by struct id, then its rows are grouped
+# while iterating over it. process_*() functions yield (struct id, value)
+# in struct id order. After download, each table is grouped on its own
+# (see DrugCentralDumper.post_dump()) and its groups split in parts (struct
+# id modulo number of parts), stored as JSON lines. Each part is then loaded
+# on its own (see DrugCentralUploader.jobs()), merging the nine tables'
+# files in a single pass: only one group per table is held in memory, and
+# documents are built, and resolved from xrefs, one block at a time.
+
+def read_table(file_path, key, **kwargs):
+    """
+    Read CSV file_path into a DataFrame sorted by key column (rows sharing
+    the same key stay in file order), with null values replaced by None.
+    """
+    df = pd.read_csv(file_path, **kwargs)
+    df = df[df[key].notnull()]
+    df = df.sort_values(key, kind='mergesort')
+    return df.astype(object).where((pd.notnull(df)), None)
+
+def iter_groups(df, key):
+    """
+    Iterate over (key, records) for each group of rows sharing the same key,
+    records being dicts. df must be sorted by key.
+    """
+    columns = list(df.columns)
+    rows = df.itertuples(index=False, name=None)
+    for strucid, group in groupby(rows, key=itemgetter(columns.index(key))):
+        yield strucid, [dict(zip(columns, row)) for row in group]
 
 def process_pharmacology_action(file_path_pharma_class):
-    df_drugcentral_pharma_class = pd.read_csv(file_path_pharma_class, sep=",", names=['_id', 'struc_id', 'role', 'description', 'code', 'source'])
-    df_drugcentral_pharma_class['source_name'] = df_drugcentral_pharma_class.apply(lambda row: row.source + '_' + row.role, axis=1)
-    df_drugcentral_pharma_class = df_drugcentral_pharma_class.where((pd.notnull(df_drugcentral_pharma_class)), None)
-    d = []
-    for strucid, subdf in df_drugcentral_pharma_class.groupby('struc_id'):
-        records = subdf.to_dict(orient="records")
-        pharm_class_related = defaultdict(list)
-        for _record in records:
-            pharm_class_related[_record['source_name'].lower().replace("chebi_has role", "chebi")].append({'description': _record['description'], 'code': _record['code']})
-        drecord = {"_id": strucid, "pharmacology_class": pharm_class_related}
-        d.append(drecord)
-    return {x['_id']: x['pharmacology_class'] for x in d}
+    df = read_table(file_path_pharma_class, 'struc_id', sep=",", names=['_id', 'struc_id', 'role', 'description', 'code', 'source'])
+    df['source_name'] = (df['source'] + '_' + df['role']).str.lower().str.replace("chebi_has role", "chebi", regex=False)
+    for strucid, group in groupby(df[['struc_id', 'source_name', 'description', 'code']].itertuples(index=False, name=None),
+                                  key=itemgetter(0)):
+        pharm_class_related = {}
+        for _, source_name, description, code in group:
+            pharm_class_related.setdefault(source_name, []).append({'description': description, 'code': code})
+        yield strucid, pharm_class_related
 
 def process_faers(file_path_faers):
     """
     # TODO: JSON field naming needs to be confirmed
     """
-    df_drugcentral_faers = pd.read_csv(file_path_faers, sep=",", names=['_id', 'struc_id', 'meddra_term', 'meddra_code', 'level', 'llr', 'llr_threshold', 'drug_ae', 'drug_no_ae', 'no_drug_ae', 'no_drug_no_ar'])
-    df_drugcentral_faers = df_drugcentral_faers.where((pd.notnull(df_drugcentral_faers)), None)    
-    d = []
-    for strucid, subdf in df_drugcentral_faers.groupby('struc_id'):
-        records = subdf.to_dict(orient="records")
-        faers_related = [{k: v for k, v in record.items() if k not in {'struc_id', '_id'}} for record in records]
-        drecord = {"_id": strucid, "fda_adverse_event": faers_related}
-        d.append(drecord)
-    return {x['_id']: x['fda_adverse_event'] for x in d}
+    df = read_table(file_path_faers, 'struc_id', sep=",", names=['_id', 'struc_id', 'meddra_term', 'meddra_code', 'level', 'llr', 'llr_threshold', 'drug_ae', 'drug_no_ae', 'no_drug_ae', 'no_drug_no_ar'])
+    for strucid, records in iter_groups(df.drop(columns=['_id']), 'struc_id'):
+        for record in records:
+            del record['struc_id']
+        yield strucid, records
+
+# act table columns not kept in bioactivity records
+ACT_EXCLUDED = ['act_id', 'target_id', 'tdl', 'act_comment', "act_source_url", "moa_source_url", 'relation', "act_ref_id", "moa_ref_id", 'first_in_class']
 
 def process_act(file_path_act):
-    df_drugcentral_act = pd.read_csv(file_path_act, sep=",", names=["act_id", "struct_id", "target_id", "target_name", "target_class", "accession", "gene", "swissprot", "act_value", "act_unit", "act_type", "act_comment", "act_source", "relation", "moa", "moa_source", "act_source_url", "moa_source_url", "action_type", "first_in_class", "tdl", "act_ref_id", "moa_ref_id", "organism"])
-    df_drugcentral_act = df_drugcentral_act.where((pd.notnull(df_drugcentral_act)), None)
-    d = []
-    for strucid, subdf in df_drugcentral_act.groupby('struct_id'):
-        records = subdf.to_dict(orient="records")
+    df = read_table(file_path_act, 'struct_id', sep=",", names=["act_id", "struct_id", "target_id", "target_name", "target_class", "accession", "gene", "swissprot", "act_value", "act_unit", "act_type", "act_comment", "act_source", "relation", "moa", "moa_source", "act_source_url", "moa_source_url", "action_type", "first_in_class", "tdl", "act_ref_id", "moa_ref_id", "organism"])
+    # uniprot entries, as lists of (accession, gene, swissprot), or None when
+    # these fields don't have the same number of values
+    splitted = [[v.split('|') if v else [None] * 10 for v in df[col]] for col in ('accession', 'gene', 'swissprot')]
+    uniprots = [list(zip(*row)) if len(row[0]) == len(row[1]) == len(row[2]) else None
+                for row in zip(*splitted)]
+    df = df.drop(columns=ACT_EXCLUDED + ['accession', 'gene', 'swissprot'])
+    df['uniprot'] = pd.Series(uniprots, index=df.index, dtype=object)
+    for strucid, records in iter_groups(df, 'struct_id'):
         pharm_class_related = []
-        for _record in records:
-            _summary = {'uniprot': []}
-            if _record['accession']:
-                accession = _record['accession'].split('|')
-            else:
-                accession = [None for i in range(10)]
-            if _record['gene']:
-                gene = _record['gene'].split('|')
-            else:
-                gene = [None for i in range(10)]
-            if _record['swissprot']:
-                swissprot = _record['swissprot'].split('|')
-            else:
-                swissprot = [None for i in range(10)]
-            if not len(accession) == len(gene) == len(swissprot):
+        for record in records:
+            if record['uniprot'] is None:
                 continue
-            for i in range(len(accession)):
-                _summary['uniprot'].append({'uniprot_id': accession[i], 'gene_symbol': gene[i], 'swissprot_entry': swissprot[i]})
-            for k, v in _record.items():
-                if k not in ['uniprot', 'act_id', 'struct_id', 'target_id', 'accession', 'gene', 'swissprot', 'tdl', 'act_comment', "act_source_url", "moa_source_url", 'relation', "act_ref_id", "moa_ref_id", 'first_in_class']:
-                    _summary[k] = v
+            _summary = {'uniprot': [{'uniprot_id': accession, 'gene_symbol': gene, 'swissprot_entry': swissprot}
+                                    for accession, gene, swissprot in record.pop('uniprot')]}
+            del record['struct_id']
+            _summary.update(record)
             pharm_class_related.append(_summary)
-        drecord = {"_id": strucid, "bioactivity": pharm_class_related}
-        d.append(drecord)
-    return {x['_id']: x['bioactivity'] for x in d}
+        yield strucid, pharm_class_related
 
 def process_omop(file_path_omop):
-    df_drugcentral_omop = pd.read_csv(file_path_omop, sep=",", names=['_id', 'struct_id', 'concept_id', 'relationship_name', 'concept_name', 'umls_cui', 'snomed_full_name', 'cui_semantic_type', 'snomed_conceptid'])
-    df_drugcentral_omop = df_drugcentral_omop.where((pd.notnull(df_drugcentral_omop)), None)
-    d = []
-    for strucid, subdf in df_drugcentral_omop.groupby('struct_id'):
-        records = subdf.to_dict(orient="records")
-        omop_related = defaultdict(list)
-        for _record in records:
-            if _record['snomed_conceptid']:
-                _record['snomed_conceptid'] = int(_record['snomed_conceptid'])
-            omop_related[_record['relationship_name'].lower()].append({'umls_cui': _record['umls_cui'], 'concept_name': _record['concept_name'], 'snomed_full_name': _record['snomed_full_name'], 'cui_semantic_type': _record['cui_semantic_type'], 'snomed_concept_id': _record['snomed_conceptid']})
-        drecord = {"_id": strucid, "drug_use": omop_related}
-        d.append(drecord)
-    return {x['_id']: x['drug_use'] for x in d}
+    df = read_table(file_path_omop, 'struct_id', sep=",", names=['_id', 'struct_id', 'concept_id', 'relationship_name', 'concept_name', 'umls_cui', 'snomed_full_name', 'cui_semantic_type', 'snomed_conceptid'])
+    df['relationship_name'] = df['relationship_name'].str.lower()
+    df['snomed_concept_id'] = pd.Series([int(v) if v else v for v in df['snomed_conceptid']], index=df.index, dtype=object)
+    for strucid, group in groupby(df[['struct_id', 'relationship_name', 'umls_cui', 'concept_name', 'snomed_full_name', 'cui_semantic_type', 'snomed_concept_id']].itertuples(index=False, name=None),
+                                  key=itemgetter(0)):
+        omop_related = {}
+        for row in group:
+            omop_related.setdefault(row[1], []).append(dict(zip(['umls_cui', 'concept_name', 'snomed_full_name', 'cui_semantic_type', 'snomed_concept_id'], row[2:])))
+        yield strucid, omop_related
 
 def process_approval(file_path_approval):
-    df_drugcentral_approval = pd.read_csv(file_path_approval, sep=",", names=['_id', 'struct_id', 'date', 'agency', 'company', 'orphan'])
-    df_drugcentral_approval = df_drugcentral_approval.where((pd.notnull(df_drugcentral_approval)), None)
-    d = []
-    for strucid, subdf in df_drugcentral_approval.groupby('struct_id'):
-        records = subdf.to_dict(orient="records")
-        approval_related = [{k: v for k, v in record.items() if k not in {'struct_id', '_id'}} for record in records]
-        drecord = {"_id": strucid, "approval": approval_related}
-        d.append(drecord)
-    return {x['_id']: x['approval'] for x in d}
+    df = read_table(file_path_approval, 'struct_id', sep=",", names=['_id', 'struct_id', 'date', 'agency', 'company', 'orphan'])
+    for strucid, records in iter_groups(df.drop(columns=['_id']), 'struct_id'):
+        for record in records:
+            del record['struct_id']
+        yield strucid, records
 
 def process_drug_dosage(file_path_drug_dosage):
-    df_drugcentral_drug_dosage = pd.read_csv(file_path_drug_dosage, sep=",", names=['_id', 'atc_code', 'dosage', 'unit', 'route', 'comment', 'struct_id'])
-    df_drugcentral_drug_dosage = df_drugcentral_drug_dosage.where((pd.notnull(df_drugcentral_drug_dosage)), None)
-    d = []
-    for strucid, subdf in df_drugcentral_drug_dosage.groupby('struct_id'):
-        records = subdf.to_dict(orient="records")
-        drug_dosage_related = [{k: v for k, v in record.items() if k not in {'struct_id', '_id', 'atc_code', 'comment'}} for record in records]
-        drecord = {"_id": strucid, "drug_dosage": drug_dosage_related}
-        d.append(drecord)
-    return {x['_id']: x['drug_dosage'] for x in d}
+    df = read_table(file_path_drug_dosage, 'struct_id', sep=",", names=['_id', 'atc_code', 'dosage', 'unit', 'route', 'comment', 'struct_id'])
+    for strucid, records in iter_groups(df.drop(columns=['_id', 'atc_code', 'comment']), 'struct_id'):
+        for record in records:
+            del record['struct_id']
+        yield strucid, records
 
 
 def process_synonym(file_path_synonym):
-    df_drugcentral_synonym = pd.read_csv(file_path_synonym, sep=",", names=["_id", "struct_id", 'synonym', 'pref', 'parent', 's2'])
-    df_drugcentral_synonym = df_drugcentral_synonym.where((pd.notnull(df_drugcentral_synonym)), None)
-    d = []
-    for strucid, subdf in df_drugcentral_synonym.groupby('struct_id'):
-        records = subdf.to_dict(orient="records")
-        synonym_related = []
-        for record in records:
-            for k, v in record.items():
-                if k not in {'struct_id', '_id', 'pref', 'parent', 's2'}:
-                    synonym_related.append(v)
-        drecord = {"_id": strucid, "synonyms": synonym_related}
-        d.append(drecord)
-    return {x['_id']: x['synonyms'] for x in d}
+    df = read_table(file_path_synonym, 'struct_id', sep=",", names=["_id", "struct_id", 'synonym', 'pref', 'parent', 's2'])
+    for strucid, group in groupby(df[['struct_id', 'synonym']].itertuples(index=False, name=None), key=itemgetter(0)):
+        yield strucid, [synonym for _, synonym in group]
 
 def process_structure(file_path_structure):
-    df_drugcentral_structure = pd.read_csv(file_path_structure, sep="\t")
-    df_drugcentral_structure = df_drugcentral_structure.where((pd.notnull(df_drugcentral_structure)), None)
-    d = []
-    for strucid, subdf in df_drugcentral_structure.groupby('ID'):
-        records = subdf.to_dict(orient="records")
-        drug_dosage_related = [{k.lower(): v for k, v in record.items() if k not in {'ID'}} for record in records]
-        drecord = {"_id": strucid, "structures": drug_dosage_related[0]}
-        d.append(drecord)
-    return {x['_id']: x['structures'] for x in d}
+    df = read_table(file_path_structure, 'ID', sep="\t")
+    df = df.rename(columns={col: col.lower() for col in df.columns if col != 'ID'})
+    for strucid, records in iter_groups(df, 'ID'):
+        del records[0]['ID']
+        yield strucid, records[0]
 
 def process_identifier(file_path_identifier):
-    df_drugcentral_identifier = pd.read_csv(file_path_identifier, sep=",", names=["_id", "identifier", "id_type", "struct_id", "parent"])
-    df_drugcentral_identifier = df_drugcentral_identifier.where((pd.notnull(df_drugcentral_identifier)), None)
-    d = []
-    for strucid, subdf in df_drugcentral_identifier.groupby('struct_id'):
-        records = subdf.to_dict(orient="records")
-        identifier_related = defaultdict(list)
-        for _record in records:
-            identifier_related[_record['id_type'].lower()].append(_record['identifier'])             
-        drecord = {"_id": strucid, "external_ref": identifier_related}
-        d.append(drecord)
-    return {x['_id']: x['external_ref'] for x in d}
+    df = read_table(file_path_identifier, 'struct_id', sep=",", names=["_id", "identifier", "id_type", "struct_id", "parent"])
+    df['id_type'] = df['id_type'].str.lower()
+    for strucid, group in groupby(df[['struct_id', 'id_type', 'identifier']].itertuples(index=False, name=None), key=itemgetter(0)):
+        identifier_related = {}
+        for _, id_type, identifier in group:
+            identifier_related.setdefault(id_type, []).append(identifier)
+        yield strucid, identifier_related
 
 def to_list(_key):
     if type(_key) != list:
@@ -150,69 +135,104 @@ def to_list(_key):
     else:
         return _key
 
-def xref_2_inchikey(xref_dict):
-    xref_key_list = ['unii', 'drugbank_id', 'chembl_id', 'chebi', 'pubchem_cid']
-    mychem_filed_dict = {'unii': 'unii.unii:', 'chebi': 'chebi.chebi_id:"', 'pubchem_cid': 'pubchem.cid:"CID','chembl_id': 'chembl.molecule_chembl_id:"', 'drugbank_id': 'drugbank.accession_number:"'}
-    mychem_query = 'http://mychem.info/v1/query?q='
-    result = None
-    for _key in xref_key_list:
-        if _key in xref_dict:
-            for _xref in to_list(xref_dict[_key]):
-                query_url = mychem_query + mychem_filed_dict[_key] + _xref + '"'
-                json_doc = requests.get(query_url).json()
-                if 'hits' in json_doc and json_doc['hits']:
-                    if len(json_doc['hits']) == 1:
-                        result = json_doc['hits'][0]['_id']
-                    else:
-                        result = json_doc['hits'][0]['_id']
+# number of structures whose InChIKey is resolved from xrefs at once
+LOOKUP_CHUNK_SIZE = 1000
+
+# DrugCentral xref type => crosswalk id type. When several xrefs can be
+# resolved, the last one in this list wins
+XREF_ID_TYPES = [('unii', 'unii'), ('drugbank_id', 'drugbank_accession'), ('chembl_id', 'chembl'),
+                 ('chebi', 'chebi'), ('pubchem_cid', 'pubchem')]
+
+def xref_2_inchikey(xrefs, crosswalk):
+    """
+    Return a dict mapping struct ids to an InChIKey, resolved from their xrefs
+    (xrefs is a dict struct id => xref dict) with the local identifier
+    crosswalk. All xrefs of a given type are resolved at once.
+    """
+    result = {}
+    for xref_type, id_type in XREF_ID_TYPES:
+        ids = set()
+        for xref_dict in xrefs.values():
+            ids.update(to_list(xref_dict.get(xref_type, [])))
+        if not ids:
+            continue
+        found = crosswalk.lookup(id_type, ids)
+        for struc_id, xref_dict in xrefs.items():
+            for _xref in to_list(xref_dict.get(xref_type, [])):
+                if _xref in found:
+                    result[struc_id] = found[_xref][0]
     return result
 
-def load_data():
-    pharmacology_class = process_pharmacology_action(file_path_pharma_class)
-    faers = process_faers(file_path_faers)
-    act = process_act(file_path_act)
-    omop = process_omop(file_path_omop)
-    approval = process_approval(file_path_approval)
-    drug_dosage = process_drug_dosage(file_path_drug_dosage)
-    synonyms = process_synonym(file_path_synonym)
-    structures = process_structure(file_path_structure)
-    identifiers = process_identifier(file_path_identifier)
-    for struc_id in set(list(pharmacology_class.keys()) + list(faers.keys()) + list(act.keys()) + list(omop.keys()) + list(approval.keys()) + list(drug_dosage.keys()) + list(identifiers.keys()) + list(synonyms.keys()) + list(structures.keys())):
-    #for disease_id in set(list(d_go_bp.keys()) + list(d_go_mf.keys()) + list(d_go_cc.keys()) + list(d_pathway.keys())):
-        if structures.get(struc_id, {}).get('inchikey', {}):
-            _doc = {
-                '_id': structures.get(struc_id, {}).get('inchikey', {}),
-                'drugcentral': {
-                    "pharmacology_class": pharmacology_class.get(struc_id, {}),
-                    "fda_adverse_event": faers.get(struc_id, {}),
-                    "bioactivity": act.get(struc_id, {}),
-                    "drug_use": omop.get(struc_id, {}),
-                    "approval": approval.get(struc_id, {}),
-                    "drug_dosage": drug_dosage.get(struc_id, {}),
-                    "synonyms": synonyms.get(struc_id, {}),
-                    "structures": structures.get(struc_id, {}),
-                    "xref": identifiers.get(struc_id, {})
-                }
-            }
-        else:
-            _id = xref_2_inchikey(identifiers.get(struc_id, {}))
-            if not _id:
-                _id = 'DrugCentral:' + str(struc_id)
-            _doc = {
-                '_id': _id,
-                'drugcentral': {
-                    "pharmacology_class": pharmacology_class.get(struc_id, {}),
-                    "fda_adverse_event": faers.get(struc_id, {}),
-                    "bioactivity": act.get(struc_id, {}),
-                    "drug_use": omop.get(struc_id, {}),
-                    "approval": approval.get(struc_id, {}),
-                    "drug_dosage": drug_dosage.get(struc_id, {}),
-                    "synonyms": synonyms.get(struc_id, {}),
-                    "structures": structures.get(struc_id, {}),
-                    "xref": identifiers.get(struc_id, {})
-                }
-            }
-        _doc = (dict_sweep(unlist(_doc), [None]))
-        yield _doc
+def tag_groups(field, groups):
+    for strucid, value in groups:
+        yield strucid, field, value
+
+# document field => (function grouping table by struct id, file in data folder)
+TABLES = [("pharmacology_class", process_pharmacology_action, "pharma_class.csv"),
+          ("fda_adverse_event", process_faers, "faers.csv"),
+          ("bioactivity", process_act, "act_table_full.csv"),
+          ("drug_use", process_omop, "omop_relationship.csv"),
+          ("approval", process_approval, "approval.csv"),
+          ("drug_dosage", process_drug_dosage, "drug_dosage.csv"),
+          ("synonyms", process_synonym, "synonyms.csv"),
+          ("structures", process_structure, "structures.smiles.tsv"),
+          ("xref", process_identifier, "identifiers.csv")]
+
+def iter_structures(groups):
+    """
+    Merge groups (field => iterator over (struct id, value), in struct id
+    order) into (struct id, drugcentral dict) for each struct id
+    """
+    merged = heapq.merge(*[tag_groups(field, groups[field]) for field, _, _ in TABLES], key=itemgetter(0))
+    for struc_id, group in groupby(merged, key=itemgetter(0)):
+        drugcentral = {field: {} for field, _, _ in TABLES}
+        for _, field, value in group:
+            drugcentral[field] = value
+        yield struc_id, drugcentral
 
+def get_part_file(parts_folder, part, field):
+    return os.path.join(parts_folder, str(part), "%s.json" % field)
 
+def partition_table(field, data_folder, parts_folder, num_parts):
+    """
+    Group table for field (see TABLES) and write its (struct id, value) pairs
+    in num_parts files (struct id modulo num_parts) in parts_folder, one JSON
+    list per line, in struct id order. Returns the number of struct ids.
+    """
+    func, filename = {f: (fn, fname) for f, fn, fname in TABLES}[field]
+    fouts = []
+    for part in range(num_parts):
+        part_file = get_part_file(parts_folder, part, field)
+        # other tables are partitioned at the same time
+        os.makedirs(os.path.dirname(part_file), exist_ok=True)
+        fouts.append(open(part_file, "w"))
+    cnt = 0
+    try:
+        for strucid, value in func(os.path.join(data_folder, filename)):
+            fouts[int(strucid) % num_parts].write(json.dumps([strucid, value]) + "\n")
+            cnt += 1
+    finally:
+        for fout in fouts:
+            fout.close()
+    return cnt
+
+def read_part(part_file):
+    with open(part_file) as fin:
+        for line in fin:
+            yield tuple(json.loads(line))
+
+def load_data(parts_folder, part=0, crosswalk=None):
+    """Load documents from one part of grouped tables (see partition_table())"""
+    groups = {field: read_part(get_part_file(parts_folder, part, field)) for field, _, _ in TABLES}
+    crosswalk = crosswalk or get_crosswalk()
+    for block in iter_n(iter_structures(groups), LOOKUP_CHUNK_SIZE):
+        # structures without InChIKey are resolved from their xrefs, a whole block at once
+        xref_inchikeys = xref_2_inchikey({struc_id: drugcentral["xref"] for struc_id, drugcentral in block
+                                          if not drugcentral["structures"].get('inchikey')}, crosswalk)
+        for struc_id, drugcentral in block:
+            _id = drugcentral["structures"].get('inchikey') or xref_inchikeys.get(struc_id)
+            if not _id:
+                _id = 'DrugCentral:' + str(struc_id)
+            _doc = {'_id': _id, 'drugcentral': drugcentral}
+            _doc = (dict_sweep(unlist(_doc), [None]))
+            yield _doc
@@ -1,6 +1,12 @@
-import biothings.hub.dataload.uploader as uploader
+import os
 
-class DrugCentralUploader(uploader.DummySourceUploader):
+from .drugcentral_parser import load_data
+from .drugcentral_dump import DrugCentralDumper
+from hub.dataload.uploader import BaseDrugUploader
+from biothings.hub.dataload.uploader import ParallelizedSourceUploader
+
+
+class DrugCentralUploader(BaseDrugUploader,ParallelizedSourceUploader):
 
     name = "drugcentral"
     __metadata__ = {
@@ -11,6 +17,18 @@ class DrugCentralUploader(uploader.DummySourceUploader):
                 "license" : "CC BY-SA 4.0",
                 }
             }
+    use_crosswalk = True
+
+    def jobs(self):
+        # this will generate arguments for self.load.data() method, allowing parallelization
+        # (tables were grouped and split in parts by the dumper, one job per part)
+        parts_folder = os.path.join(self.data_folder,DrugCentralDumper.PARTS_FOLDER)
+        assert os.path.exists(parts_folder), "Can't find '%s', dump 'drugcentral' first" % parts_folder
+        return [(parts_folder,int(part)) for part in sorted(os.listdir(parts_folder),key=int)]
+
+    def load_data(self,parts_folder,part=0):
+        self.logger.info("Load data from folder '%s' (part %s)" % (parts_folder,part))
+        return load_data(parts_folder,part)
 
     @classmethod
     def get_mapping(klass):
@@ -369,6 +387,3 @@ class DrugCentralUploader(uploader.DummySourceUploader):
         }
 
         return mapping
-
-
-"""
\ No newline at end of file
@@ -1,5 +1,10 @@
-import csv, os
+import csv, os, json, heapq, tempfile
+from itertools import groupby
 from biothings.utils.dataload import dict_sweep, unlist
+from biothings.utils.common import iter_n
+
+# max number of docs kept in memory while sorting/grouping
+SORT_CHUNK_SIZE = 50000
 
 def package_restr_dict(dictionary):
     _d = {}
@@ -42,65 +47,125 @@ def convert_to_unicode(dictionary):
     return dictionary
 
 def load_products(_file):
-    f = open(_file,'r',encoding="latin1")
-    reader = csv.DictReader(f,dialect='excel-tab')
-    for row in reader:
-        _dict = product_restr_dict(row)
-        _dict = convert_to_unicode(dict_sweep(_dict))
-        _dict["_id"] = _dict["ndc"]["productndc"]
-        yield _dict
+    with open(_file,'r',encoding="latin1") as f:
+        reader = csv.DictReader(f,dialect='excel-tab')
+        for row in reader:
+            _dict = product_restr_dict(row)
+            _dict = convert_to_unicode(dict_sweep(_dict))
+            _dict["_id"] = _dict["ndc"]["productndc"]
+            yield _dict
 
 def load_packages(_file):
-    f = open(_file,'r',encoding='latin1')
-    reader = csv.DictReader(f,dialect='excel-tab')
-    for row in reader:
-        _dict = package_restr_dict(row)
-        _dict = unlist(dict_sweep(_dict))
-        _dict["_id"] = _dict["ndc"]["productndc"]
-        yield _dict
+    with open(_file,'r',encoding='latin1') as f:
+        reader = csv.DictReader(f,dialect='excel-tab')
+        for row in reader:
+            _dict = package_restr_dict(row)
+            _dict = unlist(dict_sweep(_dict))
+            _dict["_id"] = _dict["ndc"]["productndc"]
+            yield _dict
 
-def load_data(data_folder, drugbank_col=None):
-    package_file = os.path.join(data_folder,"package.txt")
-    product_file = os.path.join(data_folder,"product.txt")
-    assert os.path.exists(package_file), "Package file doesn't exist..."
-    assert os.path.exists(product_file), "Product file doesn't exist..."
-    package_ndc = {}
-    inchi_key = {}
-    for doc in load_packages(package_file):
-        package_ndc.setdefault(doc["_id"],[]).append(doc["ndc"])
-    for doc in load_products(product_file):
-        packages = package_ndc.get(doc["_id"],[])
-        if packages:
+def external_sort(docs, key, chunk_size=SORT_CHUNK_SIZE):
+    """
+    Sort docs by key, keeping at most chunk_size docs in memory: sorted chunks
+    are spilled to temporary files (one JSON doc per line) and merged back.
+    Sort is stable, docs with the same key come in their original order.
+    """
+    chunks = []
+    try:
+        for chunk in iter_n(docs,chunk_size):
+            tmp = tempfile.TemporaryFile("w+")
+            for doc in sorted(chunk,key=key):
+                tmp.write(json.dumps(doc) + "\n")
+            tmp.seek(0)
+            chunks.append(tmp)
+        for doc in heapq.merge(*[(json.loads(line) for line in tmp) for tmp in chunks],key=key):
+            yield doc
+    finally:
+        for tmp in chunks:
+            tmp.close()
+
+def merge_packages(products, packages):
+    """
+    Join products and packages, both sorted by "_id" (productndc), adding
+    packages to their product doc. Only packages for one productndc are kept
+    in memory at a time.
+    """
+    groups = groupby(packages,key=lambda doc: doc["_id"])
+    pack_id, pack_docs = None, []
+    for doc in products:
+        # move forward in packages until we reach the product's productndc
+        while groups is not None and (pack_id is None or pack_id < doc["_id"]):
+            pack_id, pack_docs = next(groups,(None,[]))
+            pack_docs = [pack["ndc"] for pack in pack_docs]
+            if pack_id is None:
+                groups = None # no more packages
+        if pack_id == doc["_id"] and pack_docs:
             doc["ndc"]["package"] = []
-            for pack in packages:
+            for pack in pack_docs:
                 # remove keys used for the merge (duplicates, already in product
                 pack.pop("product_id",None)
                 pack.pop("productndc",None)
                 doc["ndc"]["package"].append(pack)
             if len(doc["ndc"]["package"]) == 1:
                 doc["ndc"]["package"] = doc["ndc"]["package"].pop() # to dict
-        ik = find_inchi_key(doc,drugbank_col)
-        if ik:
-            # IK found, but other productndc could also match the same
-            # IK so we keep them in a list
-            inchi_key.setdefault(ik,[]).append(doc["ndc"])
-            continue
-        else:
-            # No IK found, we'll just return the doc as-is
-            yield doc
-    for ik,ndclist in inchi_key.items():
-        if len(ndclist) == 1:
-            ndclist = ndclist.pop() # back to single dict
-        yield {"_id": ik, "ndc": ndclist}
+        yield doc
 
-def find_inchi_key(doc,drugbank_col):
-    if not drugbank_col:
-        return
-    d = drugbank_col.find_one({"drugbank.products.ndc_product_code":doc["ndc"]["productndc"]})
-    if d and d["drugbank"].get("inchi_key"):
-        _id = d["drugbank"]["inchi_key"]
-        return _id
-    else:
-        return
+def load_data(data_folder, drugbank_col=None, chunk_size=SORT_CHUNK_SIZE, ndc_inchikeys=None):
+    package_file = os.path.join(data_folder,"package.txt")
+    product_file = os.path.join(data_folder,"product.txt")
+    assert os.path.exists(package_file), "Package file doesn't exist..."
+    assert os.path.exists(product_file), "Product file doesn't exist..."
+    if ndc_inchikeys is None:
+        ndc_inchikeys = build_inchikey_map(drugbank_col)
+    # products and packages are sorted by productndc (on disk if needed), so
+    # they can be joined without keeping all packages in memory
+    by_id = lambda doc: doc["_id"]
+    products = external_sort(load_products(product_file),by_id,chunk_size)
+    packages = external_sort(load_packages(package_file),by_id,chunk_size)
+    with tempfile.TemporaryFile("w+") as spill:
+        for num,doc in enumerate(merge_packages(products,packages)):
+            ik = find_inchi_key(doc,ndc_inchikeys)
+            if ik:
+                # IK found, but other productndc could also match the same
+                # IK so we keep them aside, to be grouped by IK afterward
+                spill.write(json.dumps({"ik" : ik, "num" : num, "ndc" : doc["ndc"]}) + "\n")
+                continue
+            else:
+                # No IK found, we'll just return the doc as-is
+                yield doc
+        spill.seek(0)
+        docs = external_sort((json.loads(line) for line in spill),lambda doc: (doc["ik"],doc["num"]),chunk_size)
+        for ik,group in groupby(docs,key=lambda doc: doc["ik"]):
+            ndclist = [doc["ndc"] for doc in group]
+            if len(ndclist) == 1:
+                ndclist = ndclist.pop() # back to single dict
+            yield {"_id": ik, "ndc": ndclist}
 
+def build_inchikey_map(drugbank_col):
+    """
+    Return a dict mapping DrugBank products' NDC product codes to the drug's
+    InChIKey (or None if the drug doesn't have one), using a single projected
+    scan of drugbank_col. As with a find_one() query, the first drug found
+    for a given product code is the one used.
+    """
+    ndc_inchikeys = {}
+    if not drugbank_col:
+        return ndc_inchikeys
+    cur = drugbank_col.find({"drugbank.products.ndc_product_code":{"$exists":True}},
+                            {"drugbank.inchi_key":1,"drugbank.products.ndc_product_code":1})
+    for d in cur:
+        products = d["drugbank"].get("products",[])
+        if isinstance(products,dict):
+            products = [products]
+        for product in products:
+            codes = product.get("ndc_product_code")
+            if codes is None:
+                continue
+            if not isinstance(codes,list):
+                codes = [codes]
+            for code in codes:
+                ndc_inchikeys.setdefault(code,d["drugbank"].get("inchi_key"))
+    return ndc_inchikeys
 
+def find_inchi_key(doc,ndc_inchikeys):
+    return ndc_inchikeys.get(doc["ndc"]["productndc"])
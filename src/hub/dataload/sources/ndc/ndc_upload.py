@@ -7,6 +7,7 @@ from hub.dataload.uploader import BaseDrugUploader
 import biothings.hub.dataload.storage as storage
 from biothings.utils.common import unzipall
 from biothings.utils.mongo import get_src_db
+from hub.dataload.crosswalk import get_crosswalk
 
 
 SRC_META = {
@@ -20,12 +21,15 @@ class NDCUploader(BaseDrugUploader):
     name = "ndc"
     storage_class = storage.IgnoreDuplicatedStorage
     __metadata__ = {"src_meta" : SRC_META}
+    use_crosswalk = True
 
     def load_data(self,data_folder):
         drugbank_col = get_src_db()["drugbank"]
         assert drugbank_col.count() > 0, "'drugbank' collection is empty (required for inchikey " + \
                 "conversion). Please run 'drugbank' uploader first"
-        return load_data(data_folder,drugbank_col)
+        # NDC product codes resolved from the local identifier crosswalk
+        ndc_inchikeys = get_crosswalk().get_map("ndc")
+        return load_data(data_folder,drugbank_col,ndc_inchikeys=ndc_inchikeys)
 
 
     @classmethod
@@ -6,7 +6,7 @@ from biothings.utils.mongo import get_src_db
 
 from .pharmgkb_parser import load_data
 from hub.dataload.uploader import BaseDrugUploader
-from biothings.hub.datatransform import DataTransformMDB
+from hub.dataload.datatransform import BatchedDataTransformMDB
 from hub.dataload.graph_mychem import graph_mychem as G
 
 
@@ -22,8 +22,9 @@ class PharmGkbUploader(BaseDrugUploader):
     name = "pharmgkb"
     storage_class = storage.IgnoreDuplicatedStorage
     __metadata__ = {"src_meta" : SRC_META}
+    use_crosswalk = True
 
-    @DataTransformMDB(G, [('inchi', 'pharmgkb.inchi'), ('pubchem', 'pharmgkb.cross_references.pubchem_compound'), ('drugbank', 'pharmgkb.cross_references.drugbank'), ('chebi-short', 'pharmgkb.cross_references.chebi')], ['inchikey', 'unii', 'rxnorm', 'drugbank', 'chebi', 'chembl', 'pubchem', 'drugname'] )
+    @BatchedDataTransformMDB(G, [('inchi', 'pharmgkb.inchi'), ('pubchem', 'pharmgkb.cross_references.pubchem_compound'), ('drugbank', 'pharmgkb.cross_references.drugbank'), ('chebi-short', 'pharmgkb.cross_references.chebi')], ['inchikey', 'unii', 'rxnorm', 'drugbank', 'chebi', 'chembl', 'pubchem', 'drugname'] )
     def load_data(self,data_folder):
         self.logger.info("Load data from '%s'" % data_folder)
         input_file = os.path.join(data_folder,"drugs.tsv")
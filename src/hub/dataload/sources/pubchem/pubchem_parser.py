@@ -1,19 +1,78 @@
-import xmltodict
+import collections
 import re
 import gzip
 import os
+from lxml import etree
 from biothings.utils.dataload import value_convert_to_number
 
-def load_data(input_file):
-    compound_list = []
-    def handle(path,item):
-        item = restructure_dict(item)
-        compound_list.append(item)
-        return True
+# only these are used by restructure_dict(), others (atoms, bonds, coords, ...)
+# are the biggest part of a compound and aren't even converted
+COMPOUND_FIELDS = {"PC-Compound_id","PC-Compound_charge","PC-Compound_props","PC-Compound_count"}
+
+def elem_to_dict(elem):
+    """
+    Convert lxml element to the same structure xmltodict would produce
+    (attributes as "@name", text as "#text", repeated children as list,
+    None for empty elements), without serializing and re-parsing it.
+    """
+    d = collections.OrderedDict([("@" + k,v) for k,v in elem.attrib.items()])
+    text = elem.text or ""
+    for child in elem:
+        text += child.tail or ""
+        if not isinstance(child.tag,str):
+            continue # comments, processing instructions
+        key = etree.QName(child).localname
+        val = elem_to_dict(child)
+        if key in d:
+            if isinstance(d[key],list):
+                d[key].append(val)
+            else:
+                d[key] = [d[key],val]
+        else:
+            d[key] = val
+    text = text.strip()
+    if not d:
+        return text or None
+    if text:
+        d["#text"] = text
+    return d
+
+def iter_compounds(input_file, fields=None):
+    """
+    Iterate over <PC-Compound> elements from gzipped XML file, decompressing
+    and parsing it incrementally. Each compound is yielded as the dict
+    xmltodict would have produced (same as item_depth=2) as soon as the element
+    is closed, then cleared so memory doesn't grow with the file size.
+    If fields is given, only these compound fields are kept in the dict.
+    """
+    with gzip.open(input_file,'rb') as f:
+        context = etree.iterparse(f,events=("end",),tag="{*}PC-Compound",huge_tree=True)
+        for _,elem in context:
+            item = collections.OrderedDict()
+            for child in elem:
+                if not isinstance(child.tag,str):
+                    continue
+                key = etree.QName(child).localname
+                if fields and key not in fields:
+                    continue
+                val = elem_to_dict(child)
+                if key in item:
+                    if isinstance(item[key],list):
+                        item[key].append(val)
+                    else:
+                        item[key] = [item[key],val]
+                else:
+                    item[key] = val
+            yield item
+            elem.clear()
+            parent = elem.getparent()
+            while elem.getprevious() is not None:
+                del parent[0]
+        del context
 
-    _f = gzip.open(input_file,'rb').read()
-    xmltodict.parse(_f,item_depth=2,item_callback=handle,xml_attribs=True)  #parse the xml file to dictionary
-    for compound in compound_list:
+def load_data(input_file):
+    for item in iter_compounds(input_file,COMPOUND_FIELDS):
+        compound = restructure_dict(item)
         try:
             _id = compound["pubchem"]['inchi_key']
             compound["_id"] = _id
@@ -22,9 +81,65 @@ def load_data(input_file):
 
         yield compound
 
+# PC-Urn label (or name, for "Count" properties) => output field
+URN_FIELDS = {
+        "Hydrogen Bond Acceptor" : "hydrogen_bond_acceptor_count",
+        "Hydrogen Bond Donor" : "hydrogen_bond_donor_count",
+        "Rotatable Bond" : "rotatable_bond_count",
+        "InChI" : "inchi",
+        "InChIKey" : "inchi_key",
+        "Log P" : "xlogp",
+        "Mass" : "exact_mass",
+        "Molecular Formula" : "molecular_formula",
+        "Molecular Weight" : "molecular_weight",
+        "Topological" : "topological_polar_surface_area",
+        "Weight" : "monoisotopic_weight",
+        "Compound Complexity" : "complexity",
+        }
+# PC-Urn label => output field, holding a {lowercased PC-Urn name : value} sub-dict
+URN_SUBDICT_FIELDS = {
+        "IUPAC Name" : "iupac",
+        "SMILES" : "smiles",
+        }
+# both, as a single lookup: PC-Urn label/name => (output field, is sub-dict)
+URN_LOOKUP = dict([(k,(v,False)) for k,v in URN_FIELDS.items()] + \
+                  [(k,(v,True)) for k,v in URN_SUBDICT_FIELDS.items()])
+
+COUNT_FIELDS = {
+        "PC-Count_heavy-atom" : "heavy_atom_count",
+        "PC-Count_atom-chiral" : "chiral_atom_count",
+        "PC-Count_atom-chiral-def" : "defined_atom_stereocenter_count",
+        "PC-Count_atom-chiral-undef" : "undefined_atom_stereocenter_count",
+        "PC-Count_bond-chiral" : "chiral_bond_count",
+        "PC-Count_bond-chiral-def" : "defined_bond_stereocenter_count",
+        "PC-Count_bond-chiral-undef" : "undefined_bond_stereocenter_count",
+        "PC-Count_isotope-atom" : "isotope_atom_count",
+        "PC-Count_covalent-unit" : "covalently-bonded_unit_count",
+        "PC-Count_tautomers" : "tautomers_count",
+        }
+
+def restructure_props(props, d):
+    for infos in props.values():
+        if isinstance(infos,dict):
+            infos = [infos]
+        for ele in infos:
+            try:
+                urn = ele["PC-InfoData_urn"]["PC-Urn"]
+            except (KeyError,TypeError):
+                continue
+            match = URN_LOOKUP.get(urn.get("PC-Urn_label")) or URN_LOOKUP.get(urn.get("PC-Urn_name"))
+            if not match:
+                continue
+            field,is_subdict = match
+            # last value is the actual one
+            val = list(ele["PC-InfoData_value"].values())[-1]
+            if is_subdict:
+                # only the last one is kept (ex: "Traditional" for IUPAC)
+                d[field] = {urn["PC-Urn_name"].lower() : val}
+            else:
+                d[field] = val
+
 def restructure_dict(dictionary):
-    smile_dict = dict()
-    iupac_dict = dict()
     d = dict()
 
     for key,value in iter(dictionary.items()):
@@ -38,104 +153,16 @@ def restructure_dict(dictionary):
             d["formal_charge"] = dictionary[key]
 
         elif key == "PC-Compound_props":
-            for cnt in value:
-                for ele in value[cnt]:
-                    for x,y in iter(ele.items()):
-                        if x == "PC-InfoData_urn":
-                            for i,j in iter(y.items()):
-                                if i == "PC-Urn":
-                                    val = ele["PC-InfoData_value"]
-                                    for z in val:
-                                        val1 = val[z]
-                                    for k,l in iter(j.items()):
-                                        if l == "Hydrogen Bond Acceptor":
-                                            d["hydrogen_bond_acceptor_count"] = val1
-
-                                        elif l == "Hydrogen Bond Donor":
-                                            d["hydrogen_bond_donor_count"] = val1
-
-                                        elif l == "Rotatable Bond":
-                                            d["rotatable_bond_count"] = val1
-
-                                        elif l == "IUPAC Name":
-                                            IUPAC = j["PC-Urn_name"]
-                                            IUPAC = IUPAC.lower()
-                                            iupac_dict[IUPAC] = val1
-                                            d["iupac"] = iupac_dict
-                                            iupac_dict = {}
-
-                                        elif l == "InChI":
-                                            d["inchi"] = val1
-                                            break
-
-                                        elif l == "InChIKey":
-                                            d["inchi_key"] = val1
-                                            break
-
-                                        elif l == "Log P":
-                                            d["xlogp"] = val1
-
-                                        elif l == "Mass":
-                                            d["exact_mass"] = val1
-
-                                        elif l == "Molecular Formula":
-                                            d["molecular_formula"] = val1
-
-                                        elif l == "Molecular Weight":
-                                            d["molecular_weight"] = val1
-
-                                        elif l == "SMILES":
-                                            smiles = j["PC-Urn_name"]
-                                            smiles = smiles.lower()
-                                            smile_dict[smiles] = val1
-                                            d["smiles"] = smile_dict
-                                            smile_dict = {}
-
-                                        elif l == "Topological":
-                                            d["topological_polar_surface_area"] = val1
-
-                                        elif l == "Weight":
-                                            d["monoisotopic_weight"] = val1
-
-                                        elif l == "Compound Complexity":
-                                            d["complexity"] = val1
+            restructure_props(value,d)
 
         elif key == "PC-Compound_count":
             for cnt in value:
                 for x,y in iter(value[cnt].items()):
-                    if x == "PC-Count_heavy-atom":
-                        d["heavy_atom_count"] = y
-
-                    elif x == "PC-Count_atom-chiral":
-                        d["chiral_atom_count"] = y
-
-                    elif x == "PC-Count_atom-chiral-def":
-                        d["defined_atom_stereocenter_count"] = y
-
-                    elif x == "PC-Count_atom-chiral-undef":
-                        d["undefined_atom_stereocenter_count"] = y
-
-                    elif x == "PC-Count_bond-chiral":
-                        d["chiral_bond_count"] = y
-
-                    elif x == "PC-Count_bond-chiral-def":
-                        d["defined_bond_stereocenter_count"] = y
-
-                    elif x == "PC-Count_bond-chiral-undef":
-                        d["undefined_bond_stereocenter_count"] = y
-
-                    elif x == "PC-Count_isotope-atom":
-                        d["isotope_atom_count"] = y
-
-                    elif x == "PC-Count_covalent-unit":
-                        d["covalently-bonded_unit_count"] = y
-
-                    elif x == "PC-Count_tautomers":
-                        d["tautomers_count"] = y
+                    if x in COUNT_FIELDS:
+                        d[COUNT_FIELDS[x]] = y
 
     restr_dict = {}
     restr_dict['_id'] = d["cid"]
     restr_dict["pubchem"] = d
     restr_dict = value_convert_to_number(restr_dict)
     return restr_dict
-
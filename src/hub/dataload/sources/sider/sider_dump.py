@@ -3,6 +3,10 @@ import sys
 import time
 import ftplib
 import re
+import zlib
+import shutil
+import asyncio
+from functools import partial
 import pandas as pd
 
 import biothings, config
@@ -20,6 +24,7 @@ class SiderDumper(FTPDumper):
     FTP_HOST = 'xi.embl.de'
     CWD_DIR = '/SIDER'
     SCHEDULE = "0 12 * * *"
+    NUM_BUCKETS = 32 # files are merged by parts, in parallel
 
     def get_release(self):
         # only dir with dates
@@ -48,29 +53,89 @@ class SiderDumper(FTPDumper):
                 if not os.path.exists(local) or self.remote_is_better(remote,local):
                     self.to_dump.append({"remote": remote,"local":local})
 
-    def post_dump(self, *args, **kwargs):
+    def post_dump(self, *args, job_manager=None, **kwargs):
         gunzipall(self.new_data_folder)
         self.logger.info("Merging files")
         FREQ = os.path.join(self.new_data_folder,"meddra_freq.tsv")
         ALL_SE = os.path.join(self.new_data_folder,"meddra_all_se.tsv")
         ALL_INDICATIONS = os.path.join(self.new_data_folder,"meddra_all_indications.tsv")
         MERGED = os.path.join(self.new_data_folder,"merged_freq_all_se_indications.tsv")
-        #merge first two files- side effect and side effect with frequency
-        #add header to csv files
-        df1 = pd.read_csv(FREQ, delimiter='\t')
-        df1.columns = ['stitch_id(flat)','stitch_id(stereo)','umls_id(label)','is_placebo',
-                'desc_type','lower','upper','meddra_type','umls_id(meddra)','se_name']
-        df2 = pd.read_csv(ALL_SE, delimiter='\t')
-        df2.columns = ['stitch_id(flat)','stitch_id(stereo)','umls_id(label)','meddra_type',
-                'umls_id(meddra)','se_name']
-        s1 = pd.merge(df1, df2, how='outer',on=['stitch_id(flat)','stitch_id(stereo)','umls_id(label)','meddra_type','umls_id(meddra)','se_name'])
-
-        #merge above merged file with indication file
-        df4 = pd.read_csv(ALL_INDICATIONS,delimiter='\t')
-        df4.columns =['stitch_id(flat)','umls_id(label)','method_of_detection','concept_name',
-                'meddra_type','umls_id(meddra)','concept_name(meddra)']
-        s2 = pd.merge(s1,df4,how='outer',on=['stitch_id(flat)','umls_id(label)','meddra_type','umls_id(meddra)'])
-        s3 = s2.sort('stitch_id(flat)')
-        s3.to_csv(MERGED)
+        # files are split in buckets by STITCH flat id, so each bucket can be
+        # merged (and sorted) on its own, in parallel and with 1/N of the memory
+        bucket_folder = os.path.join(self.new_data_folder,"buckets")
+        if os.path.exists(bucket_folder):
+            shutil.rmtree(bucket_folder)
+        os.makedirs(bucket_folder)
+        num = self.__class__.NUM_BUCKETS
+        buckets = [[os.path.join(bucket_folder,"%s.%s.tsv" % (i,name)) for name in ("freq","all_se","indications")] + \
+                   [os.path.join(bucket_folder,"%s.merged.csv" % i)] for i in range(num)]
+        for pos,input_file in enumerate([FREQ,ALL_SE,ALL_INDICATIONS]):
+            partition(input_file,[bucket[pos] for bucket in buckets])
+        # post_dump() runs in a thread, buckets are merged by job_manager's
+        # processes, scheduled from its event loop
+        merged = asyncio.run_coroutine_threadsafe(self.merge_buckets(buckets,job_manager),job_manager.loop)
+        columns = merged.result()[0]
+        with open(MERGED,"w") as fout:
+            fout.write(",".join([""] + columns) + "\n")
+            for bucket in buckets:
+                with open(bucket[-1]) as fin:
+                    shutil.copyfileobj(fin,fout)
+        shutil.rmtree(bucket_folder)
         self.logger.info("Files successfully merged, ready to be uploaded")
 
+    @asyncio.coroutine
+    def merge_buckets(self, buckets, job_manager):
+        jobs = []
+        for num,bucket in enumerate(buckets):
+            pinfo = self.get_pinfo()
+            pinfo["step"] = "post_dump"
+            pinfo["description"] = "merge bucket %s/%s" % (num + 1,len(buckets))
+            job = yield from job_manager.defer_to_process(pinfo,partial(merge_bucket,*bucket))
+            jobs.append(job)
+        res = yield from asyncio.gather(*jobs)
+        return res
+
+
+FREQ_COLUMNS = ['stitch_id(flat)','stitch_id(stereo)','umls_id(label)','is_placebo',
+        'desc_type','lower','upper','meddra_type','umls_id(meddra)','se_name']
+ALL_SE_COLUMNS = ['stitch_id(flat)','stitch_id(stereo)','umls_id(label)','meddra_type',
+        'umls_id(meddra)','se_name']
+INDICATIONS_COLUMNS = ['stitch_id(flat)','umls_id(label)','method_of_detection','concept_name',
+        'meddra_type','umls_id(meddra)','concept_name(meddra)']
+
+def partition(input_file, bucket_files):
+    """
+    Split TSV input_file into bucket_files, according to a hash of the
+    STITCH flat id (first column), so all rows for a given id end up in the
+    same bucket.
+    """
+    fouts = [open(bucket_file,"w") for bucket_file in bucket_files]
+    try:
+        with open(input_file) as fin:
+            for line in fin:
+                flat = line.split("\t",1)[0]
+                fouts[zlib.crc32(flat.encode()) % len(fouts)].write(line)
+    finally:
+        for fout in fouts:
+            fout.close()
+
+def read_bucket(bucket_file, columns):
+    if not os.path.getsize(bucket_file):
+        return pd.DataFrame(columns=columns,dtype=str)
+    # values kept as found in files, whatever the types in that bucket
+    return pd.read_csv(bucket_file,delimiter='\t',header=None,names=columns,dtype=str)
+
+def merge_bucket(freq_file, all_se_file, indications_file, output_file):
+    """
+    Merge one bucket: side effects with side effects with frequency, then with
+    indications. Result is sorted by STITCH flat id and written (without
+    header) to output_file. Returns merged columns.
+    """
+    df1 = read_bucket(freq_file,FREQ_COLUMNS)
+    df2 = read_bucket(all_se_file,ALL_SE_COLUMNS)
+    s1 = pd.merge(df1, df2, how='outer',on=['stitch_id(flat)','stitch_id(stereo)','umls_id(label)','meddra_type','umls_id(meddra)','se_name'])
+    df4 = read_bucket(indications_file,INDICATIONS_COLUMNS)
+    s2 = pd.merge(s1,df4,how='outer',on=['stitch_id(flat)','umls_id(label)','meddra_type','umls_id(meddra)'])
+    s3 = s2.sort_values('stitch_id(flat)',kind='mergesort')
+    s3.to_csv(output_file,header=False)
+    return list(s3.columns)
@@ -1,9 +1,28 @@
 import pandas as pd
 import csv
+import logging
+from collections import OrderedDict
 
-from biothings.utils.dataload import dict_sweep, value_convert_to_number
+from biothings.utils.common import iter_n
+from biothings.utils.dataload import dict_sweep, value_convert_to_number, merge_struct
 
-def load_data(_file, pubchem_col=None):
+# number of documents (STITCH ids) resolved at once
+LOOKUP_CHUNK_SIZE = 1000
+
+def load_data(_file, crosswalk=None):
+    # documents are resolved by blocks, STITCH ids of a whole block being
+    # looked up at once in the identifier crosswalk
+    total = unresolved = 0
+    for docs in iter_n(iter_docs(_file),LOOKUP_CHUNK_SIZE):
+        inchikeys = resolve_inchi_keys([doc["_id"] for doc in docs],crosswalk)
+        total += len(docs)
+        unresolved += len(docs) - len(inchikeys)
+        for doc in merge_docs(docs,inchikeys):
+            yield doc
+    logging.info("%s/%s STITCH ids couldn't be converted to InChIKeys (kept as _id)" % (unresolved,total))
+
+def iter_docs(_file):
+    """Iterate over documents (one per STITCH flat id) from merged file"""
     _dict = {}
     prev_id = ''
     f = open(_file,'r')
@@ -17,15 +36,39 @@ def load_data(_file, pubchem_col=None):
         else:
             prev_id = _id
             if len(_dict)!=0:
-                _dict["_id"] = find_inchi_key(_dict, pubchem_col)
                 yield _dict
                 _dict = {}
             _dict.update({'_id':row[1]})
             _dict.update({'sider': []})
             _d = restr_dict(_dict,row)
             _dict['sider'].append(_d)
-    _dict["_id"] = find_inchi_key(_dict, pubchem_col)
-    yield _dict
+    f.close()
+    if _dict:
+        yield _dict
+
+def merge_docs(docs, inchikeys):
+    """
+    Set InChIKeys as _id, merging documents ending up with the same one.
+    Documents from different blocks are merged when stored (MergerStorage).
+    """
+    merged = OrderedDict()
+    for doc in docs:
+        doc["_id"] = find_inchi_key(doc,inchikeys)
+        if doc["_id"] in merged:
+            merged[doc["_id"]] = merge_struct(merged[doc["_id"]],doc)
+        else:
+            merged[doc["_id"]] = doc
+    return merged.values()
+
+def stitch_to_cid(stitch_id):
+    """
+    Return PubChem CID from STITCH id (ex: "CID100000085" => 85), or None
+    if it's not a STITCH id
+    """
+    try:
+        return int(stitch_id[4:]) if stitch_id.startswith("CID") else None
+    except ValueError:
+        return None
 
 def restr_dict(_dict,row):
     _d = {}
@@ -36,14 +79,23 @@ def restr_dict(_dict,row):
     _d = dict_sweep(value_convert_to_number(_d))
     return _d
 
-def find_inchi_key(doc, pubchem_col):
-    _id = doc["_id"]
-    if not pubchem_col:
-        return _id
-    d = pubchem_col.find_one({'pubchem.cid':_id})
-    if d:
-        _id = d['pubchem']['inchi_key']
-    else:
-        _id = doc['_id']
-    return _id
+def resolve_inchi_keys(stitch_ids, crosswalk):
+    """
+    Return a dict mapping STITCH ids to InChIKeys, from PubChem ids in crosswalk.
+    Ids are matched as they are, as well as converted to PubChem CIDs.
+    """
+    inchikeys = {}
+    if crosswalk is None:
+        return inchikeys
+    cids = [stitch_to_cid(stitch_id) for stitch_id in stitch_ids]
+    found = crosswalk.lookup("pubchem",list(stitch_ids) + [cid for cid in cids if cid is not None])
+    for stitch_id,cid in zip(stitch_ids,cids):
+        # ids matching as they are first, converted CIDs then
+        for key in (stitch_id,cid):
+            if found.get(key):
+                inchikeys[stitch_id] = found[key][0]
+                break
+    return inchikeys
 
+def find_inchi_key(doc, inchikeys):
+    return inchikeys.get(doc["_id"],doc["_id"])
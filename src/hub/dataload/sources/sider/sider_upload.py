@@ -6,7 +6,7 @@ import pymongo
 from .sider_parser import load_data
 from hub.dataload.uploader import BaseDrugUploader
 import biothings.hub.dataload.storage as storage
-from biothings.utils.mongo import get_src_db
+from hub.dataload.crosswalk import get_crosswalk
 
 
 SRC_META = {
@@ -20,16 +20,19 @@ SRC_META = {
 class SiderUploader(BaseDrugUploader):
 
     name = "sider"
-    #storage_class = storage.IgnoreDuplicatedStorage
+    # several STITCH ids can have the same InChIKey
+    storage_class = storage.MergerStorage
     __metadata__ = {"src_meta" : SRC_META}
+    use_crosswalk = True
 
     def load_data(self,data_folder):
         input_file = os.path.join(data_folder,"merged_freq_all_se_indications.tsv")
         self.logger.info("Load data from file '%s'" % input_file)
-        pubchem_col = get_src_db()["pubchem"]
-        assert pubchem_col.count() > 0, "'pubchem' collection is empty (required for inchikey " + \
-                "conversion). Please run 'pubchem' uploader first"
-        return load_data(input_file, pubchem_col)
+        # STITCH ids are converted to InChIKeys using PubChem CIDs
+        crosswalk = get_crosswalk()
+        assert crosswalk.count("pubchem") > 0, "No PubChem CIDs in identifier crosswalk (required for " + \
+                "inchikey conversion). Please run 'pubchem' uploader first"
+        return load_data(input_file, crosswalk)
 
     def post_update_data(self, *args, **kwargs):
         # hashed because inchi is too long (and we'll do == ops to hashed are enough)
@@ -1,33 +1,52 @@
 import pandas as pd
 import json
 
+# number of rows read (and held) at once
+CHUNK_SIZE = 10000
 
-def load_data(input_file):
-
-    unii = pd.read_csv(input_file, sep='\t', low_memory=False, dtype=str)
-    unii.rename(columns={'MF': 'molecular_formula',
-                         'PT': 'preferred_term',
-                         'RN': 'registry_number'}, inplace=True)
-    unii.columns = unii.columns.str.lower()
-
-    # half of them don't have inchikeys
-    # set the primary key to inchikey and fill in missing ones with unii
-    unii['_id'] = unii.inchikey
-    unii['_id'].fillna(unii.unii, inplace=True)
-
-    dupes = set(unii._id) - set(unii._id.drop_duplicates(False))
-    records = [{k:v for k,v in record.items() if pd.notnull(v)} for record in unii.to_dict("records") if record['_id'] not in dupes]
-    records = [{'_id': record['_id'], 'unii': record} for record in records]
-    # take care of a couple cases with identical inchikeys
-    for dupe in dupes:
-        dr = unii.query("_id == @dupe").to_dict("records")
-        dr = [{k:v for k,v in record.items() if pd.notnull(v)} for record in dr]
-        records.append({'_id': dupe, 'unii': dr})
-    for record in records:
-        if isinstance(record['unii'], dict):
-            del record['unii']['_id']
-        else:
-            for subr in record['unii']:
-                del subr['_id']
-        yield record
 
+def iter_records(df):
+    """
+    Iterate over df rows as dicts, without null values (nulls are found for
+    the whole frame at once)
+    """
+    columns = list(df.columns)
+    notnull = df.notnull().values
+    for row, keep in zip(df.itertuples(index=False, name=None), notnull):
+        yield {col: val for col, val, k in zip(columns, row, keep) if k}
+
+def find_dupes(input_file):
+    """
+    Return the set of _ids shared by several records, only reading
+    UNII and InChIKey columns
+    """
+    ids = pd.read_csv(input_file, sep='\t', dtype=str, usecols=lambda col: col.lower() in ('unii', 'inchikey'))
+    ids.columns = ids.columns.str.lower()
+    _ids = ids.inchikey.fillna(ids.unii)
+    return set(_ids[_ids.duplicated(keep=False)])
+
+def load_data(input_file, chunk_size=CHUNK_SIZE):
+
+    # take care of a couple cases with identical inchikeys: these are found
+    # first, their records are kept aside and merged once the file is read
+    dupes = find_dupes(input_file)
+    dupe_records = {}
+
+    for unii in pd.read_csv(input_file, sep='\t', dtype=str, chunksize=chunk_size):
+        unii.rename(columns={'MF': 'molecular_formula',
+                             'PT': 'preferred_term',
+                             'RN': 'registry_number'}, inplace=True)
+        unii.columns = unii.columns.str.lower()
+
+        # half of them don't have inchikeys
+        # set the primary key to inchikey and fill in missing ones with unii
+        _ids = unii.inchikey.fillna(unii.unii)
+
+        for _id, record in zip(_ids, iter_records(unii)):
+            if _id in dupes:
+                dupe_records.setdefault(_id, []).append(record)
+            else:
+                yield {'_id': _id, 'unii': record}
+
+    for _id, records in dupe_records.items():
+        yield {'_id': _id, 'unii': records}
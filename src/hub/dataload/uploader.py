@@ -1,6 +1,34 @@
+import asyncio
 
 import biothings.hub.dataload.uploader as uploader
 
+from hub.dataload.crosswalk import get_crosswalk
+
 class BaseDrugUploader(uploader.BaseSourceUploader):
 
     keep_archive = 1
+    # if True, identifier crosswalk is (re)built if needed, in a thread,
+    # before loading data (so it's up-to-date when data is transformed)
+    use_crosswalk = False
+
+    def prepare_update(self):
+        """
+        Anything needed before loading data which can take a while (scanning
+        input files, ...). Runs in a thread, so hub's event loop isn't blocked.
+        Results needed by jobs() can be kept as attributes.
+        """
+        pass
+
+    @asyncio.coroutine
+    def update_data(self, batch_size, job_manager=None):
+        pinfo = self.get_pinfo()
+        pinfo["step"] = "update_data"
+        if self.__class__.use_crosswalk:
+            pinfo["description"] = "identifier crosswalk"
+            job = yield from job_manager.defer_to_thread(pinfo,get_crosswalk)
+            yield from job
+        pinfo["description"] = "prepare update"
+        job = yield from job_manager.defer_to_thread(pinfo,self.prepare_update)
+        yield from job
+        res = yield from super(BaseDrugUploader,self).update_data(batch_size,job_manager)
+        return res
@@ -0,0 +1,178 @@
+"""
+Micro-benchmark for drugbank_parser.restructure_dict(), on a synthetic
+DrugBank corpus. Reports docs/sec and, if a baseline parser module is given
+(ex: a previous version extracted with "git show <rev>:<path> > old.py"),
+compares throughput and checks outputs are identical.
+
+    python tests/bench_drugbank.py [--num 5000] [--baseline old_drugbank_parser.py]
+"""
+import sys
+import os
+import copy
+import json
+import time
+import random
+import argparse
+import importlib.util
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+
+def load_module(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def protein(tag, i, nb):
+    return "".join(["""
+    <%s position="%d"><id>BE%07d</id><name>Protein %d</name><organism>Humans</organism>
+      <actions>%s</actions><known-action>yes</known-action>
+      <polypeptide id="P%05d" source="Swiss-Prot"><name>P</name>
+        <general-function>Binding</general-function><specific-function>Binds</specific-function>
+      </polypeptide>
+    </%s>""" % (tag, n, i * 10 + n, n, "".join("<action>inhibitor%d</action>" % a for a in range(n % 3)),
+                i + n, tag) for n in range(nb)])
+
+
+def synthetic_drug(i, rnd):
+    nb = lambda: rnd.randint(1, 4)
+    ids = "".join("<drugbank-id>APRD%05d</drugbank-id>" % (i + n) for n in range(rnd.randint(0, 2)))
+    products = "".join(["""
+    <product><name>Product %d</name><labeller>Lab</labeller><ndc-id/><ndc-product-code>%05d-%03d</ndc-product-code>
+      <dpd-id>%d</dpd-id><started-marketing-on>2000-01-01</started-marketing-on><ended-marketing-on/>
+      <dosage-form>Tablet</dosage-form><strength>10 mg</strength><route>Oral</route>
+      <fda-application-number>NDA%d</fda-application-number><generic>false</generic>
+      <over-the-counter>false</over-the-counter><approved>true</approved><country>US</country>
+      <source>FDA NDC</source></product>""" % (n, i, n, i, i) for n in range(nb())])
+    calc = [("logP", "1.%d" % i), ("IUPAC Name", "name-%d" % i), ("SMILES", "C" * (i % 20 + 1)),
+            ("Molecular Weight", "%d.5" % (100 + i)), ("Monoisotopic Weight", "%d.25" % (100 + i)),
+            ("InChI", "InChI=1S/C%dH" % i), ("InChIKey", "InChIKey=%014d-UHFFFAOYSA-N" % i),
+            ("Molecular Formula", "C%dH%d" % (i, 2 * i)), ("Rule of Five", "1"), ("Bioavailability", "0"),
+            ("Ghose Filter", "1"), ("MDDR-like Rule", "0"), ("Polar Surface Area (PSA)", "12.3")]
+    calc = "".join("<property><kind>%s</kind><value>%s</value><source>ChemAxon</source></property>" % kv
+                   for kv in calc)
+    exp = "".join("<property><kind>%s</kind><value>%s</value><source/></property>" % kv
+                  for kv in [("Melting Point", "%d" % i), ("Isoelectric Point", rnd.choice(["5.6", "5.6 - 7.6", "n/a"])),
+                             ("Water Solubility", "1 mg/mL")][:rnd.randint(1, 3)])
+    extids = "".join("<external-identifier><resource>%s</resource><identifier>%d</identifier></external-identifier>" % (r, i)
+                     for r in ["Drugs Product Database (DPD)", "KEGG Drug", "PharmGKB", "UniProtKB",
+                               "ChEBI", "PubChem Compound", "PubChem Substance", "ChemSpider",
+                               "BindingDB", "Therapeutic Targets Database", "GenBank"][:rnd.randint(1, 11)])
+    links = "".join("<external-link><resource>%s</resource><url>http://example.org/%d</url></external-link>" % (r, i)
+                    for r in ["RxList", "Drugs.com", "PDRhealth"][:rnd.randint(1, 3)])
+    return """<drug type="small molecule" created="2005-06-13" updated="2018-01-01">
+  <drugbank-id primary="true">DB%05d</drugbank-id>%s
+  <name>Drug %d</name>
+  <description>Description of drug %d</description>
+  <cas-number>%d-00-0</cas-number>
+  <groups><group>approved</group>%s</groups>
+  <indication>Indication</indication><pharmacodynamics>PD</pharmacodynamics>
+  <mechanism-of-action>MoA</mechanism-of-action><toxicity>Tox</toxicity><metabolism>Met</metabolism>
+  <absorption>Abs</absorption><half-life>2h</half-life><protein-binding>90%%</protein-binding>
+  <route-of-elimination>Renal</route-of-elimination><volume-of-distribution>1L</volume-of-distribution>
+  <clearance>Clear</clearance>
+  <classification><description>Desc</description><direct-parent>DP</direct-parent><kingdom>K</kingdom></classification>
+  <salts>%s</salts>
+  <synonyms>%s</synonyms>
+  <products>%s</products>
+  <packagers>%s</packagers>
+  <manufacturers><manufacturer generic="false">Manuf %d</manufacturer></manufacturers>
+  <categories><category><category>Cat</category><mesh-id>D%d</mesh-id></category></categories>
+  <affected-organisms><affected-organism>Humans and other mammals</affected-organism></affected-organisms>
+  <ahfs-codes><ahfs-code>20:12.04.12</ahfs-code></ahfs-codes>
+  <food-interactions>%s</food-interactions>
+  <drug-interactions>%s</drug-interactions>
+  <sequences><sequence format="FASTA">&gt;seq
+MKLV</sequence></sequences>
+  <experimental-properties>%s</experimental-properties>
+  <calculated-properties>%s</calculated-properties>
+  <external-identifiers>%s</external-identifiers>
+  <external-links>%s</external-links>
+  <patents><patent><number>%d</number><country>United States</country><approved>2000-01-01</approved></patent></patents>
+  <international-brands><international-brand><name>Brand</name><company>Co</company></international-brand></international-brands>
+  <mixtures><mixture><name>Mix</name><ingredients>Drug %d</ingredients></mixture></mixtures>
+  <pathways><pathway><smpdb-id>SMP%05d</smpdb-id><name>Pathway</name>
+    <drugs><drug><drugbank-id>DB%05d</drugbank-id><name>Drug %d</name></drug></drugs>
+    <enzymes><uniprot-id>P%05d</uniprot-id></enzymes></pathway></pathways>
+  <snp-effects/>
+  <atc-codes>%s</atc-codes>
+  <targets>%s</targets>
+  <enzymes>%s</enzymes>
+  <carriers>%s</carriers>
+  <transporters>%s</transporters>
+</drug>
+""" % (i, ids, i, i, i, rnd.choice(["", "<group>investigational</group>"]),
+       "".join("<salt><drugbank-id>DBSALT%d</drugbank-id><name>Salt %d</name></salt>" % (n, n) for n in range(rnd.randint(0, 2))),
+       "".join('<synonym language="english" coder="">Syn %d-%d</synonym>' % (i, n) for n in range(nb())),
+       products,
+       "".join('<packager><name>Pack %d</name><url>http://pack</url></packager>' % n for n in range(nb())),
+       i, i,
+       "".join("<food-interaction>Food %d</food-interaction>" % n for n in range(rnd.randint(0, 3))),
+       "".join("<drug-interaction><drugbank-id>DB%05d</drugbank-id><name>D</name><description>x</description></drug-interaction>" % n
+               for n in range(nb())),
+       exp, calc, extids, links, i, i, i, i, i, i,
+       "".join('<atc-code code="B01AE0%d"><level code="B01AE">Direct thrombin inhibitors</level></atc-code>' % n
+               for n in range(nb())),
+       protein("target", i, nb()), protein("enzyme", i, rnd.randint(0, 3)),
+       protein("carrier", i, rnd.randint(0, 2)), protein("transporter", i, rnd.randint(0, 2)))
+
+
+def build_corpus(path, num, seed=42):
+    rnd = random.Random(seed)
+    with open(path, "w") as fout:
+        fout.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        fout.write('<drugbank xmlns="http://www.drugbank.ca" version="5.1" exported-on="2018-07-03">\n')
+        for i in range(num):
+            fout.write(synthetic_drug(i, rnd))
+        fout.write('</drugbank>\n')
+
+
+def bench(restructure_dict, items, repeat):
+    best = None
+    outputs = None
+    for _ in range(repeat):
+        # restructure_dict modifies its input, work on fresh copies
+        data = copy.deepcopy(items)
+        t0 = time.time()
+        res = [restructure_dict(item) for item in data]
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+        outputs = res
+    return len(items) / best, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num", type=int, default=5000, help="number of synthetic drugs")
+    parser.add_argument("--repeat", type=int, default=3, help="keep best of N runs")
+    parser.add_argument("--baseline", help="path to a previous drugbank_parser.py to compare with")
+    parser.add_argument("--xml", default="/tmp/drugbank_synthetic.xml", help="synthetic corpus location")
+    args = parser.parse_args()
+
+    current = load_module(os.path.join(src_path, "hub", "dataload", "sources", "drugbank", "drugbank_parser.py"),
+                          "drugbank_parser")
+    build_corpus(args.xml, args.num)
+    items = list(current.iter_drugs(args.xml))
+
+    rate, outputs = bench(current.restructure_dict, items, args.repeat)
+    if args.baseline:
+        baseline = load_module(args.baseline, "baseline_drugbank_parser")
+        base_rate, base_outputs = bench(baseline.restructure_dict, items, args.repeat)
+        print("baseline: %.1f docs/sec" % base_rate)
+        print("current:  %.1f docs/sec (x%.2f)" % (rate, rate / base_rate))
+        same = [json.dumps(a, sort_keys=False) == json.dumps(b, sort_keys=False)
+                for a, b in zip(outputs, base_outputs)]
+        print("identical outputs: %s/%s" % (sum(same), len(same)))
+        if not all(same):
+            sys.exit(1)
+    else:
+        print("current:  %.1f docs/sec" % rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark for pubchem_parser.load_data(), on a generated PubChem Compound
+XML file (gzipped). Reports compounds/sec per core, running the same file in
+--procs parallel processes. If a baseline parser module is given (ex: a
+previous version extracted with "git show <rev>:<path> > old.py"), it's
+benchmarked the same way and outputs are checked to be identical.
+
+    python tests/bench_pubchem.py [--num 20000] [--procs 4] [--baseline old_pubchem_parser.py]
+"""
+import sys
+import os
+import gzip
+import json
+import time
+import argparse
+import importlib.util
+from multiprocessing import Pool
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+CURRENT = os.path.join(src_path, "hub", "dataload", "sources", "pubchem", "pubchem_parser.py")
+
+# (PC-Urn_label, PC-Urn_name, value type, value)
+PROPS = [("Compound", "Canonicalized", "ival", "1"),
+         ("Compound Complexity", None, "fval", "%d.5"),
+         ("Count", "Hydrogen Bond Acceptor", "ival", "3"),
+         ("Count", "Hydrogen Bond Donor", "ival", "1"),
+         ("Count", "Rotatable Bond", "ival", "2"),
+         ("Fingerprint", "SubStructure Keys", "binary", "00000371C0703800000000"),
+         ("IUPAC Name", "Allowed", "sval", "allowed-%d"),
+         ("IUPAC Name", "CAS-like Style", "sval", "cas-%d"),
+         ("IUPAC Name", "Markup", "sval", "markup-%d"),
+         ("IUPAC Name", "Preferred", "sval", "preferred-%d"),
+         ("IUPAC Name", "Systematic", "sval", "systematic-%d"),
+         ("IUPAC Name", "Traditional", "sval", "traditional-%d"),
+         ("InChI", "Standard", "sval", "InChI=1S/C%dH"),
+         ("InChIKey", "Standard", "sval", "%014d-UHFFFAOYSA-N"),
+         ("Log P", "XLogP3", "fval", "0.%d"),
+         ("Mass", "Exact", "fval", "%d.01"),
+         ("Molecular Formula", None, "sval", "C%dH"),
+         ("Molecular Weight", None, "fval", "%d.2"),
+         ("SMILES", "Canonical", "sval", "CC(=O)%d"),
+         ("SMILES", "Isomeric", "sval", "C[C@H](=O)%d"),
+         ("Topological", "Polar Surface Area", "fval", "12.%d"),
+         ("Weight", "MonoIsotopic", "fval", "%d.001")]
+
+COUNTS = ["heavy-atom", "atom-chiral", "atom-chiral-def", "atom-chiral-undef", "bond-chiral",
+          "bond-chiral-def", "bond-chiral-undef", "isotope-atom", "covalent-unit", "tautomers"]
+
+
+def infodata(label, name, vtype, val):
+    name = name and "<PC-Urn_name>%s</PC-Urn_name>" % name or ""
+    return "<PC-InfoData><PC-InfoData_urn><PC-Urn><PC-Urn_label>%s</PC-Urn_label>%s" % (label, name) + \
+           '<PC-Urn_datatype><PC-UrnDataType value="string">7</PC-UrnDataType></PC-Urn_datatype>' + \
+           "<PC-Urn_version>2.1</PC-Urn_version><PC-Urn_software>Cactvs</PC-Urn_software>" + \
+           "<PC-Urn_source>xemistry.com</PC-Urn_source><PC-Urn_release>2019.06.18</PC-Urn_release>" + \
+           "</PC-Urn></PC-InfoData_urn><PC-InfoData_value><PC-InfoData_value_%s>%s" % (vtype, val) + \
+           "</PC-InfoData_value_%s></PC-InfoData_value></PC-InfoData>\n" % vtype
+
+
+def compound(cid):
+    props = "".join([infodata(label, name, vtype, "%" in val and val % cid or val)
+                     for label, name, vtype, val in PROPS])
+    # atoms, bonds and coordinates make most of a real compound's size
+    natoms = cid % 30 + 10
+    aids = range(1, natoms + 1)
+    atoms = "<PC-Atoms_aid>%s</PC-Atoms_aid>" % "".join("<PC-Atoms_aid_E>%d</PC-Atoms_aid_E>" % i for i in aids) + \
+            "<PC-Atoms_element>%s</PC-Atoms_element>" % "".join(
+                '<PC-Element value="%s">%d</PC-Element>' % (i % 3 and ("c", 6) or ("o", 8)) for i in aids)
+    bonds = "".join("<PC-Bonds_%s>%s</PC-Bonds_%s>" % (k, "".join("<PC-Bonds_%s_E>%d</PC-Bonds_%s_E>" % (k, v, k)
+                                                                   for v in vals), k)
+                    for k, vals in [("aid1", aids[:-1]), ("aid2", aids[1:]), ("order", [1] * (natoms - 1))])
+    coords = "<PC-Coordinates><PC-Coordinates_aid>%s</PC-Coordinates_aid>" % "".join(
+                "<PC-Coordinates_aid_E>%d</PC-Coordinates_aid_E>" % i for i in aids) + \
+             "<PC-Coordinates_conformers><PC-Conformer>%s</PC-Conformer></PC-Coordinates_conformers></PC-Coordinates>" % \
+             "".join("<PC-Conformer_%s>%s</PC-Conformer_%s>" % (k, "".join(
+                 "<PC-Conformer_%s_E>%d.%04d</PC-Conformer_%s_E>" % (k, i, i * 7, k) for i in aids), k) for k in "xy")
+    counts = "".join("<PC-Count_%s>%d</PC-Count_%s>" % (c, cid % 7, c) for c in COUNTS)
+    return "<PC-Compound>\n" + \
+           "<PC-Compound_id><PC-CompoundType><PC-CompoundType_id><PC-CompoundType_id_cid>%d" % cid + \
+           "</PC-CompoundType_id_cid></PC-CompoundType_id></PC-CompoundType></PC-Compound_id>\n" + \
+           "<PC-Compound_atoms><PC-Atoms>%s</PC-Atoms></PC-Compound_atoms>\n" % atoms + \
+           "<PC-Compound_bonds><PC-Bonds>%s</PC-Bonds></PC-Compound_bonds>\n" % bonds + \
+           "<PC-Compound_coords>%s</PC-Compound_coords>\n" % coords + \
+           "<PC-Compound_charge>0</PC-Compound_charge>\n" + \
+           "<PC-Compound_props>%s</PC-Compound_props>\n" % props + \
+           "<PC-Compound_count><PC-Count>%s</PC-Count></PC-Compound_count>\n" % counts + \
+           "</PC-Compound>\n"
+
+
+def build_sample(path, num):
+    with gzip.open(path, "wt") as fout:
+        fout.write('<?xml version="1.0"?>\n')
+        fout.write('<PC-Compounds xmlns="http://www.ncbi.nlm.nih.gov" ' +
+                   'xmlns:xs="http://www.w3.org/2001/XMLSchema-instance">\n')
+        for cid in range(1, num + 1):
+            fout.write(compound(cid))
+        fout.write('</PC-Compounds>\n')
+
+
+def run(args):
+    parser_path, xml = args
+    spec = importlib.util.spec_from_file_location("pubchem_parser", parser_path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    t0 = time.time()
+    docs = list(mod.load_data(xml))
+    return time.time() - t0, docs
+
+
+def bench(parser_path, xml, num, procs):
+    with Pool(procs) as pool:
+        res = pool.map(run, [(parser_path, xml)] * procs)
+    elapsed = max(r[0] for r in res)
+    per_core = num / (sum(r[0] for r in res) / procs)
+    return num * procs / elapsed, per_core, res[0][1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num", type=int, default=20000, help="number of generated compounds")
+    parser.add_argument("--procs", type=int, default=1, help="number of parallel processes")
+    parser.add_argument("--baseline", help="path to a previous pubchem_parser.py to compare with")
+    parser.add_argument("--xml", default="/tmp/Compound_synthetic.xml.gz", help="generated sample location")
+    args = parser.parse_args()
+
+    build_sample(args.xml, args.num)
+    total, per_core, docs = bench(CURRENT, args.xml, args.num, args.procs)
+    print("current:  %.1f compounds/sec/core (%.1f total, %s procs)" % (per_core, total, args.procs))
+    if args.baseline:
+        base_total, base_per_core, base_docs = bench(args.baseline, args.xml, args.num, args.procs)
+        print("baseline: %.1f compounds/sec/core (%.1f total, %s procs)" % (base_per_core, base_total, args.procs))
+        print("speedup:  x%.2f" % (per_core / base_per_core))
+        same = [json.dumps(a) == json.dumps(b) for a, b in zip(docs, base_docs)]
+        print("identical outputs: %s/%s" % (sum(same), len(same)))
+        if not all(same) or len(docs) != len(base_docs):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
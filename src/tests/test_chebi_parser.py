@@ -0,0 +1,100 @@
+"""
+Tests for ChEBI SDF record index and sharding (see chebi_parser.get_record_index()
+and shard_records()): reading all shards must give the same records as
+reading the whole file.
+
+    nosetests tests/test_chebi_parser.py  (or: pytest tests/test_chebi_parser.py)
+"""
+import os
+import sys
+import shutil
+import random
+import tempfile
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+from hub.dataload.sources.chebi import chebi_parser
+
+NUM_RECORDS = 40
+
+
+def write_sdf(path, num, seed=1):
+    """Write a ChEBI-like SDF file, records having various sizes"""
+    rnd = random.Random(seed)
+    with open(path, "w") as fout:
+        for i in range(num):
+            fout.write("\n  Marvin  02030822342D\n\n  2  1  0  0  0  0            999 V2000\n"
+                       "    0.0  0.0  0.0 C   0  0\n  1  2  1  0  0  0  0\nM  END\n")
+            fout.write("> <ChEBI ID>\nCHEBI:%d\n\n> <ChEBI Name>\nname %d\n\n" % (i, i))
+            if rnd.random() < .5:
+                fout.write("> <Definition>\nA <stereo>def</stereo> %d\n\n" % i)
+            fout.write("> <Synonyms>\n%s\n\n" % "\n".join("syn %d" % k for k in range(rnd.randint(1, 4))))
+            fout.write("> <UniProt Database Links>\n%s\n\n" %
+                       "\n".join("P%05d" % k for k in range(rnd.choice([1, 5, 200]))))
+            fout.write("$$$$\n")
+
+
+def setup_module():
+    global tmp_dir, sdf_file, whole
+    tmp_dir = tempfile.mkdtemp()
+    sdf_file = os.path.join(tmp_dir, "ChEBI_complete.sdf")
+    write_sdf(sdf_file, NUM_RECORDS)
+    whole = list(chebi_parser.iter_sdf_records(sdf_file))
+
+
+def teardown_module():
+    shutil.rmtree(tmp_dir)
+
+
+def test_whole_file():
+    assert [rec["ChEBI ID"] for rec in whole] == ["CHEBI:%d" % i for i in range(NUM_RECORDS)]
+    # tag values are kept as is, even if they look like tags
+    assert [rec["Definition"] for rec in whole if "Definition" in rec][0].startswith("A <stereo>")
+
+
+def test_record_index():
+    offsets = chebi_parser.build_record_index(sdf_file)
+    assert len(offsets) == NUM_RECORDS and offsets[0] == 0
+    with open(sdf_file, "rb") as f:
+        data = f.read()
+    for offset in offsets[1:]:
+        assert data[offset - 5:offset] == b"$$$$\n"
+    for offset, rec in zip(offsets, whole):
+        assert next(chebi_parser.iter_sdf_records(sdf_file, offset, 1)) == rec
+
+
+def test_record_index_cache():
+    path = os.path.join(tmp_dir, "cached.sdf")
+    write_sdf(path, 5)
+    built = []
+    orig = chebi_parser.build_record_index
+    chebi_parser.build_record_index = lambda f: built.append(f) or orig(f)
+    try:
+        offsets = chebi_parser.get_record_index(path)
+        assert os.path.exists(path + ".idx") and len(offsets) == 5
+        assert chebi_parser.get_record_index(path) == offsets
+        assert built == [path]
+        # file changed, index is rebuilt
+        write_sdf(path, 7)
+        assert len(chebi_parser.get_record_index(path)) == 7
+        assert built == [path, path]
+    finally:
+        chebi_parser.build_record_index = orig
+
+
+def test_shards():
+    offsets = chebi_parser.build_record_index(sdf_file)
+    size = os.path.getsize(sdf_file)
+    for num_shards in (1, 2, 3, 8, NUM_RECORDS, NUM_RECORDS + 5):
+        shards = chebi_parser.shard_records(offsets, size, num_shards)
+        assert 1 <= len(shards) <= num_shards
+        # all records, each one in one shard only
+        assert sum(count for _, count in shards) == NUM_RECORDS
+        records = []
+        for start, count in shards:
+            assert start in offsets
+            records.extend(chebi_parser.iter_sdf_records(sdf_file, start, count))
+        assert records == whole
+    assert chebi_parser.shard_records([], 0, 4) == []
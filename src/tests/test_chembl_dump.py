@@ -0,0 +1,70 @@
+"""
+Tests for ChEMBL API pages download (see ChemblDumper.do_dump()): download
+is sent to another process, so the dumper must be pickable at that point.
+
+    nosetests tests/test_chembl_dump.py  (or: pytest tests/test_chembl_dump.py)
+"""
+import os
+import sys
+import pickle
+import asyncio
+import threading
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+import biothings.hub.dataload.dumper as dumper
+from hub.dataload.sources.chembl.chembl_dump import ChemblDumper
+
+
+class UnpickableCollection(object):
+    """Like a pymongo collection, holding a lock (can't be pickled)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def find_one(self, *args, **kwargs):
+        return {}
+
+    def update_one(self, *args, **kwargs):
+        pass
+
+
+class FakeJobManager(object):
+    """Pickle functions sent to processes (like ProcessPoolExecutor), without running them"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.pickled = []
+
+    @asyncio.coroutine
+    def defer_to_process(self, pinfo, func):
+        self.pickled.append(pickle.dumps(func))
+        yield from asyncio.sleep(0)
+        fut = self.loop.create_future()
+        fut.set_result(None)
+        return fut
+
+
+def test_download_pages_pickable():
+    orig = dumper.get_src_dump
+    dumper.get_src_dump = UnpickableCollection
+    loop = asyncio.new_event_loop()
+    try:
+        dump = ChemblDumper()
+        pages = [{"remote": ChemblDumper.SRC_DATA_URL + "?limit=1000&offset=0", "local": "/tmp/molecule.part0"}]
+        dump.to_dump = []
+        dump.to_dump_pages = pages
+        # prepared, as when do_dump() runs (parent logs through self.logger)
+        assert isinstance(dump.src_dump, UnpickableCollection)
+        job_manager = FakeJobManager(loop)
+        loop.run_until_complete(dump.do_dump(job_manager=job_manager))
+        func = pickle.loads(job_manager.pickled[0])
+        assert func.func.__name__ == "download_pages" and func.args == (pages,)
+        # dumper is usable again afterward
+        assert isinstance(dump.src_dump, UnpickableCollection)
+        assert dump.to_dump_pages == []
+    finally:
+        loop.close()
+        dumper.get_src_dump = orig
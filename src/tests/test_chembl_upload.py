@@ -0,0 +1,191 @@
+"""
+Tests for ChEMBL delta uploads (see chembl_upload.delta_upload_worker(),
+ChemblUploader.merge_duplicates() and delete_stale()), using in-memory
+collections instead of MongoDB
+
+    nosetests tests/test_chembl_upload.py  (or: pytest tests/test_chembl_upload.py)
+"""
+import os
+import sys
+import copy
+import types
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from hub.dataload.sources.chembl import chembl_upload
+from hub.dataload.sources.chembl.chembl_upload import ChemblUploader, delta_upload_worker
+
+
+def match(doc, query):
+    for key, cond in query.items():
+        if isinstance(cond, dict) and "$in" in cond:
+            if doc.get(key) not in cond["$in"]:
+                return False
+        elif isinstance(cond, dict) and "$ne" in cond:
+            if doc.get(key) == cond["$ne"]:
+                return False
+        elif doc.get(key) != cond:
+            return False
+    return True
+
+
+class Cursor(list):
+
+    def sort(self, keys):
+        for key, direction in reversed(keys):
+            super(Cursor, self).sort(key=lambda d: d[key], reverse=direction < 0)
+        return self
+
+
+class FakeCollection(object):
+    """Minimal collection, supporting queries and writes used in delta uploads"""
+
+    def __init__(self):
+        self.docs = {}
+        self.seq = 0
+
+    def find(self, query=None, projection=None):
+        return Cursor([copy.deepcopy(d) for d in list(self.docs.values()) if match(d, query or {})])
+
+    def find_one(self, query):
+        found = self.find(query)
+        return found and found[0] or None
+
+    def count(self, query=None):
+        return len(self.find(query))
+
+    def insert_many(self, docs, ordered=True):
+        errors = []
+        for i, doc in enumerate(docs):
+            if "_id" not in doc:
+                self.seq += 1
+                doc["_id"] = self.seq
+            if doc["_id"] in self.docs:
+                errors.append({"index": i, "code": 11000, "op": doc})
+            else:
+                self.docs[doc["_id"]] = copy.deepcopy(doc)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    def replace_one(self, query, doc, upsert=False):
+        self.bulk_write([ReplaceOne(query, doc, upsert=upsert)])
+
+    def update_one(self, query, doc, upsert=False):
+        self.bulk_write([UpdateOne(query, doc, upsert=upsert)])
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            _id = op._filter["_id"]
+            if isinstance(op, ReplaceOne):
+                assert _id in self.docs or op._upsert
+                self.docs[_id] = copy.deepcopy(op._doc)
+            elif isinstance(op, UpdateOne):
+                assert _id in self.docs or op._upsert
+                self.docs.setdefault(_id, {"_id": _id}).update(copy.deepcopy(op._doc["$set"]))
+            else:
+                raise NotImplementedError(op)
+
+    def delete_many(self, query):
+        ids = [_id for _id, d in self.docs.items() if match(d, query)]
+        for _id in ids:
+            del self.docs[_id]
+        return types.SimpleNamespace(deleted_count=len(ids))
+
+    def drop(self):
+        self.docs = {}
+
+
+class FakeDB(dict):
+
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+
+def molecules(*specs):
+    """Return a parser-like function yielding one doc per (_id, {field: value}) spec"""
+    def load_data():
+        for _id, fields in specs:
+            yield {"_id": _id, "chembl": dict(fields)}
+    return load_data
+
+
+def setup_module():
+    global orig_get_src_db, db
+    db = FakeDB()
+    orig_get_src_db = chembl_upload.get_src_db
+    chembl_upload.get_src_db = lambda: db
+
+
+def teardown_module():
+    chembl_upload.get_src_db = orig_get_src_db
+
+
+def uploader():
+    return types.SimpleNamespace(db=db)
+
+
+def upload(run_id, *jobs):
+    """Run delta upload run_id, one job per list of specs, as ChemblUploader.update_data() does"""
+    claims, dups = "chembl_claims_" + run_id, "chembl_dups_" + run_id
+    cnt = sum([delta_upload_worker(molecules(*specs), "chembl", "chembl_hashes", claims, dups, run_id, 2)
+               for specs in jobs])
+    merged = ChemblUploader.merge_duplicates(uploader(), "chembl", "chembl_hashes", dups)
+    db[claims].drop()
+    db[dups].drop()
+    stats = ChemblUploader.get_delta_stats(uploader(), "chembl_hashes", run_id)
+    stats["merged"] = merged
+    return cnt, stats
+
+
+def delete_stale(run_id):
+    return ChemblUploader.delete_stale(uploader(), "chembl", "chembl_hashes", run_id, 2)
+
+
+def test_delta_upload():
+    col, hashes = db["chembl"], db["chembl_hashes"]
+    # "A" found twice, in different batches
+    cnt, stats = upload("run1", [("A", {"x": 1}), ("B", {"x": 2}), ("C", {"x": 3}), ("A", {"y": 1})])
+    assert cnt == 4
+    assert stats == {"inserted": 3, "updated": 0, "unchanged": 0, "merged": 1}
+    assert col.docs["A"] == {"_id": "A", "chembl": {"x": 1, "y": 1}}
+    assert set(hashes.docs) == {"A", "B", "C"}
+    assert set(d["run"] for d in hashes.docs.values()) == {"run1"}
+    assert delete_stale("run1") == 0
+
+    # same release, nothing written but hashes
+    before = copy.deepcopy(col.docs)
+    cnt, stats = upload("run2", [("A", {"x": 1}), ("A", {"y": 1}), ("B", {"x": 2}), ("C", {"x": 3})])
+    assert stats == {"inserted": 0, "updated": 0, "unchanged": 3, "merged": 1}
+    assert col.docs == before
+    assert delete_stale("run2") == 0
+
+    # "B" changed, "C" removed, "D" new
+    cnt, stats = upload("run3", [("A", {"x": 1}), ("A", {"y": 1}), ("B", {"x": 20}), ("D", {"x": 4})])
+    assert stats == {"inserted": 1, "updated": 1, "unchanged": 1, "merged": 1}
+    assert col.docs["B"]["chembl"] == {"x": 20}
+    assert delete_stale("run3") == 1
+    assert set(col.docs) == set(hashes.docs) == {"A", "B", "D"}
+    # "A" changed through one of its duplicates only
+    cnt, stats = upload("run4", [("A", {"x": 1}), ("B", {"x": 20})], [("D", {"x": 4}), ("A", {"y": 2})])
+    assert stats == {"inserted": 0, "updated": 1, "unchanged": 2, "merged": 1}
+    assert col.docs["A"]["chembl"] == {"x": 1, "y": 2}
+
+
+def test_delta_upload_jobs():
+    # "E" found in three jobs (files) of the same run, each of its documents
+    # is merged, whatever the job
+    cnt, stats = upload("run5", [("E", {"x": 5})], [("E", {"y": 5}), ("F", {"x": 6})], [("E", {"z": 5})])
+    assert cnt == 4
+    assert stats == {"inserted": 2, "updated": 0, "unchanged": 0, "merged": 2}
+    assert db["chembl"].docs["E"]["chembl"] == {"x": 5, "y": 5, "z": 5}
+    # temporary collections are gone
+    assert not [name for name, col in db.items() if "run5" in name and col.docs]
+    # anything not seen during run5 is stale
+    assert delete_stale("run5") == 3
+    assert set(db["chembl"].docs) == set(db["chembl_hashes"].docs) == {"E", "F"}
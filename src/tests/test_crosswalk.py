@@ -0,0 +1,161 @@
+"""
+Tests for hub.dataload.crosswalk, built from small in-memory collections
+
+    nosetests tests/test_crosswalk.py  (or: pytest tests/test_crosswalk.py)
+"""
+import os
+import sys
+import shutil
+import pickle
+import datetime
+import tempfile
+import threading
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+from hub.dataload import crosswalk
+
+
+class FakeCollection(object):
+    """Minimal collection: find() returns all documents, in insertion order"""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query=None, projection=None):
+        return iter(self.docs)
+
+    def find_one(self, query):
+        return ([doc for doc in self.docs if doc["_id"] == query["_id"]] or [None])[0]
+
+
+SRC_DB = {
+        "drugbank" : FakeCollection([
+            {"_id" : "A", "drugbank" : {"drugbank_id" : "DB01", "accession_number" : ["DB01", "APRD1"],
+                                        "inchi_key" : "ZZZZZZZZZZZZZZ-UHFFFAOYSA-N",
+                                        "products" : [{"ndc_product_code" : "0001-01"},
+                                                      {"ndc_product_code" : "0001-02"}]}},
+            # same NDC code as above, found later in collection
+            {"_id" : "B", "drugbank" : {"drugbank_id" : "DB02", "inchi_key" : "AAAAAAAAAAAAAA-UHFFFAOYSA-N",
+                                        "products" : [{"ndc_product_code" : "0001-01"}]}},
+            ]),
+        "chembl" : FakeCollection([
+            {"_id" : "C", "chembl" : {"molecule_chembl_id" : "CHEMBL1", "inchi_key" : "CCCCCCCCCCCCCC-UHFFFAOYSA-N"}},
+            ]),
+        "pubchem" : FakeCollection([
+            {"_id" : "P", "pubchem" : {"cid" : 123, "inchi_key" : "PPPPPPPPPPPPPP-UHFFFAOYSA-N"}},
+            ]),
+        "chebi" : FakeCollection([]),
+        "unii" : FakeCollection([]),
+        }
+
+
+def setup_module():
+    global tmp_dir, path
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "crosswalk.sqlite")
+    crosswalk.build_crosswalk(path, {"test" : 1}, src_db=SRC_DB)
+
+
+def teardown_module():
+    shutil.rmtree(tmp_dir)
+
+
+def test_signature():
+    assert crosswalk.Crosswalk(path).signature == {"test" : 1}
+    assert not [f for f in os.listdir(tmp_dir) if f.endswith(".tmp")]
+
+
+def test_lookup():
+    cw = crosswalk.Crosswalk(path)
+    assert cw.lookup("drugbank", ["DB01", "DB03"]) == {"DB01" : ["ZZZZZZZZZZZZZZ-UHFFFAOYSA-N"]}
+    assert cw.lookup("drugbank_accession", ["APRD1"]) == {"APRD1" : ["ZZZZZZZZZZZZZZ-UHFFFAOYSA-N"]}
+    # ids are stored as strings, original values are returned
+    assert cw.lookup("pubchem", [123]) == {123 : ["PPPPPPPPPPPPPP-UHFFFAOYSA-N"]}
+    assert cw.get("chembl", "CHEMBL1") == "CCCCCCCCCCCCCC-UHFFFAOYSA-N"
+    assert cw.get("chembl", "CHEMBL2") is None
+    assert cw.count("ndc") == 3 and cw.count("pubchem") == 1 and cw.count("chebi") == 0
+
+
+def test_threads():
+    # same object used from several threads (hub's thread pool), and pickled
+    # to be sent to worker processes
+    cw = crosswalk.Crosswalk(path)
+    assert cw.get("chembl", "CHEMBL1") == "CCCCCCCCCCCCCC-UHFFFAOYSA-N"
+    res = []
+    thread = threading.Thread(target=lambda: res.append(cw.get("chembl", "CHEMBL1")))
+    thread.start()
+    thread.join()
+    assert res == ["CCCCCCCCCCCCCC-UHFFFAOYSA-N"]
+    cw = pickle.loads(pickle.dumps(cw))
+    assert cw.get("pubchem", 123) == "PPPPPPPPPPPPPP-UHFFFAOYSA-N"
+
+
+def test_sources_signature():
+    def upload(col, status, release, started_at):
+        return {"_id": col, "upload": {"jobs": {col: {"status": status, "release": release,
+                                                       "started_at": started_at}}}}
+    day1, day2 = datetime.datetime(2018, 1, 1), datetime.datetime(2018, 1, 2)
+    src_dump = FakeCollection([upload("drugbank", "success", "5.0", day1),
+                               upload("chembl", "success", "23", day1)])
+    orig = crosswalk.get_src_dump
+    crosswalk.get_src_dump = lambda: src_dump
+    try:
+        signature = crosswalk.get_sources_signature()
+        assert signature["drugbank"] == ["5.0", str(day1)] and signature["chembl"] == ["23", str(day1)]
+        assert signature["pubchem"] is None
+        # chembl being uploaded again: its collection is still the same,
+        # so is the signature of a crosswalk built from it
+        src_dump.docs[1] = {"_id": "chembl", "upload": {"jobs": {"chembl": {"status": "uploading",
+                                                                           "started_at": day2}}}}
+        assert crosswalk.get_sources_signature(signature) == signature
+        assert crosswalk.get_sources_signature()["chembl"] is None
+        # failed
+        src_dump.docs[1] = upload("chembl", "failed", "24", day2)
+        assert crosswalk.get_sources_signature(signature) == signature
+        # new upload done
+        src_dump.docs[1] = upload("chembl", "success", "24", day2)
+        assert crosswalk.get_sources_signature(signature)["chembl"] == ["24", str(day2)]
+    finally:
+        crosswalk.get_src_dump = orig
+
+
+def test_first_seen_wins():
+    # like the former NDC map, first InChIKey found in collection is kept,
+    # even if it's not the smallest one
+    cw = crosswalk.Crosswalk(path)
+    assert cw.get_map("ndc") == {"0001-01" : "ZZZZZZZZZZZZZZ-UHFFFAOYSA-N",
+                                 "0001-02" : "ZZZZZZZZZZZZZZ-UHFFFAOYSA-N"}
+    assert cw.get("ndc", "0001-01") == "ZZZZZZZZZZZZZZ-UHFFFAOYSA-N"
+    assert cw.lookup("ndc", ["0001-01"]) == {"0001-01" : ["ZZZZZZZZZZZZZZ-UHFFFAOYSA-N",
+                                                          "AAAAAAAAAAAAAA-UHFFFAOYSA-N"]}
+
+
+def test_get_crosswalk():
+    signature = {"test" : 2}
+    built = []
+    orig = (crosswalk.get_crosswalk_file, crosswalk.get_sources_signature, crosswalk.build_crosswalk)
+    other_path = os.path.join(tmp_dir, "other.sqlite")
+    crosswalk.get_crosswalk_file = lambda: other_path
+    crosswalk.get_sources_signature = lambda current=None: signature
+    crosswalk.build_crosswalk = lambda p, sig: built.append(p) or orig[2](p, sig, src_db=SRC_DB)
+    try:
+        crosswalk._crosswalk = None
+        assert crosswalk.get_crosswalk(build=False) is None
+        cw = crosswalk.get_crosswalk()
+        assert built == [other_path] and cw.signature == signature
+        # up-to-date, not built again
+        assert crosswalk.get_crosswalk() is cw
+        crosswalk._crosswalk = None
+        assert crosswalk.get_crosswalk(build=False).signature == signature
+        assert built == [other_path]
+        # sources changed
+        signature = {"test" : 3}
+        assert crosswalk.get_crosswalk(build=False) is None
+        assert crosswalk.get_crosswalk().signature == signature
+        assert len(built) == 2
+    finally:
+        crosswalk.get_crosswalk_file, crosswalk.get_sources_signature, crosswalk.build_crosswalk = orig
+        crosswalk._crosswalk = None
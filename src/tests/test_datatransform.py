@@ -0,0 +1,161 @@
+"""
+Tests for hub.dataload.datatransform edges (CachedEdge, CrosswalkEdge) and
+BatchedDataTransformMDB, using in-memory edges instead of MongoDB
+
+    nosetests tests/test_datatransform.py  (or: pytest tests/test_datatransform.py)
+"""
+import os
+import sys
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+import networkx as nx
+from biothings.hub.datatransform import DataTransformEdge, IDStruct, MongoDBEdge, RegExEdge
+
+from hub.dataload import datatransform
+from hub.dataload.datatransform import BatchedDataTransformMDB, CachedEdge, CrosswalkEdge
+
+
+class DictEdge(DataTransformEdge):
+    """Edge converting ids using a dict, recording the ids looked up"""
+
+    def __init__(self, mapping):
+        super(DictEdge, self).__init__()
+        self.weight = 1
+        self.mapping = mapping
+        self.looked_up = []
+
+    def edge_lookup(self, keylookup_obj, id_strct, debug=False):
+        self.looked_up.extend(id_strct.id_lst)
+        res = IDStruct()
+        for orig_id, _id in id_strct:
+            if _id in self.mapping:
+                res.add(orig_id, self.mapping[_id])
+        return res
+
+
+class FakeCrosswalk(object):
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.looked_up = []
+
+    def lookup(self, id_type, ids):
+        self.looked_up.append((id_type, list(ids)))
+        return dict([(_id, [self.mapping[_id]]) for _id in ids if _id in self.mapping])
+
+
+def lookup(edge, ids):
+    id_strct = IDStruct()
+    for _id in ids:
+        id_strct.add(_id, _id)
+    res = edge.edge_lookup(None, id_strct)
+    found = dict([(_id, sorted(res.find_left(_id))) for _id in ids])
+    return dict([(_id, val) for _id, val in found.items() if val])
+
+
+def test_cached_edge():
+    inner = DictEdge({"a": "A", "b": "B", "c": "C"})
+    edge = CachedEdge(inner)
+    assert lookup(edge, ["a", "b", "x"]) == {"a": ["A"], "b": ["B"]}
+    # no match is cached too
+    assert lookup(edge, ["b", "x", "c"]) == {"b": ["B"], "c": ["C"]}
+    assert sorted(inner.looked_up) == ["a", "b", "c", "x"]
+    assert edge.stats["misses"] == 4 and edge.stats["hits"] == 2
+    assert "2 hits, 4 misses" in edge.report()
+    edge.reset()
+    assert not edge.cache and edge.stats["hits"] == edge.stats["misses"] == 0
+
+
+def test_cached_edge_lru():
+    inner = DictEdge({"a": "A", "b": "B", "c": "C"})
+    edge = CachedEdge(inner, cache_size=2)
+    for _id in ["a", "b", "x"]:
+        lookup(edge, [_id])
+    # "a" is the least recently used, evicted
+    assert list(edge.cache) == ["b", "x"]
+    assert lookup(edge, ["x"]) == {} and lookup(edge, ["b"]) == {"b": ["B"]}
+    assert list(edge.cache) == ["x", "b"]
+    assert lookup(edge, ["c"]) == {"c": ["C"]}
+    assert list(edge.cache) == ["b", "c"]
+    assert lookup(edge, ["a"]) == {"a": ["A"]}
+    assert inner.looked_up == ["a", "b", "x", "c", "a"]
+    assert edge.stats["misses"] == 5 and edge.stats["hits"] == 2
+
+
+def test_crosswalk_edge():
+    fallback = DictEdge({"db1": "IK1", "db2": "IK2"})
+    edge = CrosswalkEdge("drugbank", fallback)
+    edge.set_crosswalk(None)
+    assert lookup(edge, ["db1"]) == {"db1": ["IK1"]}
+    crosswalk = FakeCrosswalk({"db2": "IK2-CW"})
+    edge.set_crosswalk(crosswalk)
+    assert lookup(edge, ["db1", "db2"]) == {"db2": ["IK2-CW"]}
+    assert [(id_type, sorted(ids)) for id_type, ids in crosswalk.looked_up] == [("drugbank", ["db1", "db2"])]
+    assert fallback.looked_up == ["db1"]
+
+
+def build_graph():
+    graph = nx.DiGraph()
+    graph.add_edge("chebi-short", "drugbank",
+                   object=MongoDBEdge("drugbank", "drugbank.chebi", "drugbank.drugbank_id", check_index=False))
+    graph.add_edge("drugbank", "inchikey",
+                   object=CrosswalkEdge("drugbank", MongoDBEdge("drugbank", "drugbank.drugbank_id",
+                                                                "drugbank.inchi_key", check_index=False)))
+    graph.add_edge("chembl", "inchikey", object=DictEdge({"CHEMBL1": "IK1", "CHEMBL2": "IK2"}))
+    for _, _, data in graph.edges(data=True):
+        data["object"] = CachedEdge(data["object"])
+    return graph
+
+
+def test_fused_path():
+    transform = BatchedDataTransformMDB(build_graph(), ["chebi-short"], ["inchikey"])
+    path, = transform.paths[("chebi-short", "inchikey")]
+    assert path == ("chebi-short>drugbank", "inchikey")
+    edge = transform.graph.edges["chebi-short>drugbank", "inchikey"]["object"]
+    # fused edge is still cached, and resolved from the crosswalk
+    assert isinstance(edge, CachedEdge) and isinstance(edge.edge, CrosswalkEdge)
+    assert edge.edge.id_type == "drugbank_chebi"
+    assert edge.edge.fallback.lookup == "drugbank.chebi"
+    assert edge.edge.fallback.field == "drugbank.inchi_key"
+
+
+def test_fused_path_prefix():
+    graph = build_graph()
+    prefix = CachedEdge(RegExEdge("CHEBI:", ""))
+    graph.add_edge("chebi", "chebi-short", object=prefix)
+    transform = BatchedDataTransformMDB(graph, ["chebi"], ["inchikey"])
+    path, = transform.paths[("chebi", "inchikey")]
+    assert path == ("chebi", "chebi-short>drugbank", "inchikey")
+    # fused vertex is reached the same way as the vertex it replaces
+    assert transform.graph.edges["chebi", "chebi-short>drugbank"]["object"] is prefix
+
+
+def test_call_resets_caches():
+    orig = datatransform.get_crosswalk
+    calls = []
+    datatransform.get_crosswalk = lambda build=True: calls.append(build)
+    try:
+        transform = BatchedDataTransformMDB(build_graph(), ["chembl"], ["inchikey"])
+
+        @transform
+        def load_data(docs):
+            for doc in docs:
+                yield dict(doc)
+
+        edge = transform.graph.edges["chembl", "inchikey"]["object"]
+        docs = [{"_id": "CHEMBL1"}, {"_id": "CHEMBL2"}, {"_id": "CHEMBL1"}]
+        assert [d["_id"] for d in load_data(docs)] == ["IK1", "IK2", "IK1"]
+        assert edge.stats["misses"] == 2 and edge.stats["hits"] == 0
+        assert sorted(edge.edge.looked_up) == ["CHEMBL1", "CHEMBL2"]
+        # crosswalk is checked once per call, without building it
+        assert calls == [False]
+        # new call, cache and counters start over (source may have changed)
+        assert [d["_id"] for d in load_data(docs[:1])] == ["IK1"]
+        assert edge.stats["misses"] == 1 and edge.stats["hits"] == 0
+        assert edge.edge.looked_up[2:] == ["CHEMBL1"]
+        assert calls == [False, False]
+    finally:
+        datatransform.get_crosswalk = orig
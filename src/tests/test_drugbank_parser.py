@@ -0,0 +1,79 @@
+"""
+Tests for DrugBank XML sharding (see drugbank_parser.shard_offsets()): parsing
+all shards must give the same documents as parsing the whole file.
+
+    nosetests tests/test_drugbank_parser.py  (or: pytest tests/test_drugbank_parser.py)
+"""
+import os
+import sys
+import copy
+import shutil
+import tempfile
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+from tests.bench_drugbank import build_corpus
+from hub.dataload.sources.drugbank import drugbank_parser
+
+NUM_DRUGS = 30
+
+
+def setup_module():
+    global tmp_dir, xml_file, whole
+    tmp_dir = tempfile.mkdtemp()
+    xml_file = os.path.join(tmp_dir, "drugbank.xml")
+    build_corpus(xml_file, NUM_DRUGS)
+    whole = list(drugbank_parser.load_data(xml_file))
+
+
+def teardown_module():
+    shutil.rmtree(tmp_dir)
+
+
+def test_whole_file():
+    # drugs nested in pathways aren't top-level documents
+    assert len(whole) == NUM_DRUGS
+    assert [doc["drugbank"]["drugbank_id"] for doc in whole] == ["DB%05d" % i for i in range(NUM_DRUGS)]
+
+
+def test_shard_offsets():
+    for num_shards in (1, 2, 3, 7, NUM_DRUGS, NUM_DRUGS + 5):
+        shards = drugbank_parser.shard_offsets(xml_file, num_shards)
+        assert 1 <= len(shards) <= num_shards
+        # contiguous ranges, starting on a top-level <drug> element
+        for (_, end), (start, _) in zip(shards, shards[1:]):
+            assert end == start
+        with open(xml_file, "rb") as f:
+            data = f.read()
+        assert data[shards[-1][1]:].strip() == b"</drugbank>"
+        for start, _ in shards:
+            assert data[start:start + 6] == b"<drug " and data[start - 1:start] == b"\n"
+
+
+def test_shards_load_data():
+    for num_shards in (1, 2, 4, NUM_DRUGS):
+        docs = []
+        for start, end in drugbank_parser.shard_offsets(xml_file, num_shards):
+            docs.extend(drugbank_parser.load_data(xml_file, start, end))
+        assert docs == whole
+
+
+def test_conversions():
+    # local conversions follow biothings.utils.dataload ones
+    from biothings.utils.dataload import boolean_convert, value_convert_to_number
+    orig = drugbank_parser.convert_booleans, drugbank_parser.convert_numbers
+    drugbank_parser.convert_booleans = lambda d: boolean_convert(d, drugbank_parser.BOOLEAN_KEYS)
+    drugbank_parser.convert_numbers = lambda d: value_convert_to_number(d, list(drugbank_parser.NUMBER_SKIPPED_KEYS))
+    try:
+        assert list(drugbank_parser.load_data(xml_file)) == whole
+    finally:
+        drugbank_parser.convert_booleans, drugbank_parser.convert_numbers = orig
+    doc = {"predicted_properties": {"rule_of_five": "1", "ghose_filter": "NO", "logp": "1.5"},
+           "products": [{"generic": "false", "otc": "t", "dpd": "123", "strength": "10"}],
+           "xrefs": {"chebi": "1234", "pubchem_compound": ["1", "2"], "kegg": ("1", "a")}}
+    expected = value_convert_to_number(boolean_convert(copy.deepcopy(doc), drugbank_parser.BOOLEAN_KEYS),
+                                       list(drugbank_parser.NUMBER_SKIPPED_KEYS))
+    assert drugbank_parser.convert_numbers(drugbank_parser.convert_booleans(doc)) == expected
+    assert expected["products"][0] == {"generic": False, "otc": True, "dpd": "123", "strength": 10}
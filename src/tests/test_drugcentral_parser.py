@@ -0,0 +1,308 @@
+"""
+Tests for DrugCentral parser: InChIKeys resolved from xrefs with the
+identifier crosswalk (see drugcentral_parser.xref_2_inchikey()), and
+documents built from synthetic tables, grouped and split in parts by
+DrugCentralDumper.post_dump(), which must be the same as the ones from the
+former implementation (one pandas groupby() per table, documents built from
+per-table dicts), reproduced in reference_load_data().
+
+    nosetests tests/test_drugcentral_parser.py  (or: pytest tests/test_drugcentral_parser.py)
+"""
+import os
+import sys
+import csv
+import json
+import pickle
+import random
+import shutil
+import asyncio
+import tempfile
+import threading
+from collections import defaultdict
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+import pandas as pd
+from biothings.utils.dataload import dict_sweep, unlist
+
+import biothings.hub.dataload.dumper as dumper
+from hub.dataload.sources.drugcentral import drugcentral_parser
+from hub.dataload.sources.drugcentral.drugcentral_dump import DrugCentralDumper
+
+NUM_STRUCTS = 400
+
+
+class FakeCrosswalk(object):
+    """Crosswalk resolving ids from a dict (id type => {id: InChIKey}), recording lookups"""
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.lookups = []
+
+    def lookup(self, id_type, ids):
+        ids = list(ids)
+        self.lookups.append((id_type, sorted(ids)))
+        mapping = self.mapping.get(id_type, {})
+        return dict([(_id, [mapping[_id]]) for _id in ids if _id in mapping])
+
+
+def test_xref_2_inchikey():
+    crosswalk = FakeCrosswalk({"unii": {"U1": "IK-UNII-1", "U2": "IK-UNII-2"},
+                               "drugbank_accession": {"DB1": "IK-DB-1"},
+                               "chembl": {"CHEMBL3": "IK-CHEMBL-3"},
+                               "pubchem": {3: "IK-PUBCHEM-3"}})
+    xrefs = {1: {"unii": "U1", "drugbank_id": "DB1"},
+             # list of xrefs, first one unknown
+             2: {"unii": ["U0", "U2"]},
+             # last resolved type wins
+             3: {"unii": "U0", "chembl_id": "CHEMBL3", "pubchem_cid": 3},
+             4: {"kegg_drug": "D4"},
+             5: {}}
+    assert drugcentral_parser.xref_2_inchikey(xrefs, crosswalk) == \
+            {1: "IK-DB-1", 2: "IK-UNII-2", 3: "IK-PUBCHEM-3"}
+    # one lookup per xref type found, whatever the number of structures
+    assert crosswalk.lookups == [("unii", ["U0", "U1", "U2"]), ("drugbank_accession", ["DB1"]),
+                                 ("chembl", ["CHEMBL3"]), ("pubchem", [3])]
+    assert drugcentral_parser.xref_2_inchikey({}, crosswalk) == {}
+
+
+XREF_FORMATS = {"UNII": "U%d", "DRUGBANK_ID": "DB%d", "ChEMBL_ID": "CHEMBL%d", "ChEBI": "CHEBI:%d",
+                "PUBCHEM_CID": "%d", "KEGG_DRUG": "D%d"}
+
+
+def write_tables(folder, seed=3):
+    rnd = random.Random(seed)
+    struc_ids = list(range(1, NUM_STRUCTS + 1))
+    rnd.shuffle(struc_ids)
+    pick = lambda: rnd.choice(struc_ids)
+
+    def write(filename, rows, delimiter=","):
+        with open(os.path.join(folder, filename), "w", newline="") as fout:
+            writer = csv.writer(fout, delimiter=delimiter)
+            for row in rows:
+                writer.writerow(row)
+
+    def uniprot(num):
+        return "|".join("P%05d" % rnd.randint(0, 99999) for _ in range(num))
+
+    write("pharma_class.csv", [[i, pick(), rnd.choice(["has role", "EPC", "MoA"]), "desc%d" % i, "C%d" % i,
+                                rnd.choice(["CHEBI", "FDA", "MeSH"])] for i in range(500)])
+    write("faers.csv", [[i, pick(), "term%d" % i, 1000 + i, "PT", rnd.random() * 10, 3.2, rnd.randint(0, 99),
+                         rnd.randint(0, 99), rnd.randint(0, 99), rnd.randint(0, 99)] for i in range(1500)])
+    act = []
+    for i in range(1000):
+        num = rnd.randint(1, 3)
+        # some rows have uniprot fields of different lengths (skipped)
+        other = num if rnd.random() < 0.9 else num + 1
+        act.append([i, pick(), i, "target%d" % i, "Enzyme", rnd.choice([uniprot(num), ""]), rnd.choice([uniprot(num), ""]),
+                    uniprot(other), rnd.random(), "", rnd.choice(["IC50", "Ki"]), "", rnd.choice(["CHEMBL", "IUPHAR"]), "=",
+                    rnd.choice([1, ""]), "", "", "", "INHIBITOR", "", "Tclin", "", "", "Homo sapiens"])
+    write("act_table_full.csv", act)
+    write("omop_relationship.csv", [[i, pick(), i, rnd.choice(["Indication", "contraindication", "off-label use"]),
+                                     "c%d" % i, "C%07d" % i, "full%d" % i, "T047", rnd.choice([123456 + i, ""])]
+                                    for i in range(800)])
+    write("approval.csv", [[i, pick(), "2001-01-%02d" % (i % 28 + 1), rnd.choice(["FDA", "EMA"]), rnd.choice(["Co", ""]),
+                            rnd.choice([0, 1])] for i in range(300)])
+    write("drug_dosage.csv", [[i, "A01", rnd.random() * 100, "mg", "O", rnd.choice(["", "c"]), pick()] for i in range(300)])
+    write("synonyms.csv", [[i, pick(), "syn%d" % i, rnd.choice([1, ""]), "", ""] for i in range(1000)])
+    # some structs have no structure, or no InChIKey
+    write("structures.smiles.tsv", [["ID", "SMILES", "InChI", "InChIKey", "INN", "CAS_RN"]] +
+          [[sid, "C" * (sid % 5 + 1), "InChI=%d" % sid, rnd.choice(["IK%d" % sid, ""]), "inn%d" % sid, "%d-0" % sid]
+           for sid in struc_ids[:330]], delimiter="\t")
+    ids = []
+    for i in range(1000):
+        id_type = rnd.choice(list(XREF_FORMATS))
+        ids.append([i, XREF_FORMATS[id_type] % rnd.randint(0, 60), id_type, pick(), ""])
+    write("identifiers.csv", ids)
+
+
+def crosswalk_mapping():
+    mapping = {}
+    for (xref_type, id_type), fmt in zip(drugcentral_parser.XREF_ID_TYPES,
+                                         ["U%d", "DB%d", "CHEMBL%d", "CHEBI:%d", "%d"]):
+        for i in range(0, 61, 3):
+            # pubchem CIDs are read as numbers
+            _id = id_type == "pubchem" and i or fmt % i
+            mapping.setdefault(id_type, {})[_id] = "IK-%s-%d" % (id_type, i)
+    return mapping
+
+
+def reference_table(folder, filename, key, **kwargs):
+    """struct id => records (as dicts), one groupby() per table"""
+    df = pd.read_csv(os.path.join(folder, filename), **kwargs)
+    df = df.astype(object).where((pd.notnull(df)), None)
+    return dict([(strucid, subdf.to_dict(orient="records")) for strucid, subdf in df.groupby(key)])
+
+
+def reference_load_data(folder, crosswalk):
+    tables = {}
+    pharma_class = reference_table(folder, "pharma_class.csv", "struc_id",
+                                   names=['_id', 'struc_id', 'role', 'description', 'code', 'source'])
+    tables["pharmacology_class"] = {}
+    for strucid, records in pharma_class.items():
+        related = defaultdict(list)
+        for rec in records:
+            related[(rec['source'] + '_' + rec['role']).lower().replace("chebi_has role", "chebi")].append(
+                {'description': rec['description'], 'code': rec['code']})
+        tables["pharmacology_class"][strucid] = related
+    faers = reference_table(folder, "faers.csv", "struc_id",
+                            names=['_id', 'struc_id', 'meddra_term', 'meddra_code', 'level', 'llr', 'llr_threshold',
+                                   'drug_ae', 'drug_no_ae', 'no_drug_ae', 'no_drug_no_ar'])
+    tables["fda_adverse_event"] = dict([(strucid, [dict([(k, v) for k, v in rec.items() if k not in ('struc_id', '_id')])
+                                                   for rec in records]) for strucid, records in faers.items()])
+    act = reference_table(folder, "act_table_full.csv", "struct_id",
+                          names=["act_id", "struct_id", "target_id", "target_name", "target_class", "accession", "gene",
+                                 "swissprot", "act_value", "act_unit", "act_type", "act_comment", "act_source", "relation",
+                                 "moa", "moa_source", "act_source_url", "moa_source_url", "action_type", "first_in_class",
+                                 "tdl", "act_ref_id", "moa_ref_id", "organism"])
+    tables["bioactivity"] = {}
+    for strucid, records in act.items():
+        related = []
+        for rec in records:
+            accession, gene, swissprot = [rec[k] and rec[k].split('|') or [None] * 10
+                                          for k in ('accession', 'gene', 'swissprot')]
+            if not len(accession) == len(gene) == len(swissprot):
+                continue
+            summary = {'uniprot': [{'uniprot_id': a, 'gene_symbol': g, 'swissprot_entry': s}
+                                   for a, g, s in zip(accession, gene, swissprot)]}
+            for k, v in rec.items():
+                if k not in drugcentral_parser.ACT_EXCLUDED + ['struct_id', 'accession', 'gene', 'swissprot']:
+                    summary[k] = v
+            related.append(summary)
+        tables["bioactivity"][strucid] = related
+    omop = reference_table(folder, "omop_relationship.csv", "struct_id",
+                           names=['_id', 'struct_id', 'concept_id', 'relationship_name', 'concept_name', 'umls_cui',
+                                  'snomed_full_name', 'cui_semantic_type', 'snomed_conceptid'])
+    tables["drug_use"] = {}
+    for strucid, records in omop.items():
+        related = defaultdict(list)
+        for rec in records:
+            related[rec['relationship_name'].lower()].append(
+                {'umls_cui': rec['umls_cui'], 'concept_name': rec['concept_name'],
+                 'snomed_full_name': rec['snomed_full_name'], 'cui_semantic_type': rec['cui_semantic_type'],
+                 'snomed_concept_id': rec['snomed_conceptid'] and int(rec['snomed_conceptid'])})
+        tables["drug_use"][strucid] = related
+    approval = reference_table(folder, "approval.csv", "struct_id",
+                               names=['_id', 'struct_id', 'date', 'agency', 'company', 'orphan'])
+    tables["approval"] = dict([(strucid, [dict([(k, v) for k, v in rec.items() if k not in ('struct_id', '_id')])
+                                          for rec in records]) for strucid, records in approval.items()])
+    dosage = reference_table(folder, "drug_dosage.csv", "struct_id",
+                             names=['_id', 'atc_code', 'dosage', 'unit', 'route', 'comment', 'struct_id'])
+    tables["drug_dosage"] = dict([(strucid, [dict([(k, v) for k, v in rec.items()
+                                                   if k not in ('struct_id', '_id', 'atc_code', 'comment')])
+                                             for rec in records]) for strucid, records in dosage.items()])
+    synonyms = reference_table(folder, "synonyms.csv", "struct_id",
+                               names=["_id", "struct_id", 'synonym', 'pref', 'parent', 's2'])
+    tables["synonyms"] = dict([(strucid, [rec['synonym'] for rec in records]) for strucid, records in synonyms.items()])
+    structures = reference_table(folder, "structures.smiles.tsv", "ID", sep="\t")
+    tables["structures"] = dict([(strucid, dict([(k.lower(), v) for k, v in records[0].items() if k != 'ID']))
+                                 for strucid, records in structures.items()])
+    identifiers = reference_table(folder, "identifiers.csv", "struct_id",
+                                  names=["_id", "identifier", "id_type", "struct_id", "parent"])
+    tables["xref"] = {}
+    for strucid, records in identifiers.items():
+        related = defaultdict(list)
+        for rec in records:
+            related[rec['id_type'].lower()].append(rec['identifier'])
+        tables["xref"][strucid] = related
+    struc_ids = set()
+    for table in tables.values():
+        struc_ids.update(table)
+    xref_inchikeys = drugcentral_parser.xref_2_inchikey(
+        dict([(strucid, tables["xref"].get(strucid, {})) for strucid in struc_ids
+              if not tables["structures"].get(strucid, {}).get('inchikey')]), crosswalk)
+    for strucid in struc_ids:
+        _id = tables["structures"].get(strucid, {}).get('inchikey') or xref_inchikeys.get(strucid) or \
+                'DrugCentral:' + str(strucid)
+        doc = {'_id': _id, 'drugcentral': dict([(field, table.get(strucid, {})) for field, table in tables.items()])}
+        yield dict_sweep(unlist(doc), [None])
+
+
+def normalize(docs):
+    return sorted([json.dumps(doc, sort_keys=True) for doc in docs])
+
+
+def setup_module():
+    global tmp_dir
+    tmp_dir = tempfile.mkdtemp()
+    write_tables(tmp_dir)
+
+
+def teardown_module():
+    shutil.rmtree(tmp_dir)
+
+
+class FakeSrcDump(object):
+
+    def find_one(self, *args, **kwargs):
+        return {}
+
+
+class FakeJobManager(object):
+    """Run functions sent to processes in threads, once pickled (like ProcessPoolExecutor)"""
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    @asyncio.coroutine
+    def defer_to_process(self, pinfo, func):
+        func = pickle.loads(pickle.dumps(func))
+        yield from asyncio.sleep(0)
+        return self.loop.run_in_executor(None, func)
+
+
+def partition(num_parts):
+    """Run DrugCentralDumper.post_dump() on synthetic tables, as it's run by the hub (in a thread)"""
+    orig = dumper.get_src_dump, DrugCentralDumper.NUM_PARTS
+    dumper.get_src_dump = FakeSrcDump
+    DrugCentralDumper.NUM_PARTS = num_parts
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        dump = DrugCentralDumper(src_root_folder=tmp_dir)
+        dump.new_data_folder = tmp_dir
+        dump.post_dump(job_manager=FakeJobManager(loop))
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+        dumper.get_src_dump, DrugCentralDumper.NUM_PARTS = orig
+    return os.path.join(tmp_dir, DrugCentralDumper.PARTS_FOLDER)
+
+
+def test_load_data():
+    crosswalk = FakeCrosswalk(crosswalk_mapping())
+    expected = normalize(reference_load_data(tmp_dir, crosswalk))
+    assert len(expected) == NUM_STRUCTS
+    # some structures resolved from xrefs, some not resolved at all
+    assert [doc for doc in expected if '"_id": "IK-' in doc] and [doc for doc in expected if "DrugCentral:" in doc]
+    orig = drugcentral_parser.LOOKUP_CHUNK_SIZE
+    try:
+        for num_parts in (1, 3):
+            parts_folder = partition(num_parts)
+            assert sorted(os.listdir(parts_folder)) == [str(part) for part in range(num_parts)]
+            for chunk_size in (7, orig):
+                drugcentral_parser.LOOKUP_CHUNK_SIZE = chunk_size
+                docs = []
+                for part in range(num_parts):
+                    docs.extend(drugcentral_parser.load_data(parts_folder, part, crosswalk=crosswalk))
+                assert normalize(docs) == expected
+    finally:
+        drugcentral_parser.LOOKUP_CHUNK_SIZE = orig
+
+
+def test_partition_table():
+    parts_folder = os.path.join(tmp_dir, "test_parts")
+    try:
+        assert drugcentral_parser.partition_table("synonyms", tmp_dir, parts_folder, 4) == \
+                len(set(row[1] for row in csv.reader(open(os.path.join(tmp_dir, "synonyms.csv")))))
+        for part in range(4):
+            struc_ids = [strucid for strucid, _ in drugcentral_parser.read_part(
+                drugcentral_parser.get_part_file(parts_folder, part, "synonyms"))]
+            # sorted, unique, in their part
+            assert struc_ids == sorted(set(struc_ids)) and set(strucid % 4 for strucid in struc_ids) == {part}
+    finally:
+        shutil.rmtree(parts_folder, ignore_errors=True)
@@ -0,0 +1,189 @@
+"""
+Tests for NDC parser, on synthetic product/package files and drugbank
+collection: documents must be the same as the ones from the former
+implementation (packages and InChIKeys kept in dicts, one drugbank query
+per product), reproduced in reference_load_data().
+
+    nosetests tests/test_ndc_parser.py  (or: pytest tests/test_ndc_parser.py)
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+from hub.dataload.sources.ndc import ndc_parser
+
+NUM_PRODUCTS = 60
+
+
+def get_path(doc, path):
+    values = [doc]
+    for key in path.split("."):
+        found = []
+        for value in values:
+            for val in (isinstance(value, list) and value or [value]):
+                if isinstance(val, dict) and key in val:
+                    found.extend(isinstance(val[key], list) and val[key] or [val[key]])
+        values = found
+    return values
+
+
+class FakeCollection(object):
+    """Minimal drugbank collection: equality queries on (dotted) fields, in insertion order"""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query=None, projection=None):
+        for doc in self.docs:
+            if all([cond == {"$exists": True} and get_path(doc, key) or cond in get_path(doc, key)
+                    for key, cond in (query or {}).items()]):
+                yield doc
+
+    def find_one(self, query):
+        return next(self.find(query), None)
+
+
+def write_files(folder, seed=42):
+    rnd = random.Random(seed)
+    products, packages = [], []
+    for i in range(NUM_PRODUCTS):
+        # a few products share their productndc
+        ndc = "%04d-%03d" % (i % 50, i % 7)
+        products.append(["PID%03d" % i, ndc, "Drug %d" % i, i % 3 and "generic %d" % i or ""])
+        for j in range(rnd.randint(0, 3)):
+            packages.append(["PID%03d" % i, ndc, "%s-%02d" % (ndc, j), "%d tablets in 1 bottle" % (j + 10)])
+    # packages of unknown products are ignored
+    packages.append(["PID999", "9999-999", "9999-999-01", "1 bottle"])
+    rnd.shuffle(products)
+    rnd.shuffle(packages)
+    with open(os.path.join(folder, "product.txt"), "w", encoding="latin1") as fout:
+        fout.write("PRODUCTID\tPRODUCTNDC\tPROPRIETARYNAME\tNONPROPRIETARYNAME\n")
+        for row in products:
+            fout.write("\t".join(row) + "\n")
+    with open(os.path.join(folder, "package.txt"), "w", encoding="latin1") as fout:
+        fout.write("PRODUCTID\tPRODUCTNDC\tNDCPACKAGECODE\tPACKAGEDESCRIPTION\n")
+        for row in packages:
+            fout.write("\t".join(row) + "\n")
+
+
+def drugbank_docs():
+    ik = lambda i: "%014d-UHFFFAOYSA-N" % i
+    return [
+        {"_id": ik(1), "drugbank": {"inchi_key": ik(1), "products": [{"ndc_product_code": "0001-001"},
+                                                                     {"ndc_product_code": "0002-002"}]}},
+        # same product code as above, found later: ignored
+        {"_id": ik(2), "drugbank": {"inchi_key": ik(2), "products": [{"ndc_product_code": "0001-001"},
+                                                                     {"ndc_product_code": "0003-003"}]}},
+        # single product, as a dict
+        {"_id": ik(3), "drugbank": {"inchi_key": ik(3), "products": {"ndc_product_code": "0004-004"}}},
+        # no InChIKey: its products aren't resolved, even if found later
+        {"_id": "DB4", "drugbank": {"products": [{"ndc_product_code": "0005-005"}]}},
+        {"_id": ik(5), "drugbank": {"inchi_key": ik(5), "products": [{"ndc_product_code": "0005-005"},
+                                                                     {"ndc_product_code": "0043-001"}]}},
+        # several products sharing the InChIKey of the first drug
+        {"_id": "DB6", "drugbank": {"inchi_key": ik(1), "products": [{"ndc_product_code": "0008-001"},
+                                                                     {"ndc_product_code": "0015-001"}]}},
+        ]
+
+
+def reference_load_data(data_folder, drugbank_col):
+    package_ndc = {}
+    inchi_key = {}
+    for doc in ndc_parser.load_packages(os.path.join(data_folder, "package.txt")):
+        package_ndc.setdefault(doc["_id"], []).append(doc["ndc"])
+    for doc in ndc_parser.load_products(os.path.join(data_folder, "product.txt")):
+        packages = package_ndc.get(doc["_id"], [])
+        if packages:
+            doc["ndc"]["package"] = []
+            for pack in packages:
+                pack.pop("product_id", None)
+                pack.pop("productndc", None)
+                doc["ndc"]["package"].append(pack)
+            if len(doc["ndc"]["package"]) == 1:
+                doc["ndc"]["package"] = doc["ndc"]["package"].pop()
+        d = drugbank_col.find_one({"drugbank.products.ndc_product_code": doc["ndc"]["productndc"]})
+        ik = d and d["drugbank"].get("inchi_key")
+        if ik:
+            inchi_key.setdefault(ik, []).append(doc["ndc"])
+        else:
+            yield doc
+    for ik, ndclist in inchi_key.items():
+        if len(ndclist) == 1:
+            ndclist = ndclist.pop()
+        yield {"_id": ik, "ndc": ndclist}
+
+
+def normalize(docs):
+    """Documents sorted by _id, NDC entries of grouped ones by product id (order isn't relevant)"""
+    res = []
+    for doc in docs:
+        if isinstance(doc["ndc"], list):
+            doc["ndc"] = sorted(doc["ndc"], key=lambda ndc: ndc["product_id"])
+        res.append(json.dumps(doc, sort_keys=True))
+    return sorted(res)
+
+
+def setup_module():
+    global tmp_dir, drugbank_col
+    tmp_dir = tempfile.mkdtemp()
+    write_files(tmp_dir)
+    drugbank_col = FakeCollection(drugbank_docs())
+
+
+def teardown_module():
+    shutil.rmtree(tmp_dir)
+
+
+def test_inchikey_map():
+    ik = lambda i: "%014d-UHFFFAOYSA-N" % i
+    ndc_inchikeys = ndc_parser.build_inchikey_map(drugbank_col)
+    assert ndc_inchikeys == {"0001-001": ik(1), "0002-002": ik(1), "0003-003": ik(2), "0004-004": ik(3),
+                             "0005-005": None, "0043-001": ik(5), "0008-001": ik(1), "0015-001": ik(1)}
+    # same as querying drugbank for each product
+    for code, inchikey in ndc_inchikeys.items():
+        d = drugbank_col.find_one({"drugbank.products.ndc_product_code": code})
+        assert d["drugbank"].get("inchi_key") == inchikey
+    assert ndc_parser.build_inchikey_map(None) == {}
+
+
+def test_load_data():
+    expected = normalize(reference_load_data(tmp_dir, drugbank_col))
+    assert normalize(ndc_parser.load_data(tmp_dir, drugbank_col)) == expected
+    # map given by caller (ie. from the crosswalk)
+    ndc_inchikeys = ndc_parser.build_inchikey_map(drugbank_col)
+    assert normalize(ndc_parser.load_data(tmp_dir, ndc_inchikeys=ndc_inchikeys)) == expected
+    # grouped by InChIKey, with or without packages
+    grouped = [json.loads(doc) for doc in expected if json.loads(doc)["_id"].endswith("-N")]
+    assert len(grouped) == 4 and [doc for doc in grouped if isinstance(doc["ndc"], list)]
+
+
+def test_external_sort():
+    rnd = random.Random(0)
+    docs = [{"_id": rnd.randint(0, 20), "num": i} for i in range(100)]
+    for chunk_size in (1, 7, 100, 1000):
+        res = list(ndc_parser.external_sort(iter(docs), lambda doc: doc["_id"], chunk_size))
+        # stable, like sorted()
+        assert res == sorted(docs, key=lambda doc: doc["_id"])
+
+
+def test_load_data_chunks():
+    expected = normalize(reference_load_data(tmp_dir, drugbank_col))
+    ndc_inchikeys = ndc_parser.build_inchikey_map(drugbank_col)
+    for chunk_size in (1, 2, 7, NUM_PRODUCTS, 10000):
+        docs = list(ndc_parser.load_data(tmp_dir, chunk_size=chunk_size, ndc_inchikeys=ndc_inchikeys))
+        # products without InChIKey, in productndc order, then grouped ones, in InChIKey order
+        products = [doc for doc in docs if not doc["_id"].endswith("-N")]
+        grouped = docs[len(products):]
+        assert [doc["_id"] for doc in products] == sorted([doc["_id"] for doc in products])
+        assert [doc["_id"] for doc in grouped] == sorted([doc["_id"] for doc in grouped])
+        for doc in grouped:
+            if isinstance(doc["ndc"], list):
+                assert [ndc["productndc"] for ndc in doc["ndc"]] == sorted([ndc["productndc"] for ndc in doc["ndc"]])
+        assert normalize(docs) == expected
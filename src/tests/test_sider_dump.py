@@ -0,0 +1,85 @@
+"""
+Tests for SIDER files merging (see SiderDumper.post_dump()): merging files
+split in buckets must give the same rows as merging whole files.
+
+    nosetests tests/test_sider_dump.py  (or: pytest tests/test_sider_dump.py)
+"""
+import os
+import sys
+import shutil
+import random
+import tempfile
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+import pandas as pd
+
+from hub.dataload.sources.sider.sider_dump import partition, merge_bucket
+
+NUM_DRUGS = 50
+NUM_BUCKETS = 8
+
+
+def generate_files(folder):
+    """Write meddra_freq/all_se/all_indications TSV files, sharing ids and side effects"""
+    rnd = random.Random(42)
+    freq, all_se, indications = [], [], []
+    for i in range(NUM_DRUGS):
+        flat = "CID1%08d" % (i * 37)
+        stereo = "CID0%08d" % (i * 37)
+        for j in rnd.sample(range(20), 4):
+            label = "C%07d" % (i * 100 + j)
+            meddra = "C%07d" % j
+            row = [flat, stereo, label, "PT", meddra, "side effect %d" % j]
+            all_se.append(row)
+            if j % 2:
+                # some frequencies are numbers, some aren't
+                lower = j % 3 and "0.%02d" % j or "postmarketing"
+                freq.append([flat, stereo, label, j % 4 == 1 and "placebo" or "", "",
+                             lower, j % 3 and "0.%02d" % (j + 1) or "", "PT", meddra, "side effect %d" % j])
+            if j % 3 == 0:
+                indications.append([flat, label, "text_mention", "indication %d" % j, "PT", meddra,
+                                    "indication %d" % j])
+    files = []
+    for name, rows in (("meddra_freq.tsv", freq), ("meddra_all_se.tsv", all_se),
+                       ("meddra_all_indications.tsv", indications)):
+        rnd.shuffle(rows)
+        path = os.path.join(folder, name)
+        with open(path, "w") as fout:
+            for row in rows:
+                fout.write("\t".join(row) + "\n")
+        files.append(path)
+    return files
+
+
+def read_merged(path):
+    # first column is the (per-bucket) index, ignored
+    df = pd.read_csv(path, header=None, dtype=str, keep_default_na=False)
+    return sorted([tuple(row[1:]) for row in df.itertuples(index=False)])
+
+
+def test_buckets_merge():
+    folder = tempfile.mkdtemp()
+    try:
+        input_files = generate_files(folder)
+        whole = os.path.join(folder, "whole.csv")
+        columns = merge_bucket(*(input_files + [whole]))
+        buckets = [[os.path.join(folder, "%s.%s.tsv" % (i, name)) for name in ("freq", "all_se", "indications")] +
+                   [os.path.join(folder, "%s.merged.csv" % i)] for i in range(NUM_BUCKETS)]
+        for pos, input_file in enumerate(input_files):
+            partition(input_file, [bucket[pos] for bucket in buckets])
+        merged = os.path.join(folder, "merged.csv")
+        with open(merged, "w") as fout:
+            for bucket in buckets:
+                assert merge_bucket(*bucket) == columns
+                with open(bucket[-1]) as fin:
+                    shutil.copyfileobj(fin, fout)
+        assert read_merged(merged) == read_merged(whole)
+        # each STITCH id is found in one bucket only
+        ids = [set(pd.read_csv(bucket[-1], header=None, dtype=str)[1]) for bucket in buckets
+               if os.path.getsize(bucket[-1])]
+        assert sum(len(i) for i in ids) == len(set.union(*ids)) == NUM_DRUGS
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,128 @@
+"""
+Tests for SIDER parser, on a synthetic merged file: STITCH ids resolved by
+blocks from the crosswalk must give the same documents as resolving them one
+by one (as the former implementation did, querying pubchem collection), once
+documents sharing an InChIKey are merged (as MergerStorage does).
+
+    nosetests tests/test_sider_parser.py  (or: pytest tests/test_sider_parser.py)
+"""
+import os
+import sys
+import csv
+import json
+import random
+import shutil
+import logging
+import tempfile
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+from hub.dataload.sources.sider import sider_parser
+
+NUM_IDS = 200
+
+
+class FakeCrosswalk(object):
+    """PubChem CIDs => InChIKey, ids stored as strings like in the crosswalk"""
+
+    def __init__(self, mapping):
+        self.mapping = dict([(str(cid), ik) for cid, ik in mapping.items()])
+        self.lookups = 0
+
+    def lookup(self, id_type, ids):
+        assert id_type == "pubchem"
+        self.lookups += 1
+        return dict([(_id, [self.mapping[str(_id)]]) for _id in ids if str(_id) in self.mapping])
+
+
+def write_file(path, seed=42):
+    rnd = random.Random(seed)
+    with open(path, "w") as fout:
+        writer = csv.writer(fout)
+        writer.writerow([""] + ["col%d" % i for i in range(13)])
+        num = 0
+        for cid in range(NUM_IDS):
+            for k in range(rnd.randint(1, 3)):
+                writer.writerow([num, "CID1%08d" % cid, "CID0%08d" % cid, "C%d" % k, rnd.choice(["", "placebo"]),
+                                 "%.2f" % rnd.random(), "", "", "PT", "C%07d" % k, "side effect %d" % k, "",
+                                 "indication %d" % cid])
+                num += 1
+
+
+def pubchem_inchikeys():
+    ik = lambda i: "%014d-UHFFFAOYSA-N" % i
+    # unresolved CIDs (multiple of 5), pairs of CIDs sharing an InChIKey,
+    # and one STITCH id found as is
+    mapping = dict([(cid, ik(cid // 2)) for cid in range(NUM_IDS) if cid % 5])
+    mapping["CID100000007"] = ik(1000)
+    return mapping
+
+
+def reference_load_data(_file, mapping):
+    for doc in sider_parser.iter_docs(_file):
+        cid = sider_parser.stitch_to_cid(doc["_id"])
+        doc["_id"] = mapping.get(doc["_id"]) or mapping.get(cid) or doc["_id"]
+        yield doc
+
+
+def normalize(docs):
+    """Merge docs by _id (as MergerStorage does), order isn't relevant"""
+    merged = {}
+    for doc in docs:
+        merged.setdefault(doc["_id"], []).extend(doc["sider"])
+    return dict([(_id, sorted([json.dumps(d, sort_keys=True) for d in sider]))
+                 for _id, sider in merged.items()])
+
+
+def setup_module():
+    global tmp_dir, sider_file
+    tmp_dir = tempfile.mkdtemp()
+    sider_file = os.path.join(tmp_dir, "merged_freq_all_se_indications.tsv")
+    write_file(sider_file)
+
+
+def teardown_module():
+    shutil.rmtree(tmp_dir)
+
+
+def test_load_data():
+    mapping = pubchem_inchikeys()
+    expected = normalize(reference_load_data(sider_file, mapping))
+    assert "00000000001000-UHFFFAOYSA-N" in expected and "CID100000005" in expected
+    orig = sider_parser.LOOKUP_CHUNK_SIZE
+    try:
+        # shared InChIKeys within a block, and spanning blocks
+        for chunk_size in (1, 7, NUM_IDS):
+            sider_parser.LOOKUP_CHUNK_SIZE = chunk_size
+            crosswalk = FakeCrosswalk(mapping)
+            docs = list(sider_parser.load_data(sider_file, crosswalk))
+            assert normalize(docs) == expected
+            assert crosswalk.lookups == (NUM_IDS + chunk_size - 1) // chunk_size
+            if chunk_size == NUM_IDS:
+                # all in one block, nothing left to merge when storing
+                assert len(docs) == len(expected)
+    finally:
+        sider_parser.LOOKUP_CHUNK_SIZE = orig
+
+
+def test_unresolved():
+    messages = []
+    handler = logging.Handler()
+    handler.emit = lambda record: messages.append(record.getMessage())
+    logger = logging.getLogger()
+    level = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        docs = list(sider_parser.load_data(sider_file, FakeCrosswalk(pubchem_inchikeys())))
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+    unresolved = [doc["_id"] for doc in docs if doc["_id"].startswith("CID")]
+    assert len(unresolved) == NUM_IDS // 5
+    assert "%s/%s STITCH ids couldn't be converted to InChIKeys (kept as _id)" % (NUM_IDS // 5, NUM_IDS) in messages
+    # no crosswalk, ids kept as is
+    assert [doc["_id"] for doc in sider_parser.load_data(sider_file)] == \
+            ["CID1%08d" % cid for cid in range(NUM_IDS)]
@@ -0,0 +1,106 @@
+"""
+Tests for UNII parser, on a synthetic Records file: documents must be the
+same as the ones from the former implementation (whole file in a DataFrame,
+one query per duplicated _id), reproduced in reference_load_data().
+
+    nosetests tests/test_unii_parser.py  (or: pytest tests/test_unii_parser.py)
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+
+src_path = os.path.split(os.path.split(os.path.abspath(__file__))[0])[0]
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+import pandas as pd
+
+from hub.dataload.sources.unii import unii_parser
+
+NUM_RECORDS = 300
+COLUMNS = ["UNII", "PT", "RN", "EC", "NCIT", "RXCUI", "ITIS", "NCBI", "PLANTS", "GRIN", "MPNS", "INN_ID",
+           "MF", "INCHIKEY", "SMILES", "UNII_TYPE"]
+# rows sharing an InChIKey: far from each other, next to each other, and
+# on each side of row 100 (chunk boundary when reading 100 rows at once)
+SHARED = {"IKSHARED-A": [5, 150, 290], "IKSHARED-B": [20, 21], "IKSHARED-C": [99, 100]}
+
+
+def write_file(path, seed=7):
+    rnd = random.Random(seed)
+    shared = dict([(row, ik) for ik, rows in SHARED.items() for row in rows])
+    with open(path, "w") as fout:
+        fout.write("\t".join(COLUMNS) + "\n")
+        for i in range(NUM_RECORDS):
+            row = dict([(col, "") for col in COLUMNS])
+            row["UNII"] = "U%08d" % i
+            row["PT"] = "term %d" % i
+            row["UNII_TYPE"] = "INGREDIENT SUBSTANCE"
+            if rnd.random() < .3:
+                row["RN"] = "%d-00" % i
+            if rnd.random() < .2:
+                row["NCIT"] = "C%d" % i
+            # row 1 has no InChIKey, its UNII is found again below
+            if rnd.random() < .5 and i != 1:
+                row["INCHIKEY"] = "IK%06d-AAA" % i
+                row["MF"] = "C%dH" % i
+            row["INCHIKEY"] = shared.get(i, row["INCHIKEY"])
+            fout.write("\t".join([row[col] for col in COLUMNS]) + "\n")
+        # same UNII found twice, without InChIKey
+        fout.write("\t".join(["U00000001", "term 1 again"] + [""] * (len(COLUMNS) - 3) + ["INGREDIENT SUBSTANCE"]) + "\n")
+
+
+def reference_load_data(input_file):
+    unii = pd.read_csv(input_file, sep='\t', dtype=str)
+    unii.rename(columns={'MF': 'molecular_formula', 'PT': 'preferred_term', 'RN': 'registry_number'}, inplace=True)
+    unii.columns = unii.columns.str.lower()
+    unii['_id'] = unii.inchikey.fillna(unii.unii)
+    dupes = set(unii._id) - set(unii._id.drop_duplicates(keep=False))
+    records = [dict([(k, v) for k, v in record.items() if pd.notnull(v) and k != '_id'])
+               for record in unii.to_dict("records")]
+    for _id, record in zip(unii._id, records):
+        if _id not in dupes:
+            yield {'_id': _id, 'unii': record}
+    for dupe in dupes:
+        yield {'_id': dupe, 'unii': [record for _id, record in zip(unii._id, records) if _id == dupe]}
+
+
+def normalize(docs):
+    return sorted([json.dumps(doc, sort_keys=True) for doc in docs])
+
+
+def setup_module():
+    global tmp_dir, input_file
+    tmp_dir = tempfile.mkdtemp()
+    input_file = os.path.join(tmp_dir, "UNII_Records.txt")
+    write_file(input_file)
+
+
+def teardown_module():
+    shutil.rmtree(tmp_dir)
+
+
+def test_load_data():
+    expected = normalize(reference_load_data(input_file))
+    docs = list(unii_parser.load_data(input_file))
+    assert normalize(docs) == expected
+    # _ids are unique, records of duplicated ones are grouped in file order
+    assert len(docs) == len(set(doc["_id"] for doc in docs)) == NUM_RECORDS - 4
+    grouped = dict([(doc["_id"], doc["unii"]) for doc in docs if isinstance(doc["unii"], list)])
+    assert sorted(grouped) == sorted(list(SHARED) + ["U00000001"])
+    for ik, rows in SHARED.items():
+        assert [record["unii"] for record in grouped[ik]] == ["U%08d" % row for row in rows]
+
+
+def test_find_dupes():
+    assert unii_parser.find_dupes(input_file) == set(list(SHARED) + ["U00000001"])
+
+
+def test_load_data_chunks():
+    expected = normalize(reference_load_data(input_file))
+    # one row at a time, duplicates within a chunk and spanning chunks
+    # (IKSHARED-C rows on each side of a 100 rows boundary), whole file
+    for chunk_size in (1, 7, 100, NUM_RECORDS + 1):
+        assert normalize(unii_parser.load_data(input_file, chunk_size=chunk_size)) == expected